@@ -1,45 +1,95 @@
 import streamlit as st
-import openai
-import base64
+import atexit
 import os
 import urllib.parse
-import re
-
-
-# 背景画像の設定
-def set_bg(png_file):
-    with open(png_file, "rb") as f:
-        data = f.read()
-    b64 = base64.b64encode(data).decode()
-    css = f"""
-    <style>
-    .stApp {{
-        background-image: url('data:image/png;base64,{b64}');
-        background-size: cover;
-        background-repeat: no-repeat;
-        background-attachment: fixed;
-    }}
-    .stApp h1, .stApp h2, .stApp h3, .stApp h4, .stApp h5, .stApp h6, .stApp p, .stApp label, .stApp span {{
-        color: #1a237e !important;
-        background: #fff !important;
-        border-radius: 8px;
-        padding: 0.2em 0.5em;
-        display: inline-block;  /* ←ここをinline-blockからinlineに変更 */
-    }}
-    /* st.markdownで出力される材料リストなどにも背景色を適用 */
-    .stApp ul, .stApp ol, .stApp li, .stApp pre, .stApp code {{
-        background: #fff !important;
-        color: #1a237e !important;
-        border-radius: 8px;
-        padding: 0.2em 0.5em;
-        display: inline-block;
-    }}
-    </style>
-    """
-    st.markdown(css, unsafe_allow_html=True)
+import time
+
+from background_asset import build_background_url
+from ingredients import extract_ingredients as _extract_ingredients, parse_ingredient_line, remember_ingredients
+from llm_fanout import fan_out
+from llm_gateway import LLMGateway, UpstreamUnavailable
+from meal_plan import WEEKDAYS, aggregate_shopping_list, build_day_prompts
+from metrics import METRICS
+from prompt_builder import DEFAULT_OUTPUT_BUDGETS, build_user_prompt, request_messages, section_instruction
+from nutrition import default_grams, load_nutrition_table
+from prices import load_price_catalog
+from recipe_corpus import RecipeCorpus, ingredient_query
+from recipe_schema import RESPONSE_FORMAT, parse_recipe, recipe_ingredients, recipe_to_text
+from response_cache import ResponseCache, make_cache_key
+from semantic_cache import SemanticCache, make_bucket
+from shop_links import build_links
+from conversation import build_messages, estimate_tokens
+from favorites_store import FavoritesStore, SharedFavoritesStore, recipe_id
+from startup import start_warm_up, timed_import
+from state_backend import BackendError, MemoryBackend, SQLiteBackend, open_backend
+from table_render import Table, excel_available, to_csv_bytes, to_excel_bytes
+from theme import build_stylesheet, link_button, summary_card
+from usage_ledger import UsageLedger
+
+# 再実行1回分の所要時間を計測する
+rerun_started_at = time.perf_counter()
+METRICS.increment("reruns_total")
+
+# 材料抽出の所要時間も計測する
+extract_ingredients = METRICS.timed("extract_ingredients")(_extract_ingredients)
+
+# 管理用ページの権限確認（secrets に ADMIN_TOKEN があれば &token=... が必要）
+def check_admin_token():
+    admin_token = st.secrets.get("ADMIN_TOKEN")
+    if admin_token and st.query_params.get("token") != admin_token:
+        st.error("権限がありません")
+        st.stop()
+
+
+# 管理用ページ: ?admin=metrics で計測値をPrometheusのテキスト形式で表示する
+if st.query_params.get("admin") == "metrics":
+    check_admin_token()
+    st.code(METRICS.render_prometheus(), language="text")
+    st.stop()
+
+
+# 背景画像の変換設定（環境変数で変更可能）
+BG_IMAGE_FORMAT = os.environ.get("BG_IMAGE_FORMAT", "WEBP")
+BG_IMAGE_QUALITY = int(os.environ.get("BG_IMAGE_QUALITY", "80"))
+BG_IMAGE_MAX_WIDTH = int(os.environ.get("BG_IMAGE_MAX_WIDTH", "1920"))
+
+
+# 背景画像の変換はプロセスごとに1回だけ（画像の更新時刻が変わったら作り直す）
+@st.cache_resource(show_spinner=False)
+def get_background_url(png_file, mtime, image_format, quality, max_width, static_serving):
+    return build_background_url(png_file, image_format, quality, max_width, static_serving)
+
+
+# 背景画像・各部品のスタイルを1つにまとめたスタイルシート（プロセスごとに1回だけ作る）
+@st.cache_resource(show_spinner=False)
+def get_stylesheet(bg_url):
+    return build_stylesheet(bg_url)
+
+
+# テーマの適用（全体の再実行ごとに小さな <style> を1つだけ送る。フラグメントの再実行では送らない）
+# st.html はスタイルだけの内容を画面の外（イベント用のコンテナ）に置くので、余白もできない
+def inject_theme(png_file):
+    bg_url = get_background_url(
+        png_file,
+        os.path.getmtime(png_file),
+        BG_IMAGE_FORMAT,
+        BG_IMAGE_QUALITY,
+        BG_IMAGE_MAX_WIDTH,
+        bool(st.get_option("server.enableStaticServing")),
+    )
+    st.html(get_stylesheet(bg_url))
+
+
+# Gmailの作成画面を開くボタン（回答は先頭1000文字まで）
+def gmail_button(answer):
+    subject = "料理の材料と作り方"
+    body = urllib.parse.quote(answer[:1000])
+    gmail_link = f"https://mail.google.com/mail/?view=cm&fs=1&to=&su={urllib.parse.quote(subject)}&body={body}"
+    st.markdown(link_button(gmail_link, "📧 Gmailで送る"), unsafe_allow_html=True)
 
 # 画像ファイル名（同じディレクトリに保存しておく）
-set_bg("background.png")
+with METRICS.timer("inject_css"):
+    inject_theme("background.png")
 
 # タイトルとGmailボタンを横並びに表示
 title_col, mail_col = st.columns([5, 1])
@@ -51,27 +101,7 @@ with title_col:
 with mail_col:
     # 直近のAI回答（answer）があればGmailボタンを表示
     if answer:
-        subject = "料理の材料と作り方"
-        short_answer = answer[:1000]
-        body = urllib.parse.quote(short_answer)
-        gmail_link = f"https://mail.google.com/mail/?view=cm&fs=1&to=&su={urllib.parse.quote(subject)}&body={body}"
-        st.markdown(
-            f'''
-            <a href="{gmail_link}" target="_blank" style="
-                display:inline-block;
-                padding:8px 16px;
-                font-size:16px;
-                background:#1976d2;
-                color:#fff;
-                border:none;
-                border-radius:6px;
-                text-decoration:none;
-                font-weight:bold;
-                margin-top:24px;
-            ">📧 Gmailで送る</a>
-            ''',
-            unsafe_allow_html=True
-        )
+        gmail_button(answer)
 
 # ここでスペースを追加
 st.markdown("<br>", unsafe_allow_html=True)
@@ -84,14 +114,932 @@ endpoint = st.secrets["AZURE_OPENAI_ENDPOINT"]
 deployment_name = st.secrets["AZURE_OPENAI_DEPLOYMENT"]
 api_version = "2024-02-15-preview"
 
-# openai v1.0.0以降の新方式（グローバルで初期化）
-client = openai.OpenAI(
-    api_key=api_key,
-    base_url=f"{endpoint}/openai/deployments/{deployment_name}",
-    default_headers={"api-key": api_key}
+# 接続プール・タイムアウト・同時実行数の設定（環境変数で変更可能）
+LLM_MAX_CONNECTIONS = int(os.environ.get("LLM_MAX_CONNECTIONS", "20"))
+LLM_MAX_KEEPALIVE = int(os.environ.get("LLM_MAX_KEEPALIVE", "10"))
+LLM_KEEPALIVE_EXPIRY = float(os.environ.get("LLM_KEEPALIVE_EXPIRY", "120"))
+LLM_CONNECT_TIMEOUT = float(os.environ.get("LLM_CONNECT_TIMEOUT", "5"))
+LLM_READ_TIMEOUT = float(os.environ.get("LLM_READ_TIMEOUT", "60"))
+LLM_MAX_CONCURRENCY = int(os.environ.get("LLM_MAX_CONCURRENCY", "8"))
+# Azureのデプロイのクォータ（1分あたりのリクエスト数・トークン数）に合わせて設定する
+LLM_REQUESTS_PER_MINUTE = int(os.environ.get("LLM_REQUESTS_PER_MINUTE", "60"))
+LLM_TOKENS_PER_MINUTE = int(os.environ.get("LLM_TOKENS_PER_MINUTE", "60000"))
+LLM_MAX_RETRIES = int(os.environ.get("LLM_MAX_RETRIES", "3"))
+# 混雑待ちの上限（秒）。超える場合は待たずにキャッシュの回答などで対応する
+LLM_QUEUE_TIMEOUT = float(os.environ.get("LLM_QUEUE_TIMEOUT", "20"))
+# 連続でこの回数失敗したら、LLM_BREAKER_RESET 秒のあいだAIを呼ばない
+LLM_BREAKER_FAILURES = int(os.environ.get("LLM_BREAKER_FAILURES", "5"))
+LLM_BREAKER_RESET = float(os.environ.get("LLM_BREAKER_RESET", "30"))
+# レート制限で見積もる1回あたりの回答のトークン数
+LLM_EXPECTED_COMPLETION_TOKENS = int(os.environ.get("LLM_EXPECTED_COMPLETION_TOKENS", "1000"))
+# 混雑時に代わりに表示する回答の、質問の類似度の下限
+FALLBACK_SIMILARITY = float(os.environ.get("FALLBACK_SIMILARITY", "0.6"))
+# 追加の要望を送るときの会話履歴のトークン上限（超えた分は古いやり取りから要約に置き換える）
+CHAT_TOKEN_BUDGET = int(os.environ.get("CHAT_TOKEN_BUDGET", "3000"))
+# モードごとの回答の長さの上限（max_tokens）。LLM_MAX_TOKENS_ANSWER・LLM_MAX_TOKENS_COMPARE などで変更する
+LLM_OUTPUT_BUDGETS = {
+    mode: int(os.environ.get(f"LLM_MAX_TOKENS_{mode.upper()}", tokens)) for mode, tokens in DEFAULT_OUTPUT_BUDGETS.items()
+}
+# 概算費用の単価（100万トークンあたりの円。既定は gpt-4o-mini を1ドル150円で換算した目安）
+LLM_YEN_PER_1M_PROMPT_TOKENS = float(os.environ.get("LLM_YEN_PER_1M_PROMPT_TOKENS", "22.5"))
+LLM_YEN_PER_1M_COMPLETION_TOKENS = float(os.environ.get("LLM_YEN_PER_1M_COMPLETION_TOKENS", "90"))
+# ストリーミングでも最後に usage を返してもらう（stream_options。Azure では 2024-09-01-preview 以降のAPIバージョンが必要）
+# 無効のときのストリーミングの利用量は文字数から見積もる
+LLM_STREAM_USAGE = os.environ.get("LLM_STREAM_USAGE", "") == "1"
+
+
+# 接続プールの設定は openai が使っている HTTP ライブラリの型で作る
+# （openai のメジャーバージョンによって httpx / httpx2 と変わるため、httpx を直接 import しない）
+def llm_pool_limits():
+    openai = timed_import("openai")
+    limits_type = type(openai._constants.DEFAULT_CONNECTION_LIMITS)
+    return limits_type(
+        max_connections=LLM_MAX_CONNECTIONS,
+        max_keepalive_connections=LLM_MAX_KEEPALIVE,
+        keepalive_expiry=LLM_KEEPALIVE_EXPIRY,
+    )
+
+
+# openai v1.0.0以降の新方式
+# 再実行のたびに作り直さないよう、接続先ごとにプロセスで1つだけ作って全セッションで共有する
+@st.cache_resource(show_spinner=False)
+def get_client(endpoint, deployment_name, api_key):
+    openai = timed_import("openai")
+    http_client = openai.DefaultHttpxClient(
+        limits=llm_pool_limits(),
+        timeout=openai.Timeout(LLM_READ_TIMEOUT, connect=LLM_CONNECT_TIMEOUT),
+    )
+    return openai.OpenAI(
+        api_key=api_key,
+        base_url=f"{endpoint}/openai/deployments/{deployment_name}",
+        default_headers={"api-key": api_key},
+        http_client=http_client,
+        max_retries=0,  # リトライは LLMGateway で行う
+    )
+
+
+# AIへのリクエストの入口（同時実行数・レート制限・リトライ・同じ質問のまとめを全セッション共通で行う）
+@st.cache_resource(show_spinner=False)
+def get_llm_gateway(_client, endpoint, deployment_name):
+    # 共有バックエンドがあれば、1分あたりの上限は全ワーカーの合計で数える
+    requests_bucket = tokens_bucket = None
+    if state_backend is not None:
+        requests_bucket = state_backend.rate_limiter(f"requests:{deployment_name}", LLM_REQUESTS_PER_MINUTE)
+        tokens_bucket = state_backend.rate_limiter(f"tokens:{deployment_name}", LLM_TOKENS_PER_MINUTE)
+    return LLMGateway(
+        _client,
+        requests_per_minute=LLM_REQUESTS_PER_MINUTE,
+        tokens_per_minute=LLM_TOKENS_PER_MINUTE,
+        max_concurrency=LLM_MAX_CONCURRENCY,
+        max_retries=LLM_MAX_RETRIES,
+        queue_timeout=LLM_QUEUE_TIMEOUT,
+        flight_timeout=LLM_QUEUE_TIMEOUT + LLM_READ_TIMEOUT,
+        failure_threshold=LLM_BREAKER_FAILURES,
+        reset_seconds=LLM_BREAKER_RESET,
+        on_usage=METRICS.record_usage,
+        on_event=lambda name: METRICS.increment(f"llm_gateway_{name}_total"),
+        requests_bucket=requests_bucket,
+        tokens_bucket=tokens_bucket,
+    )
+
+
+# レート制限で使うトークン数の見積もり（プロンプト + 回答。回答は max_tokens があればそれを上限とする）
+def estimate_request_tokens(messages, max_tokens=None):
+    return sum(estimate_tokens(message["content"]) for message in messages) + (max_tokens or LLM_EXPECTED_COMPLETION_TOKENS)
+
+
+# モードごとのリクエストの共通の引数（回答の長さの上限・ストリーミングの usage）
+def generation_options(mode, stream=False):
+    options = {"max_tokens": LLM_OUTPUT_BUDGETS[mode]}
+    if stream and LLM_STREAM_USAGE:
+        options["stream_options"] = {"include_usage": True}
+    return options
+
+
+# 非同期クライアント（メニュー比較で同時に問い合わせる用）
+# 接続プールがイベントループに紐づくため、比較1回ごとに作って使い終わったら閉じる
+def make_async_client():
+    openai = timed_import("openai")
+    return openai.AsyncOpenAI(
+        api_key=api_key,
+        base_url=f"{endpoint}/openai/deployments/{deployment_name}",
+        default_headers={"api-key": api_key},
+        http_client=openai.DefaultAsyncHttpxClient(
+            limits=llm_pool_limits(),
+            timeout=openai.Timeout(LLM_READ_TIMEOUT, connect=LLM_CONNECT_TIMEOUT),
+        ),
+    )
+
+
+# AIのクライアントは最初に使うときに作る（初回表示で openai の読み込みを待たせない）
+def get_gateway():
+    with METRICS.timer("get_client"):
+        client = get_client(endpoint, deployment_name, api_key)
+    return get_llm_gateway(client, endpoint, deployment_name)
+
+# 構造化出力（json_schema）に対応したAPIバージョン
+structured_api_version = "2024-08-01-preview"
+
+# キャッシュの保存先（ベンチマークなどで別の場所を使うときは環境変数で変更する）
+CACHE_DIR = os.environ.get("CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache"))
+
+
+# 複数のワーカーで共有する状態（回答キャッシュ・レート制限）の置き場所
+# 空ならワーカーごと（キャッシュは CACHE_DIR のSQLite、レート制限はプロセス内）。launch_workers.py を参照
+#   memory / sqlite:///path/to/state.sqlite3 / redis://host:6379/0
+STATE_BACKEND = os.environ.get("STATE_BACKEND", "")
+
+
+@st.cache_resource(show_spinner=False)
+def get_state_backend(url):
+    return open_backend(url)
+
+state_backend = get_state_backend(STATE_BACKEND) if STATE_BACKEND else None
+
+
+# AIの利用量（トークン数・概算費用）の集計先。共有バックエンドが無ければこのファイルに置く
+# （キャッシュとは別の場所に置き、キャッシュ削除で消えないようにする）
+USAGE_DB_PATH = os.environ.get(
+    "USAGE_DB_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".data", "usage.sqlite3")
+)
+
+
+@st.cache_resource(show_spinner=False)
+def get_usage_ledger(path):
+    backend = state_backend if state_backend is not None else SQLiteBackend(path)
+    return UsageLedger(backend, DEFAULT_OUTPUT_BUDGETS, LLM_YEN_PER_1M_PROMPT_TOKENS, LLM_YEN_PER_1M_COMPLETION_TOKENS)
+
+usage_ledger = get_usage_ledger(USAGE_DB_PATH)
+
+
+# 1回分の利用量を記録する（usage が返らなかったときは文字数から見積もる）
+# 集計に失敗しても回答の表示は続ける
+def record_usage(mode, usage, messages, reply):
+    try:
+        return usage_ledger.record(
+            mode,
+            usage,
+            estimated_prompt_tokens=sum(estimate_tokens(message["content"]) for message in messages),
+            estimated_completion_tokens=estimate_tokens(reply or ""),
+        )
+    except BackendError:
+        METRICS.increment("usage_ledger_errors_total")
+        return None
+
+
+def usage_caption(record):
+    estimated = "（推定）" if record.estimated else ""
+    return (
+        f"入力 {record.prompt_tokens:,} / 出力 {record.completion_tokens:,}トークン{estimated}"
+        f"・約¥{record.cost_yen:.2f}"
+    )
+
+
+# 回答の長さの上限（max_tokens）で途中までになったか（なっていれば数える）
+# 途中までの回答は回答キャッシュ・類似質問・レシピ集に保存しない
+def check_truncated(finish_reason, mode):
+    if finish_reason != "length":
+        return False
+    METRICS.increment(f"llm_truncated_{mode}_total")
+    return True
+
+
+TRUNCATED_NOTICE = "回答が長さの上限に達したため、途中までになっています（この回答はキャッシュ・レシピ集には保存しません）"
+
+# 途中までの回答をこのセッションで覚えておく件数（再実行のたびにAIを呼び直さず、同じ回答を表示し続ける）
+TRUNCATED_KEEP = 20
+
+
+def keep_truncated(cache_key, text):
+    kept = st.session_state.setdefault("truncated_answers", {})
+    kept.pop(cache_key, None)
+    kept[cache_key] = text
+    while len(kept) > TRUNCATED_KEEP:
+        kept.pop(next(iter(kept)))
+
+
+# キャッシュの回答を返す（戻り値: (回答, 途中までか)。無ければ (None, False)）
+# 途中までの回答は共有のキャッシュには入れず、このセッションの分だけから返す
+def cached_answer(cache_key):
+    kept = st.session_state.get("truncated_answers", {}).get(cache_key)
+    if kept is not None:
+        return kept, True
+    return response_cache.get(cache_key), False
+
+
+USAGE_MODE_LABELS = {
+    "answer": "通常の回答", "structured": "構造化レシピ", "compare": "メニュー比較",
+    "meal_plan": "1週間の献立", "followup": "追加の要望",
+}
+USAGE_TABLE_COLUMNS = [
+    ("日付", "{}"), ("モード", "{}"), ("回数", "{:,}"), ("入力トークン", "{:,}"), ("出力トークン", "{:,}"),
+    ("概算費用", "¥{:,.2f}"),
+]
+
+# 管理用ページ: ?admin=usage で直近1週間のAIの利用量と概算費用を日ごと・モードごとに表示する
+if st.query_params.get("admin") == "usage":
+    check_admin_token()
+    usage_table = Table(USAGE_TABLE_COLUMNS)
+    total_cost = 0.0
+    for day, totals in usage_ledger.recent_days(7):
+        for mode, total in totals.items():
+            if total["requests"]:
+                usage_table.add_row(
+                    day, USAGE_MODE_LABELS.get(mode, mode), total["requests"], total["prompt_tokens"],
+                    total["completion_tokens"], total["cost_yen"],
+                )
+                total_cost += total["cost_yen"]
+    st.subheader("📈 AIの利用量（直近7日）")
+    if len(usage_table):
+        st.markdown(usage_table.to_html(), unsafe_allow_html=True)
+    else:
+        st.write("まだ記録がありません。")
+    st.caption(
+        f"合計 約¥{total_cost:,.2f}（単価: 入力 ¥{LLM_YEN_PER_1M_PROMPT_TOKENS:g} / 出力 ¥{LLM_YEN_PER_1M_COMPLETION_TOKENS:g}"
+        " / 100万トークン）"
+    )
+    st.stop()
+
+
+# AI回答のキャッシュ（プロセス内で1つだけ作成し、全セッションで共有）
+@st.cache_resource
+def get_response_cache():
+    return ResponseCache(
+        os.path.join(CACHE_DIR, "responses.sqlite3"),
+        max_memory_entries=256,
+        max_disk_entries=5000,
+        ttl_seconds=7 * 24 * 3600,
+        backend=state_backend,
+    )
+
+response_cache = get_response_cache()
+
+
+# 言い回しだけが違う質問（「簡単な親子丼の作り方」「親子丼 簡単に作りたい」など）の回答キャッシュ
+# インデックスは最初に使うときにディスクから読み込み、追加分はまとめてバックグラウンドで保存する
+# STATE_BACKEND を指定したときはバックエンドに追記し、他のワーカーの追加分もそこから取り込む
+@st.cache_resource
+def get_semantic_cache():
+    cache = SemanticCache(os.path.join(CACHE_DIR, "semantic_index.npz"), threshold=0.85, backend=state_backend)
+    # 保存待ちの追加分を終了時に書き出す
+    atexit.register(cache.flush)
+    return cache
+
+semantic_cache = get_semantic_cache()
+
+
+# お気に入り・評価の保存先（キャッシュとは別の場所に置き、キャッシュ削除で消えないようにする）
+FAVORITES_DB_PATH = os.environ.get(
+    "FAVORITES_DB_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".data", "favorites.sqlite3")
 )
+FAVORITES_PAGE_SIZE = 5
+
+# 1週間の献立で作る日数
+MEAL_PLAN_DAYS = int(os.environ.get("MEAL_PLAN_DAYS", "7"))
+
+# 検索リンクを表示するお店（shop_links に登録したキーをカンマ区切りで指定。省略時はすべて）
+SHOP_STORES = tuple(key.strip() for key in os.environ["SHOP_STORES"].split(",")) if os.environ.get("SHOP_STORES") else None
+
+
+# STATE_BACKEND に Redis を指定したとき（複数サーバ）は登録・評価・解除をバックエンドで共有し、手元のファイルはその複製にする
+# 同じサーバのワーカーだけのとき（SQLite・メモリ）は、このファイルをそのまま全ワーカーで共有する
+@st.cache_resource
+def get_favorites_store(path):
+    if state_backend is not None and not isinstance(state_backend, (MemoryBackend, SQLiteBackend)):
+        return SharedFavoritesStore(path, state_backend)
+    return FavoritesStore(path)
+
+favorites_store = get_favorites_store(FAVORITES_DB_PATH)
+
+
+# AIの回答・お気に入りをためたレシピ集（定番の料理や材料からの質問はAIを呼ばずにここから答える）
+RECIPE_CORPUS_PATH = os.environ.get(
+    "RECIPE_CORPUS_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".data", "recipes.sqlite3")
+)
+# レシピ集の件数の上限（超えたらAIの回答のうち、答えとして使われていないものから消す）
+RECIPE_CORPUS_MAX_ENTRIES = int(os.environ.get("RECIPE_CORPUS_MAX_ENTRIES", "20000"))
+
+
+@st.cache_resource
+def get_recipe_corpus(path):
+    return RecipeCorpus(path, max_entries=RECIPE_CORPUS_MAX_ENTRIES)
+
+recipe_corpus = get_recipe_corpus(RECIPE_CORPUS_PATH)
+
+
+# レシピ集の回答を使わずにAIに聞き直す（質問・条件ごと）
+def bypass_corpus(cache_key):
+    st.session_state.corpus_bypass = cache_key
+
+
+# お気に入り一覧の「開く」ボタン（質問欄も保存したときの質問に戻す）
+def open_favorite(favorite_id, question):
+    st.session_state.opened_favorite = favorite_id
+    st.session_state.user_question = question
+    st.session_state.favorite_opened = True
+
+
+def close_favorite():
+    st.session_state.opened_favorite = None
+
+# 構造化出力（JSON）でレシピを取得する。失敗した場合は None を返して従来のテキスト処理に任せる
+def fetch_structured_recipe(prompt, cache_key):
+    raw, truncated = cached_answer(cache_key)
+    if truncated:
+        st.warning("構造化出力が長さの上限で途切れたため、通常の回答に切り替えます")
+        return None
+    from_cache = raw is not None
+    if raw is None:
+        # openai は読み込みに時間がかかるので、AIを呼ぶときだけ読み込む（キャッシュから返すときは不要）
+        openai = timed_import("openai")
+        messages = request_messages(prompt)
+        try:
+            with METRICS.timer("llm_call_structured"):
+                completion = get_gateway().create(
+                    cache_key,
+                    estimate_request_tokens(messages, LLM_OUTPUT_BUDGETS["structured"]),
+                    messages=messages,
+                    model=deployment_name,
+                    response_format=RESPONSE_FORMAT,
+                    extra_headers={"api-key": api_key},
+                    extra_query={"api-version": structured_api_version},
+                    **generation_options("structured")
+                )
+        except openai.BadRequestError as e:
+            st.warning(f"構造化出力に対応していないため、通常の回答に切り替えます（{e}）")
+            return None
+        except UpstreamUnavailable as e:
+            st.warning(f"構造化出力を取得できなかったため、通常の回答に切り替えます（{e}）")
+            return None
+        raw = completion.text
+        if not completion.shared:
+            record_usage("structured", completion.usage, messages, raw)
+        if check_truncated(completion.finish_reason, "structured"):
+            keep_truncated(cache_key, raw)
+            st.warning("構造化出力が長さの上限で途切れたため、通常の回答に切り替えます")
+            return None
+    try:
+        recipe = parse_recipe(raw)
+    except ValueError as e:
+        st.warning(f"構造化出力の読み込みに失敗したため、通常の回答に切り替えます（{e}）")
+        return None
+    if not from_cache:
+        response_cache.set(cache_key, raw)
+    return recipe
+
+
+# 構造化されたレシピを表示する
+def render_recipe(recipe, ingredients):
+    st.markdown(f"### {recipe['dish_name']}")
+    st.markdown("**材料**\n" + "\n".join(f"- {ingredient.text}" for ingredient in ingredients))
+    if recipe["steps"]:
+        st.markdown("**作り方**\n" + "\n".join(f"{i}. {step}" for i, step in enumerate(recipe["steps"], 1)))
+    if recipe["estimated_kcal"] is not None:
+        st.write(f"推定カロリー: 約{recipe['estimated_kcal']:g}kcal")
+    if recipe["dessert_suggestions"]:
+        st.write("おすすめのデザート: " + "、".join(recipe["dessert_suggestions"]))
+    if recipe["drink_suggestions"]:
+        st.write("おすすめの飲み物: " + "、".join(recipe["drink_suggestions"]))
+
+
+# 会話の続きをストリーミングで表示し、(回答全文, 途中までか) を返す
+def stream_followup(messages):
+    started_at = time.perf_counter()
+    first_token_at = []
+    with METRICS.timer("llm_call_followup"):
+        # 会話ごとに内容が違うので、同じ質問のまとめ（key）は使わない
+        completions = []
+        stream = get_gateway().stream_text(
+            None,
+            estimate_request_tokens(messages, LLM_OUTPUT_BUDGETS["followup"]),
+            on_complete=completions.append,
+            messages=messages,
+            model=deployment_name,
+            extra_headers={"api-key": api_key},
+            extra_query={"api-version": api_version},
+            **generation_options("followup", stream=True)
+        )
+
+        def iter_reply_chunks():
+            for delta in stream:
+                if not first_token_at:
+                    first_token_at.append(time.perf_counter())
+                yield delta
+
+        reply = st.write_stream(iter_reply_chunks())
+    if not isinstance(reply, str):
+        reply = "".join(str(part) for part in reply)
+    if first_token_at:
+        METRICS.observe("llm_ttft_followup", first_token_at[0] - started_at)
+    truncated = False
+    if completions:
+        record_usage("followup", completions[0].usage, messages, reply)
+        truncated = check_truncated(completions[0].finish_reason, "followup")
+        if truncated:
+            st.warning(TRUNCATED_NOTICE)
+    return reply, truncated
+
+
+# 材料の価格表（運用で毎日更新する。ファイルを差し替えると再起動なしで反映される）
+PRICES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "prices.csv")
+
+
+# 価格表はプロセスで1回だけ読み込み、全セッションで共有する（更新時刻が変わったら読み直す）
+@st.cache_resource(show_spinner=False, max_entries=2)
+def get_price_catalog(path, mtime):
+    return load_price_catalog(path)
+
+
+# 栄養表（100gあたりのカロリー・PFCと単位ごとの重さ）
+NUTRITION_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "nutrition.csv")
+
+
+# 栄養表はプロセスで1回だけ読み込む（ファイルが更新されたら読み直す）
+@st.cache_resource(show_spinner=False, max_entries=2)
+def get_nutrition_table(path, mtime):
+    return load_nutrition_table(path)
+
+
+# 材料費・カロリーの表の列（見出し, 書式）
+COST_TABLE_COLUMNS = [
+    ("材料名", "{}"), ("使用量", "{:g}g"), ("推定価格", "¥{:,.0f}"), ("1パックの価格", "¥{:,.0f}"), ("マッチング", "{}"),
+]
+CALORIE_TABLE_COLUMNS = [
+    ("材料名", "{}"), ("量", "{:g}g"), ("カロリー", "{:.1f}kcal"), ("たんぱく質", "{:.1f}g"),
+    ("脂質", "{:.1f}g"), ("炭水化物", "{:.1f}g"), ("マッチング", "{}"),
+]
+# 買い物リストの書き出しでは単位を見出しに付ける（値は数値のまま書き出す）
+SHOPPING_LIST_HEADERS = ["材料名", "使用量(g)", "推定価格(円)", "1パックの価格(円)", "マッチング"]
+# 1週間分の買い物リスト
+WEEKLY_LIST_COLUMNS = [
+    ("材料名", "{}"), ("1週間の量", "{:,.0f}g"), ("使う日数", "{}日"), ("パック数", "{:g}"),
+    ("1パックの価格", "¥{:,.0f}"), ("費用", "¥{:,.0f}"),
+]
+WEEKLY_LIST_HEADERS = ["材料名", "1週間の量(g)", "使う日数", "パック数", "1パックの価格(円)", "費用(円)"]
+
+
+# 回答の材料数・概算費用・概算カロリーをまとめて計算する（メニュー比較などで使う）
+def summarize_answer(text, num_people):
+    parsed = extract_ingredients(text)
+    if not parsed:
+        return {"ingredients": 0, "cost": 0, "kcal": 0.0}
+    price_catalog = get_price_catalog(PRICES_PATH, os.path.getmtime(PRICES_PATH))
+    nutrition_table = get_nutrition_table(NUTRITION_PATH, os.path.getmtime(NUTRITION_PATH))
+    _, price_indices = price_catalog.lookup([ingredient.text for ingredient in parsed])
+    _, nutrition_indices = nutrition_table.lookup(parsed)
+    grams = nutrition_table.to_grams(parsed, nutrition_indices, default_grams=default_grams(num_people))
+    return {
+        "ingredients": len(parsed),
+        "cost": int(round(price_catalog.estimate(price_indices, grams).sum())),
+        "kcal": float(nutrition_table.compute(nutrition_indices, grams)[:, 0].sum()),
+    }
+
+
+# 比較する案（難易度・希望カロリーの組み合わせ）
+def build_menu_variants(difficulty, target_calorie, count):
+    other = "ちょっと手間のかかる料理" if difficulty == "簡単な料理" else "簡単な料理"
+    candidates = [
+        (difficulty, target_calorie),
+        (other, target_calorie),
+        (difficulty, max(100, target_calorie - 200)),
+        (difficulty, target_calorie + 200),
+    ]
+    return candidates[:count]
+
+
+# 複数の案を同時に生成し、届いたものから各カラムに表示する
+# 戻り値: (案ごとの回答, 案ごとに途中までか)
+def run_menu_comparison(user_question, num_people, variants, sections=()):
+    variant_cols = st.columns(len(variants))
+    placeholders = []
+    summaries = []
+    for col, (variant_difficulty, variant_calorie) in zip(variant_cols, variants):
+        with col:
+            st.markdown(f"**{variant_difficulty} / {variant_calorie}kcal**")
+            placeholders.append(st.empty())
+            summaries.append(st.empty())
+
+    def show_summary(index, text, note=""):
+        summary = summarize_answer(text, num_people)
+        summaries[index].caption(
+            f"材料 {summary['ingredients']}品 / 概算 ¥{summary['cost']:,} / 約{summary['kcal']:.0f}kcal{note}"
+        )
+
+    truncated_note = " / ⚠️ 長さの上限で途中までになっています"
+    results = [None] * len(variants)
+    truncated = [False] * len(variants)
+    pending = []  # (案の番号, キャッシュキー)
+    requests = []
+    for index, (variant_difficulty, variant_calorie) in enumerate(variants):
+        cache_key = make_cache_key(
+            user_question, num_people, variant_difficulty, variant_calorie, deployment_name, api_version,
+            sections=list(sections)
+        )
+        cached, truncated[index] = cached_answer(cache_key)
+        if cached is not None:
+            results[index] = cached
+            placeholders[index].markdown(cached)
+            show_summary(index, cached, truncated_note if truncated[index] else "")
+            continue
+        pending.append((index, cache_key))
+        requests.append({
+            "messages": request_messages(
+                build_user_prompt(user_question, num_people, variant_difficulty, variant_calorie, sections)
+            ),
+            "model": deployment_name,
+            "extra_headers": {"api-key": api_key},
+            "extra_query": {"api-version": api_version},
+            **generation_options("compare", stream=True),
+        })
+
+    def on_chunk(position, text):
+        placeholders[pending[position][0]].markdown(text)
+
+    # 生成が終わった案から材料の抽出と費用・カロリー計算をする
+    def on_done(position, text, info):
+        index, cache_key = pending[position]
+        if text is None:
+            placeholders[index].error(f"エラーが発生しました: {info['error']}")
+            return
+        record_usage("compare", info["usage"], requests[position]["messages"], text)
+        results[index] = text
+        truncated[index] = check_truncated(info["finish_reason"], "compare")
+        if truncated[index]:
+            keep_truncated(cache_key, text)
+        else:
+            response_cache.set(cache_key, text)
+        if info["ttft"] is not None:
+            METRICS.observe("llm_ttft", info["ttft"])
+        show_summary(index, text, truncated_note if truncated[index] else "")
+
+    # 同時に投げる分もまとめてレート制限の枠を確保する
+    estimates = [estimate_request_tokens(request["messages"], request["max_tokens"]) for request in requests]
+    if requests:
+        get_gateway().admit(sum(estimates), requests=len(requests))
+    with METRICS.timer("llm_fanout"):
+        fan_out(make_async_client, requests, get_gateway(), estimates, on_chunk, on_done)
+    return results, truncated
+
+
+# 1週間分のレシピを構造化出力で同時に生成する（戻り値: 日ごとのレシピ。失敗した日は None）
+def generate_meal_plan(num_people, difficulty, target_calorie, sections=()):
+    prompts = [
+        prompt + section_instruction(sections, structured=True)
+        for prompt in build_day_prompts(num_people, difficulty, target_calorie, MEAL_PLAN_DAYS)
+    ]
+    progress = st.progress(0.0, text="献立を作成中...")
+    recipes = [None] * len(prompts)
+    finished = [0]
+
+    def mark_done(index, raw):
+        try:
+            recipes[index] = parse_recipe(raw)
+        except ValueError:
+            recipes[index] = None
+        finished[0] += 1
+        progress.progress(finished[0] / len(prompts), text=f"献立を作成中...（{finished[0]}/{len(prompts)}日）")
+
+    pending = []  # (日の番号, キャッシュキー)
+    requests = []
+    for index, prompt in enumerate(prompts):
+        cache_key = make_cache_key(
+            prompt, num_people, difficulty, target_calorie, deployment_name, structured_api_version, output="json"
+        )
+        # 途中までで読めなかった日も、このセッションでは作り直さない（もう一度作るときは条件を変える）
+        cached, _ = cached_answer(cache_key)
+        if cached is not None:
+            mark_done(index, cached)
+            continue
+        pending.append((index, cache_key))
+        requests.append({
+            "messages": request_messages(prompt),
+            "model": deployment_name,
+            "response_format": RESPONSE_FORMAT,
+            "extra_headers": {"api-key": api_key},
+            "extra_query": {"api-version": structured_api_version},
+            **generation_options("meal_plan", stream=True),
+        })
+
+    def on_done(position, text, info):
+        index, cache_key = pending[position]
+        if text is None:
+            finished[0] += 1
+            return
+        record_usage("meal_plan", info["usage"], requests[position]["messages"], text)
+        mark_done(index, text)
+        if check_truncated(info["finish_reason"], "meal_plan"):
+            keep_truncated(cache_key, text)
+        elif recipes[index] is not None:
+            response_cache.set(cache_key, text)
+
+    # 1週間分をまとめてレート制限の枠を確保する
+    estimates = [estimate_request_tokens(request["messages"], request["max_tokens"]) for request in requests]
+    if requests:
+        get_gateway().admit(sum(estimates), requests=len(requests))
+    with METRICS.timer("llm_meal_plan"):
+        fan_out(make_async_client, requests, get_gateway(), estimates, on_done=on_done)
+    progress.empty()
+    return recipes
+
 
 # メインとサイドの2カラムを作成
+# --- 操作したときに、その部分だけを再実行するパネル（st.fragment） ---
+# スライダーやボタンを操作しても背景・CSS・AIの回答などは作り直さない
+# 表示中かどうかは回答ごとのキーで st.session_state に持つ（入力欄を操作しても閉じないように）
+
+# 星評価・お気に入り登録（登録・解除したときはお気に入り一覧も更新するため全体を再実行する）
+# conditions: 回答を作ったときの条件（レシピ集に登録するときに一緒に保存する）
+# truncated: 長さの上限で途中までの回答（お気に入りには登録できるが、レシピ集には入れない）
+@st.fragment
+@METRICS.timed("fragment_rating")
+def rating_panel(answer, question, conditions=None, truncated=False):
+    # 回答の内容から作ったキーで管理する（登録済みなら保存した評価を初期値にする）
+    favorite_id = recipe_id(answer)
+    saved_favorite = favorites_store.get(favorite_id)
+    st.subheader("このメニューの評価")
+    rating = st.slider(
+        "星を付けて評価してください", 1, 5, saved_favorite.rating if saved_favorite else 3,
+        format="%d⭐", key=f"rating_{favorite_id}"
+    )
+    st.write(f"あなたの評価: {'⭐'*rating}")
+
+    notice = st.session_state.pop("favorite_notice", None)
+    if saved_favorite is not None:
+        favorites_store.set_rating(favorite_id, rating)
+        if st.button("★ お気に入り解除"):
+            favorites_store.remove(favorite_id)
+            st.session_state.favorite_notice = "お気に入りから解除しました"
+            st.rerun()
+        if notice:
+            st.success(notice)
+        else:
+            st.info("お気に入り登録済み")
+    else:
+        if notice:
+            st.success(notice)
+        if st.button("☆ お気に入り登録"):
+            favorites_store.save(question, answer, extract_ingredients(answer), rating)
+            if not truncated:
+                recipe_corpus.add(answer, extract_ingredients(answer), question, source="favorite", **(conditions or {}))
+            st.session_state.favorite_notice = "お気に入りに登録しました"
+            st.rerun()
+
+
+# 材料費の算出（地域の切り替えや手動入力ではこのパネルだけを再実行する）
+@st.fragment
+@METRICS.timed("fragment_cost")
+def cost_panel(answer, num_people):
+    price_catalog = get_price_catalog(PRICES_PATH, os.path.getmtime(PRICES_PATH))
+    # 価格の地域・店舗（価格表に列があるものから選ぶ）
+    price_region = st.selectbox("価格の地域・店舗", price_catalog.regions, index=0)
+    panel_key = recipe_id(answer)
+    if st.button("💰 材料費を算出"):
+        st.session_state.cost_panel_for = panel_key
+    if st.session_state.get("cost_panel_for") != panel_key:
+        return
+
+    st.subheader("🛒 材料費の詳細")
+
+    # 材料リストを抽出（解析結果は回答ごとに共有）
+    parsed_ingredients = list(extract_ingredients(answer))
+
+    # デバッグ情報を表示
+    if not parsed_ingredients:
+        st.warning("材料の自動抽出に失敗しました。AI回答の形式を確認します...")
+        with st.expander("AI回答の内容を確認"):
+            st.text(answer)
+        st.info("手動で材料を入力することもできます。")
+
+        # 手動入力オプション
+        manual_ingredients = st.text_area(
+            "材料を手動で入力してください（1行に1つずつ）:",
+            placeholder="例：\n玉ねぎ 1個\n豚肉 300g\n醤油 大さじ2"
+        )
+        if manual_ingredients:
+            parsed_ingredients = [
+                parse_ingredient_line(line) for line in manual_ingredients.split('\n') if line.strip()
+            ]
+
+    total_cost = 0
+
+    if parsed_ingredients:
+        st.success(f"材料を {len(parsed_ingredients)} 個検出しました:")
+
+        # 材料費一覧表を作成
+        st.write("**材料別価格一覧表：**")
+
+        nutrition_table = get_nutrition_table(NUTRITION_PATH, os.path.getmtime(NUTRITION_PATH))
+        # 材料名から価格を推定（全材料をまとめて照合し、一番長く一致したキーを採用）
+        matched_keys, price_indices = price_catalog.lookup([ingredient.text for ingredient in parsed_ingredients])
+        # 使う量をgに換算（分量が書かれていない材料は一人100gとして人数分）
+        _, nutrition_indices = nutrition_table.lookup(parsed_ingredients)
+        grams = nutrition_table.to_grams(
+            parsed_ingredients, nutrition_indices, default_grams=default_grams(num_people)
+        )
+        costs = price_catalog.estimate(price_indices, grams, price_region)
+        pack_prices = price_catalog.pack_prices(price_indices, price_region)
+        total_cost = int(round(costs.sum()))
+
+        # 表の文字列は作るときに1回だけ整形し、HTMLの表で表示する（pandas は書き出すときだけ使う）
+        with METRICS.timer("render_cost_table"):
+            cost_table = Table(COST_TABLE_COLUMNS)
+            for ingredient, amount, cost, pack_price, matched_key in zip(
+                parsed_ingredients, grams, costs, pack_prices, matched_keys
+            ):
+                cost_table.add_row(ingredient.text, float(amount), float(cost), float(pack_price), matched_key)
+            st.markdown(cost_table.to_html(), unsafe_allow_html=True)
+
+        # 買い物リストの書き出し（データはボタンを押したときに作る）
+        export_cols = st.columns(2)
+        export_cols[0].download_button(
+            "📄 買い物リスト (CSV)",
+            data=lambda: to_csv_bytes(cost_table, SHOPPING_LIST_HEADERS),
+            file_name="shopping_list.csv",
+            mime="text/csv",
+        )
+        if excel_available():
+            export_cols[1].download_button(
+                "📊 買い物リスト (Excel)",
+                data=lambda: to_excel_bytes(cost_table, SHOPPING_LIST_HEADERS, "買い物リスト"),
+                file_name="shopping_list.xlsx",
+                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+            )
+
+        # 合計金額をハイライト表示
+        st.markdown(
+            summary_card(f"💰 合計概算費用: ¥{total_cost:,}", f"({num_people}人分)", tone="cost"),
+            unsafe_allow_html=True,
+        )
+
+        # 一人当たりの費用
+        per_person_cost = total_cost // num_people if num_people > 0 else total_cost
+        st.info(f"一人当たりの費用: 約¥{per_person_cost}")
+
+        st.warning("※ 価格は概算です。実際の価格は各ショッピングサイトでご確認ください。")
+        st.caption(f"価格データ: {price_catalog.version}（{price_region}）")
+
+    else:
+        st.error("材料リストが見つかりませんでした。AIの回答に材料が含まれていない可能性があります。")
+
+
+# お気に入り一覧（検索・ページ送りではこのパネルだけを再実行する）
+@st.fragment
+@METRICS.timed("fragment_favorites")
+def favorites_panel():
+    st.subheader("⭐ お気に入り")
+    favorite_query = st.text_input("お気に入りを検索（料理名・材料など）", key="favorite_query")
+    favorite_total = favorites_store.count(favorite_query)
+    if favorite_total:
+        page_count = (favorite_total + FAVORITES_PAGE_SIZE - 1) // FAVORITES_PAGE_SIZE
+        favorite_page = st.number_input("ページ", min_value=1, max_value=page_count, value=1, step=1) if page_count > 1 else 1
+        for favorite in favorites_store.page(favorite_page - 1, FAVORITES_PAGE_SIZE, favorite_query):
+            saved_at = time.strftime("%Y-%m-%d", time.localtime(favorite.created_at))
+            item_cols = st.columns([4, 1])
+            item_cols[0].markdown(f"**{favorite.title}** {'⭐' * favorite.rating}  \n{saved_at}・材料{len(favorite.ingredients)}品")
+            item_cols[1].button(
+                "開く", key=f"open_{favorite.id}", on_click=open_favorite, args=(favorite.id, favorite.question)
+            )
+        st.caption(f"{favorite_total}件中 {(favorite_page - 1) * FAVORITES_PAGE_SIZE + 1}〜{min(favorite_page * FAVORITES_PAGE_SIZE, favorite_total)}件")
+    elif favorite_query:
+        st.write("該当するお気に入りはありません。")
+    else:
+        st.write("お気に入りに登録したレシピがここに表示されます。")
+    # 「開く」を押したときは質問欄と回答を切り替えるため全体を再実行する
+    if st.session_state.pop("favorite_opened", False):
+        st.rerun()
+
+
+# カロリー計算（材料ごとの量を変えたときはこのパネルだけを再実行する）
+@st.fragment
+@METRICS.timed("fragment_calorie")
+def calorie_panel(answer, num_people):
+    panel_key = recipe_id(answer)
+    if st.button("🔥 カロリーを計算"):
+        st.session_state.calorie_panel_for = panel_key
+    if st.session_state.get("calorie_panel_for") != panel_key:
+        return
+
+    st.subheader("📊 カロリー詳細")
+
+    parsed_ingredients = extract_ingredients(answer)
+
+    if parsed_ingredients:
+        nutrition_table = get_nutrition_table(NUTRITION_PATH, os.path.getmtime(NUTRITION_PATH))
+        matched_keys, row_indices = nutrition_table.lookup(parsed_ingredients)
+        # 回答に書かれた分量（「豚肉 300g」「醤油 大さじ2」など）をgに換算して初期値にする
+        # 分量が書かれていない材料は、費用の表と同じく一人100gとして人数分
+        initial_grams = nutrition_table.to_grams(
+            parsed_ingredients, row_indices, default_grams=default_grams(num_people)
+        )
+
+        # 材料ごとの量入力欄を表示
+        st.write("**材料ごとの量を入力してください（g）**")
+        ingredient_amounts = []
+        for i, ingredient in enumerate(parsed_ingredients):
+            ingredient_amounts.append(st.number_input(
+                f"{ingredient.text} の量 (g)",
+                min_value=0.0,
+                value=float(round(initial_grams[i], 1)),
+                step=1.0,
+                format="%.1f",
+                key=f"amount_{ingredient.text}_{i}"
+            ))
+
+        # 全材料の栄養価をまとめて計算（100gあたりの値 × 量）
+        nutrients = nutrition_table.compute(row_indices, ingredient_amounts)
+        totals = nutrients.sum(axis=0)
+        total_calories = totals[0]
+
+        with METRICS.timer("render_calorie_table"):
+            calorie_table = Table(CALORIE_TABLE_COLUMNS)
+            for ingredient, amount, row, matched_key in zip(parsed_ingredients, ingredient_amounts, nutrients, matched_keys):
+                calorie_table.add_row(
+                    ingredient.text, float(amount), float(row[0]), float(row[1]), float(row[2]), float(row[3]), matched_key
+                )
+            st.markdown(calorie_table.to_html(), unsafe_allow_html=True)
+
+        st.markdown(
+            summary_card(f"🔥 合計概算カロリー: {total_calories:.1f}kcal", f"({num_people}人分)", tone="calorie"),
+            unsafe_allow_html=True,
+        )
+        per_person = totals / num_people if num_people > 0 else totals
+        per_person_cal = per_person[0]
+        st.info(
+            f"一人当たり: 約{per_person_cal:.1f}kcal"
+            f"（たんぱく質 {per_person[1]:.1f}g / 脂質 {per_person[2]:.1f}g / 炭水化物 {per_person[3]:.1f}g）"
+        )
+
+        # カロリー評価
+        if per_person_cal < 300:
+            st.success("🌱 低カロリーな料理ですね！")
+        elif per_person_cal < 600:
+            st.info("⚖️ 適度なカロリーの料理です")
+        else:
+            st.warning("🔥 高カロリーな料理です。食べ過ぎに注意！")
+
+        st.warning("※ カロリーは概算です。実際の量や調理法で変動します。")
+
+    else:
+        st.error("材料リストが見つかりませんでした。AIの回答に材料が含まれていない可能性があります。")
+
+
+# 1週間の献立（7日分を同時に生成し、材料をまとめた買い物リストと費用を表示する）
+@st.fragment
+@METRICS.timed("fragment_meal_plan")
+def meal_plan_panel(num_people, difficulty, target_calorie, sections=()):
+    st.subheader("📅 1週間の献立")
+    plan_key = (num_people, difficulty, target_calorie, sections)
+    if st.button("📅 1週間の献立を作る"):
+        try:
+            st.session_state.meal_plan = {"key": plan_key, "recipes": generate_meal_plan(*plan_key)}
+        except UpstreamUnavailable as e:
+            st.warning(f"AIサービスが混み合っています。しばらくしてからもう一度お試しください（{e}）")
+            return
+    plan = st.session_state.get("meal_plan")
+    if plan is None or plan["key"] != plan_key:
+        st.write("人数・難易度・希望カロリーに合わせて、1週間分の夕食と買い物リストを作ります。")
+        return
+
+    recipes = plan["recipes"]
+    day_ingredients = [recipe_ingredients(recipe) if recipe is not None else () for recipe in recipes]
+    for day, recipe in enumerate(recipes):
+        weekday = WEEKDAYS[day % len(WEEKDAYS)]
+        if recipe is None:
+            st.error(f"{weekday}曜日の献立を作成できませんでした")
+            continue
+        with st.expander(f"{weekday}曜日: {recipe['dish_name']}"):
+            render_recipe(recipe, day_ingredients[day])
+    if not any(day_ingredients):
+        return
+
+    price_catalog = get_price_catalog(PRICES_PATH, os.path.getmtime(PRICES_PATH))
+    nutrition_table = get_nutrition_table(NUTRITION_PATH, os.path.getmtime(NUTRITION_PATH))
+    price_region = st.selectbox("価格の地域・店舗", price_catalog.regions, index=0, key="meal_plan_region")
+    with METRICS.timer("meal_plan_aggregate"):
+        shopping = aggregate_shopping_list(day_ingredients, price_catalog, nutrition_table, num_people, price_region)
+
+    st.write("**1週間分の買い物リスト：**")
+    with METRICS.timer("render_meal_plan_table"):
+        shopping_table = Table(WEEKLY_LIST_COLUMNS)
+        for row in zip(shopping.names, shopping.grams, shopping.days, shopping.packs, shopping.pack_prices, shopping.costs):
+            shopping_table.add_row(row[0], float(row[1]), int(row[2]), float(row[3]), float(row[4]), float(row[5]))
+        st.markdown(shopping_table.to_html(), unsafe_allow_html=True)
+
+    saving = shopping.separate_cost - shopping.total_cost
+    st.info(
+        f"まとめ買いの合計: ¥{shopping.total_cost:,}（{num_people}人分・{len(recipes)}日）"
+        f" / 日ごとに買った場合: ¥{shopping.separate_cost:,}（¥{saving:,} お得）"
+    )
+    st.caption(f"使う分だけの按分額: ¥{shopping.used_cost:,}（残った材料は翌週に使えます）")
+    st.caption(f"価格データ: {price_catalog.version}（{price_region}）")
+    st.download_button(
+        "📄 1週間の買い物リスト (CSV)",
+        data=lambda: to_csv_bytes(shopping_table, WEEKLY_LIST_HEADERS),
+        file_name="weekly_shopping_list.csv",
+        mime="text/csv",
+    )
+
+
 main_col, fav_col = st.columns([3, 2])
 
 answer = ""  # グローバルで初期化
@@ -101,39 +1049,14 @@ with main_col:
     # 希望カロリー入力欄を追加
     with cols[2]:
         target_calorie = st.number_input("希望カロリー (kcal)", min_value=100, max_value=2000, value=600, step=50)
+    # 回答を少しずつ表示するかどうか
+    with cols[3]:
+        stream_mode = st.toggle("逐次表示", value=True)
+    # 材料・手順をJSONで受け取って表示するかどうか
+    with cols[4]:
+        json_mode = st.toggle("構造化レシピ", value=False)
 
     with cols[0]:
-        st.markdown(
-            """
-            <style>
-            /* selectboxの親divに枠線を付ける */
-            div[data-testid="stSelectbox"] {
-                border: 2px solid #1976d2;
-                border-radius: 8px;
-                padding: 8px 4px;
-                background: #fff;
-                margin-bottom: 8px;
-            }
-            /* text inputの親divに枠線を付ける */
-            div[data-testid="stTextInput"] {
-                border: 2px solid #1976d2;
-                border-radius: 8px;
-                padding: 8px 4px;
-                background: #fff;
-                margin-bottom: 8px;
-            }
-            /* radioの親divに枠線を付ける */
-            div[data-testid="stRadio"] {
-                border: 2px solid #1976d2;
-                border-radius: 8px;
-                padding: 8px 4px;
-                background: #fff;
-                margin-bottom: 8px;
-            }
-            </style>
-            """,
-            unsafe_allow_html=True
-        )
         num_people = st.selectbox("何人分ですか？", [1, 2, 3, 4, 5], index=0)
     with cols[1]:
         difficulty = st.radio(
@@ -145,485 +1068,303 @@ with main_col:
 
     user_question = st.text_input("料理に関する質問を入力してください:", key="user_question")
 
-    if user_question:
+    # お気に入りから開いたレシピ（質問を書き換えたら通常の質問に戻る）
+    opened_favorite = favorites_store.get(st.session_state.get("opened_favorite"))
+    if opened_favorite is not None and opened_favorite.question != user_question:
+        st.session_state.opened_favorite = opened_favorite = None
+    # デザート・飲み物の提案は選んだときだけ頼む（回答が短くなり、早く表示できる）
+    section_cols = st.columns(2)
+    with section_cols[0]:
+        want_dessert = st.toggle("デザートも提案", value=False)
+    with section_cols[1]:
+        want_drink = st.toggle("飲み物も提案", value=False)
+    sections = tuple(name for name, wanted in (("dessert", want_dessert), ("drink", want_drink)) if wanted)
+    # 難易度や希望カロリーを変えた複数の案を同時に作って比べる
+    compare_cols = st.columns([1, 2])
+    with compare_cols[0]:
+        compare_mode = st.toggle("メニューを比較", value=False)
+    with compare_cols[1]:
+        compare_count = st.slider("比較する案の数", 2, 4, 3) if compare_mode else 1
+
+    if user_question or opened_favorite is not None:
         with st.spinner("AIが考中..."):
             try:
-                # 希望カロリーをプロンプトに反映
-                prompt = f"{user_question}（{num_people}人分、{difficulty}、{target_calorie}kcal前後で教えて。料理に合うお勧めのデザートや飲み物も提案してください）"
-                response = client.chat.completions.create(
-                    messages=[
-                        {
-                            "role": "user",
-                            "content": prompt
-                        }
-                    ],
-                    model=deployment_name,
-                    extra_headers={"api-key": api_key},
-                    extra_query={"api-version": api_version}
-                )
-                answer = response.choices[0].message.content
-                st.write(f"AIの回答: {answer}")
-
-                # --- 星評価 ---
-                st.subheader("このメニューの評価")
-                rating = st.slider("星を付けて評価してください", 1, 5, 3, format="%d⭐")
-                st.write(f"あなたの評価: {'⭐'*rating}")
-
-                # --- お気に入り登録 ---
-                if "favorites" not in st.session_state:
-                    st.session_state.favorites = set()
-                fav_key = f"fav_{answer[:30]}"
-
-                if fav_key in st.session_state.favorites:
-                    if st.button("★ お気に入り解除"):
-                        st.session_state.favorites.remove(fav_key)
-                        st.success("お気に入りから解除しました")
-                    else:
-                        st.info("お気に入り登録済み")
+                # 希望カロリーなどの条件と、選んだ追加の項目をプロンプトに反映
+                prompt = build_user_prompt(user_question, num_people, difficulty, target_calorie, sections)
+                # 構造化出力モードではJSONのレシピを受け取り、失敗したときだけ従来のテキスト処理にする
+                recipe = None
+                answer_truncated = False
+                if json_mode and not compare_mode and opened_favorite is None:
+                    recipe = fetch_structured_recipe(
+                        build_user_prompt(user_question, num_people, difficulty, target_calorie, sections, structured=True),
+                        make_cache_key(
+                            user_question, num_people, difficulty, target_calorie, deployment_name,
+                            structured_api_version, output="json", sections=list(sections)
+                        )
+                    )
+                if opened_favorite is not None:
+                    # 保存済みの回答と材料をそのまま使う（AIは呼ばない）
+                    answer = opened_favorite.answer
+                    remember_ingredients(answer, opened_favorite.ingredients)
+                    st.write(f"AIの回答（お気に入りから表示）: {answer}")
+                    st.button("お気に入りを閉じる", on_click=close_favorite)
+                elif compare_mode:
+                    variants = build_menu_variants(difficulty, target_calorie, compare_count)
+                    results, truncated_results = run_menu_comparison(user_question, num_people, variants, sections)
+                    # 選んだ案で評価・お気に入り・材料費などを続ける
+                    available = [i for i, text in enumerate(results) if text]
+                    if not available:
+                        raise RuntimeError("どの案も生成できませんでした")
+                    chosen = st.radio(
+                        "この案で進める",
+                        available,
+                        format_func=lambda i: f"{variants[i][0]} / {variants[i][1]}kcal",
+                        horizontal=True
+                    )
+                    answer = results[chosen]
+                    answer_truncated = truncated_results[chosen]
+                elif recipe is not None:
+                    recipe_items = recipe_ingredients(recipe)
+                    answer = recipe_to_text(recipe, num_people)
+                    # 材料はJSONから分かっているので、回答テキストを解析し直さない
+                    remember_ingredients(answer, recipe_items)
+                    st.write("AIの回答:")
+                    render_recipe(recipe, recipe_items)
                 else:
-                    if st.button("☆ お気に入り登録"):
-                        st.session_state.favorites.add(fav_key)
-                        st.success("お気に入りに登録しました")
+                    # 同じ条件の質問はキャッシュから返す（スライダー操作などの再実行でAIを呼び直さない）
+                    cache_key = make_cache_key(
+                        user_question, num_people, difficulty, target_calorie, deployment_name, api_version,
+                        sections=list(sections)
+                    )
+                    with METRICS.timer("response_cache_get"):
+                        answer, answer_truncated = cached_answer(cache_key)
+                    semantic_bucket = make_bucket(num_people, difficulty, target_calorie, sections)
+                    semantic_hit = None
+                    if answer is None:
+                        # 完全一致が無ければ、同じ条件の似た質問の回答を探す
+                        with METRICS.timer("semantic_cache_lookup"):
+                            semantic_hit = semantic_cache.lookup(user_question, semantic_bucket)
+                        if semantic_hit is not None:
+                            answer = semantic_hit[0]
+                            response_cache.set(cache_key, answer)
+                    corpus_hit = None
+                    if answer is None and st.session_state.get("corpus_bypass") != cache_key:
+                        # それでも無ければレシピ集から探す（料理名の質問・材料からの質問）
+                        ingredient_terms = ingredient_query(user_question)
+                        with METRICS.timer("recipe_corpus_lookup"):
+                            if ingredient_terms:
+                                # 挙げた材料をすべて使うものだけを候補にする
+                                corpus_matches = [
+                                    recipe for recipe, matched in recipe_corpus.search_ingredients(
+                                        ingredient_terms, num_people, difficulty, target_calorie, sections
+                                    )
+                                    if matched == len(ingredient_terms)
+                                ]
+                            else:
+                                dish_hit = recipe_corpus.find_dish(user_question, num_people, difficulty, target_calorie, sections)
+                                corpus_matches = [dish_hit] if dish_hit is not None else []
+                        METRICS.increment("recipe_corpus_hits_total" if corpus_matches else "recipe_corpus_misses_total")
+                        if corpus_matches:
+                            chosen = 0
+                            if len(corpus_matches) > 1:
+                                chosen = st.radio(
+                                    "レシピ集から見つかった料理",
+                                    range(len(corpus_matches)),
+                                    format_func=lambda i: corpus_matches[i].dish_name,
+                                    horizontal=True
+                                )
+                            corpus_hit = corpus_matches[chosen]
+                            answer = corpus_hit.answer
+                            remember_ingredients(answer, corpus_hit.ingredients)
+                    if answer is None:
+                        messages = request_messages(prompt)
+                        completions = []
+                        started_at = time.perf_counter()
+                        ttft = None
+                        try:
+                            # 同時実行数・レート制限・リトライは llm_gateway で行う
+                            # 同じ条件の質問が他のセッションで生成中なら、その回答を待って使う
+                            with METRICS.timer("llm_call"):
+                                if stream_mode:
+                                    # ストリーミングAPIで受け取った分から順に表示する
+                                    stream = get_gateway().stream_text(
+                                        cache_key,
+                                        estimate_request_tokens(messages, LLM_OUTPUT_BUDGETS["answer"]),
+                                        on_complete=completions.append,
+                                        messages=messages,
+                                        model=deployment_name,
+                                        extra_headers={"api-key": api_key},
+                                        extra_query={"api-version": api_version},
+                                        **generation_options("answer", stream=True)
+                                    )
+                                    first_token_at = []
 
-                # --- Gmail送信ボタン ---
-                subject = "料理の材料と作り方"
-                short_answer = answer[:1000]
-                body = urllib.parse.quote(short_answer)
-                gmail_link = f"https://mail.google.com/mail/?view=cm&fs=1&to=&su={urllib.parse.quote(subject)}&body={body}"
-                st.markdown(
-                    f'''
-                    <a href="{gmail_link}" target="_blank" style="
-                        display:inline-block;
-                        padding:8px 16px;
-                        font-size:16px;
-                        background:#1976d2;
-                        color:#fff;
-                        border:none;
-                        border-radius:6px;
-                        text-decoration:none;
-                        font-weight:bold;
-                        margin-top:24px;
-                    ">📧 Gmailで送る</a>
-                    ''',
-                    unsafe_allow_html=True
-                )
+                                    def iter_answer_chunks():
+                                        for delta in stream:
+                                            if not first_token_at:
+                                                first_token_at.append(time.perf_counter())
+                                            yield delta
 
-                # --- 材料費算出ボタン ---
-                if st.button("💰 材料費を算出"):
-                    st.subheader("🛒 材料費の詳細")
-                    
-                    # 材料リストを抽出（複数のパターンに対応）
-                    ingredients = []
-                    if answer:
-                        # パターン1: 「材料」セクションから抽出
-                        patterns = [
-                            r"材料.*?\n((?:- .*\n)+)",           # - リスト形式
-                            r"材料.*?\n((?:\d+\..*\n)+)",        # 1. 番号付きリスト
-                            r"材料.*?\n((?:・.*\n)+)",           # ・ リスト形式
-                            r"材料.*?[:：]\s*(.*?)(?:\n\n|\n作り方|\n手順|$)",  # : 以降の材料
-                        ]
-                        
-                        for pattern in patterns:
-                            match = re.search(pattern, answer, re.DOTALL | re.MULTILINE)
-                            if match:
-                                raw_ingredients = match.group(1).strip()
-                                # 行ごとに分割して材料を抽出
-                                for line in raw_ingredients.split('\n'):
-                                    line = line.strip()
-                                    if line and not line.startswith(('作り方', '手順', '調理法')):
-                                        # 先頭の記号や番号を除去
-                                        clean_line = re.sub(r'^[-・\d+\.\)]\s*', '', line)
-                                        if clean_line:
-                                            ingredients.append(clean_line)
-                                break
-                        
-                        # パターンが見つからない場合、全体から食材らしきものを抽出
-                        if not ingredients:
-                            # 一般的な食材名を含む行を抽出
-                            food_keywords = ['肉', '野菜', '魚', '米', '麺', '卵', '豆腐', '油', '醤油', '味噌', '塩', '砂糖', 
-                                           '玉ねぎ', 'にんじん', 'じゃがいも', 'キャベツ', 'トマト', 'ピーマン']
-                            
-                            for line in answer.split('\n'):
-                                line = line.strip()
-                                if any(keyword in line for keyword in food_keywords):
-                                    # 調理法や説明文を除外
-                                    if not any(exclude in line for exclude in ['炒める', '煮る', '焼く', '切る', '作り方', '手順']):
-                                        clean_line = re.sub(r'^[-・\d+\.\)]\s*', '', line)
-                                        if clean_line and len(clean_line) < 50:  # 長すぎる行は除外
-                                            ingredients.append(clean_line)
-            
-                    # デバッグ情報を表示
-                    if not ingredients:
-                        st.warning("材料の自動抽出に失敗しました。AI回答の形式を確認します...")
-                        with st.expander("AI回答の内容を確認"):
-                            st.text(answer)
-                        st.info("手動で材料を入力することもできます。")
-                        
-                        # 手動入力オプション
-                        manual_ingredients = st.text_area(
-                            "材料を手動で入力してください（1行に1つずつ）:",
-                            placeholder="例：\n玉ねぎ 1個\n豚肉 300g\n醤油 大さじ2"
-                        )
-                        if manual_ingredients:
-                            ingredients = [line.strip() for line in manual_ingredients.split('\n') if line.strip()]
-                    
-                    # 材料の概算価格辞書（大幅拡張版）
-                    price_dict = {
-                        # 肉類
-                        "豚肉": 400, "豚バラ": 450, "豚ロース": 500, "豚ひき肉": 350, "豚こま": 380,
-                        "鶏肉": 300, "鶏もも": 350, "鶏むね": 250, "鶏ひき肉": 280, "手羽先": 320, "手羽元": 300,
-                        "牛肉": 600, "牛バラ": 700, "牛ロース": 800, "牛ひき肉": 450, "牛切り落とし": 550,
-                        "ベーコン": 400, "ハム": 350, "ソーセージ": 300, "ウインナー": 280,
-                        
-                        # 魚介類
-                        "魚": 400, "鮭": 450, "サバ": 350, "アジ": 300, "イワシ": 250, "タラ": 400,
-                        "エビ": 500, "イカ": 400, "タコ": 600, "ホタテ": 700, "カニ": 800,
-                        "ツナ缶": 200, "さば缶": 180, "鮭缶": 220,
-                        
-                        # 野菜類
-                        "玉ねぎ": 150, "にんじん": 120, "じゃがいも": 200, "キャベツ": 200, "トマト": 300,
-                        "きゅうり": 150, "大根": 180, "白菜": 250, "ピーマン": 200, "パプリカ": 300,
-                        "なす": 200, "ズッキーニ": 250, "かぼちゃ": 300, "ブロッコリー": 250, "カリフラワー": 280,
-                        "ほうれん草": 200, "小松菜": 180, "チンゲン菜": 150, "レタス": 200, "サニーレタス": 180,
-                        "もやし": 50, "豆苗": 100, "ネギ": 150, "長ネギ": 150, "万能ねぎ": 120,
-                        "ニラ": 150, "生姜": 200, "にんにく": 180, "セロリ": 200, "アスパラ": 350,
-                        "オクラ": 200, "いんげん": 250, "枝豆": 200, "とうもろこし": 300,
-                        "れんこん": 300, "ごぼう": 250, "たけのこ": 400, "山芋": 350,
-                        
-                        # きのこ類
-                        "しいたけ": 200, "えのき": 100, "しめじ": 150, "エリンギ": 180, "まいたけ": 200,
-                        "マッシュルーム": 200, "なめこ": 150,
-                        
-                        # 豆類・豆腐製品
-                        "豆腐": 100, "厚揚げ": 150, "油揚げ": 120, "絹ごし豆腐": 100, "木綿豆腐": 100,
-                        "納豆": 150, "大豆": 200, "小豆": 250, "いんげん豆": 200,
-                        
-                        # 穀物・麺類
-                        "米": 250, "白米": 250, "玄米": 300, "もち米": 280,
-                        "パン": 150, "食パン": 120, "バゲット": 200, "ロールパン": 180,
-                        "うどん": 120, "そば": 150, "そうめん": 100, "ラーメン": 120, "パスタ": 150,
-                        "スパゲッティ": 150, "マカロニ": 120, "ペンネ": 150,
-                        "小麦粉": 150, "片栗粉": 180, "パン粉": 120, "天ぷら粉": 200,
-                        
-                        # 卵・乳製品
-                        "卵": 250, "たまご": 250, "うずらの卵": 300,
-                        "牛乳": 200, "豆乳": 180, "生クリーム": 300, "ヨーグルト": 180,
-                        "バター": 400, "マーガリン": 200, "クリームチーズ": 350,
-                        "チーズ": 350, "モッツァレラ": 400, "パルメザン": 500, "チェダー": 380,
-                        
-                        # 調味料
-                        "醤油": 200, "味噌": 300, "塩": 100, "砂糖": 180, "上白糖": 180, "三温糖": 200,
-                        "酢": 200, "米酢": 220, "穀物酢": 180, "黒酢": 300,
-                        "みりん": 250, "料理酒": 200, "日本酒": 400,
-                        "ごま油": 350, "サラダ油": 300, "オリーブオイル": 500, "ココナッツオイル": 600,
-                        "ケチャップ": 200, "マヨネーズ": 250, "ソース": 200, "ウスターソース": 200,
-                        "コチュジャン": 300, "豆板醤": 250, "甜麺醤": 280, "オイスターソース": 250,
-                        "ナンプラー": 300, "タバスコ": 400, "ラー油": 300,
-                        
-                        # 香辛料・ハーブ
-                        "こしょう": 200, "黒胡椒": 220, "白胡椒": 250, "唐辛子": 200, "一味": 180,
-                        "七味": 200, "わさび": 300, "からし": 150, "山椒": 400,
-                        "カレー粉": 300, "ガラムマサラ": 400, "クミン": 350, "コリアンダー": 300,
-                        "バジル": 200, "オレガノ": 250, "ローズマリー": 300, "タイム": 280,
-                        "パセリ": 150, "大葉": 120, "しそ": 120,
-                        
-                        # だし・スープ
-                        "だしの素": 200, "コンソメ": 180, "中華だし": 200, "鶏ガラスープ": 180,
-                        "昆布": 300, "かつお節": 400, "煮干し": 250,
-                        
-                        # 缶詰・瓶詰
-                        "トマト缶": 150, "コーン缶": 120, "ミックスビーンズ": 150,
-                        "ジャム": 300, "はちみつ": 500, "メープルシロップ": 600,
-                        
-                        # 冷凍食品
-                        "冷凍野菜": 200, "冷凍エビ": 600, "冷凍魚": 400, "冷凍肉": 500,
-                        
-                        # その他
-                        "海苔": 300, "ごま": 200, "白ごま": 200, "黒ごま": 220,
-                        "アーモンド": 400, "くるみ": 500, "ピーナッツ": 300,
-                        "レーズン": 300, "ドライフルーツ": 400,
-                        "春雨": 150, "わかめ": 200, "ひじき": 250, "昆布": 300,
-                        "こんにゃく": 100, "しらたき": 120, "寒天": 200,
-                        "パスタソース": 200, "カレールー": 180, "シチューの素": 200,
-                    }
-                    
-                    total_cost = 0
-                    
-                    if ingredients:
-                        st.success(f"材料を {len(ingredients)} 個検出しました:")
-                        
-                        # 材料費一覧表を作成
-                        st.write("**材料別価格一覧表：**")
-                        
-                        # テーブル形式で表示
-                        import pandas as pd
-                        
-                        table_data = []
-                        for item in ingredients:
-                            # 材料名から価格を推定（部分一致の精度向上）
-                            estimated_price = 150  # デフォルト価格
-                            matched_key = "その他"
-                            
-                            # より柔軟な価格マッチング
-                            for key, price in price_dict.items():
-                                if key in item or item in key:
-                                    estimated_price = price
-                                    matched_key = key
-                                    break
-                            
-                            total_cost += estimated_price
-                            
-                            table_data.append({
-                                "材料名": item,
-                                "推定価格": f"¥{estimated_price}",
-                                "マッチング": matched_key
-                            })
-                        
-                        # DataFrameで表示
-                        df = pd.DataFrame(table_data)
-                        st.dataframe(df, use_container_width=True)
-                        
-                        # 合計金額をハイライト表示
-                        st.markdown(
-                            f"""
-                            <div style="
-                                background-color: #f0f8ff;
-                                border: 2px solid #1976d2;
-                                border-radius: 10px;
-                                padding: 20px;
-                                text-align: center;
-                                margin: 20px 0;
-                            ">
-                                <h3 style="color: #1976d2; margin: 0;">
-                                    💰 合計概算費用: ¥{total_cost:,}
-                                </h3>
-                                <p style="margin: 10px 0; color: #666;">
-                                    ({num_people}人分)
-                                </p>
-                            </div>
-                            """,
-                            unsafe_allow_html=True
-                        )
-                        
-                        # 一人当たりの費用
-                        per_person_cost = total_cost // num_people if num_people > 0 else total_cost
-                        st.info(f"一人当たりの費用: 約¥{per_person_cost}")
-                        
-                        st.warning("※ 価格は概算です。実際の価格は各ショッピングサイトでご確認ください。")
-                        
+                                    st.write("AIの回答:")
+                                    answer = st.write_stream(iter_answer_chunks())
+                                    # 後続の材料費・Gmail・お店検索などで使うので文字列にまとめておく
+                                    if not isinstance(answer, str):
+                                        answer = "".join(str(part) for part in answer)
+                                    ttft = first_token_at[0] - started_at if first_token_at else None
+                                else:
+                                    completions.append(get_gateway().create(
+                                        cache_key,
+                                        estimate_request_tokens(messages, LLM_OUTPUT_BUDGETS["answer"]),
+                                        messages=messages,
+                                        model=deployment_name,
+                                        extra_headers={"api-key": api_key},
+                                        extra_query={"api-version": api_version},
+                                        **generation_options("answer")
+                                    ))
+                                    answer = completions[0].text
+                                    st.write(f"AIの回答: {answer}")
+                        except UpstreamUnavailable:
+                            # AIが混雑・障害で使えないときは、条件の同じ似た質問の保存済み回答で代用する（「辛口」などの違いがあっても使う）
+                            semantic_hit = semantic_cache.lookup(
+                                user_question, semantic_bucket, threshold=FALLBACK_SIMILARITY, strict=False
+                            )
+                            if semantic_hit is None:
+                                raise
+                            answer = semantic_hit[0]
+                            st.warning("AIサービスが混み合っているため、保存済みの回答を表示しています")
+                            st.write(f"AIの回答: {answer}")
+                            st.caption(f"似た質問「{semantic_hit[2]}」の回答です（類似度 {semantic_hit[1]:.2f}）")
+                        else:
+                            # 応答時間を記録（最初の文字が出るまで / 生成完了まで）
+                            if ttft is not None:
+                                METRICS.observe("llm_ttft", ttft)
+                            total_time = time.perf_counter() - started_at
+                            METRICS.observe("llm_answer_total", total_time)
+                            if completions and check_truncated(completions[0].finish_reason, "answer"):
+                                # 共有のキャッシュには入れず、このセッションの再実行では同じ回答を使う
+                                answer_truncated = True
+                                keep_truncated(cache_key, answer)
+                                st.warning(TRUNCATED_NOTICE)
+                            else:
+                                response_cache.set(cache_key, answer)
+                                semantic_cache.add(user_question, semantic_bucket, answer)
+                                recipe_corpus.add(
+                                    answer, extract_ingredients(answer), user_question, num_people,
+                                    difficulty=difficulty, target_calorie=target_calorie, sections=sections
+                                )
+
+                            # 実際にAIを呼んだときだけ利用量を記録する（他のセッションの生成を待って使ったときは数えない）
+                            usage_record = None
+                            if completions and not completions[0].shared:
+                                usage_record = record_usage("answer", completions[0].usage, messages, answer)
+                            timing = f"生成完了まで {total_time:.2f}秒"
+                            if ttft is not None:
+                                timing = f"最初の文字まで {ttft:.2f}秒 / {timing}"
+                            if usage_record is not None:
+                                timing += f" / {usage_caption(usage_record)}"
+                            st.caption(timing)
+                    elif corpus_hit is not None:
+                        st.write(f"レシピ集の回答: {answer}")
+                        st.caption(f"レシピ集の「{corpus_hit.dish_name}」を表示しています（AIは使っていません）")
+                        st.button("🤖 AIに新しく作ってもらう", on_click=bypass_corpus, args=(cache_key,))
                     else:
-                        st.error("材料リストが見つかりませんでした。AIの回答に材料が含まれていない可能性があります。")
+                        st.write(f"AIの回答: {answer}")
+                        if answer_truncated:
+                            st.warning(TRUNCATED_NOTICE)
+                        if semantic_hit is not None:
+                            st.caption(f"似た質問「{semantic_hit[2]}」の回答を表示しています（類似度 {semantic_hit[1]:.2f}）")
+                stats = response_cache.stats
+                st.caption(
+                    f"キャッシュ: ヒット {stats['hits']} / ミス {stats['misses']}（ヒット率 {response_cache.hit_rate():.0%}）"
+                    f" / 類似質問: ヒット率 {semantic_cache.hit_rate():.0%}・検索 {semantic_cache.mean_lookup_ms():.2f}ms"
+                    f" / レシピ集: ヒット率 {recipe_corpus.hit_rate():.0%}・検索 {recipe_corpus.mean_lookup_ms():.2f}ms"
+                )
+
+                # --- 追加の要望（会話の続き） ---
+                # 質問や条件が変わったら会話履歴をリセットする
+                conversation_key = (
+                    user_question, num_people, difficulty, target_calorie, json_mode, compare_mode,
+                    opened_favorite.id if opened_favorite else None
+                )
+                if st.session_state.get("conversation_key") != conversation_key:
+                    st.session_state.conversation_key = conversation_key
+                    st.session_state.chat_history = []
+                chat_history = st.session_state.chat_history
+                # 最初の質問と回答は毎回同じ内容で先頭に置く（プロンプトキャッシュが効くように）
+                base_turns = [
+                    {"role": "user", "content": prompt},
+                    {"role": "assistant", "content": answer}
+                ]
+                for turn in chat_history:
+                    with st.chat_message(turn["role"]):
+                        st.markdown(turn["content"])
+                followup = st.chat_input("このレシピへの追加の要望（例: もっと辛くして、3人分にして）")
+                if followup:
+                    with st.chat_message("user"):
+                        st.markdown(followup)
+                    messages, context_info = build_messages(base_turns, chat_history, followup, CHAT_TOKEN_BUDGET)
+                    with st.chat_message("assistant"):
+                        reply, reply_truncated = stream_followup(messages)
+                        note = f"送信したトークン数(目安): {context_info['tokens']}"
+                        if context_info["dropped"]:
+                            note += f" / 古いやり取り{context_info['dropped']}件を要約しました"
+                        st.caption(note)
+                    chat_history.append({"role": "user", "content": followup})
+                    chat_history.append({"role": "assistant", "content": reply, "truncated": reply_truncated})
+                # 評価・材料費・お店検索などは最新の回答で行う
+                if chat_history:
+                    answer = chat_history[-1]["content"]
+                    answer_truncated = chat_history[-1].get("truncated", False)
+
+                # --- 星評価・お気に入り登録 ---
+                rating_panel(
+                    answer, user_question,
+                    {"num_people": num_people, "difficulty": difficulty, "target_calorie": target_calorie, "sections": sections},
+                    answer_truncated,
+                )
 
+                # --- Gmail送信ボタン ---
+                gmail_button(answer)
+
+                # --- 材料費算出 ---
+                cost_panel(answer, num_people)
+
+            except UpstreamUnavailable as e:
+                st.warning(f"AIサービスが混み合っています。しばらくしてからもう一度お試しください（{e}）")
             except Exception as e:
                 st.error(f"エラーが発生しました: {str(e)}")
 
+    # --- 1週間の献立 ---
+    meal_plan_panel(num_people, difficulty, target_calorie, sections)
+
 with fav_col:
+    # --- お気に入り一覧（検索・ページ送り） ---
+    favorites_panel()
+
+    # お店・ネットスーパーの検索リンク（回答ごとにまとめて作り、再実行では作り直さない）
+    shop_links = build_links(answer, extract_ingredients(answer), SHOP_STORES)
+
     st.subheader("🍽 食べられるお店を探す")
-    menu_name = answer.split('\n')[0].replace("【", "").replace("】", "").replace("メニュー", "").strip() if answer else ""
-    if menu_name:
-        google_url = f"https://www.google.com/search?q={urllib.parse.quote(menu_name + ' レストラン')}"
-        tabelog_url = f"https://tabelog.com/rstLst/?vs=1&sa={urllib.parse.quote(menu_name)}"
-        st.markdown(f"- [Googleで「{menu_name}」が食べられるお店を探す]({google_url})")
-        st.markdown(f"- [食べログで「{menu_name}」のお店を探す]({tabelog_url})")
+    if shop_links.restaurants:
+        st.markdown(shop_links.restaurant_markdown)
     else:
         st.write("メニューが決まると、お店検索リンクが表示されます。")
 
     st.subheader("🛒 ネットスーパーで材料を探す")
-    ingredients = []
-    if answer:
-        match = re.search(r"材料.*?\n((?:- .*\n)+)", answer)
-        if match:
-            ingredients = [line.replace("- ", "").strip() for line in match.group(1).split("\n") if line.strip()]
-    if ingredients:
-        for item in ingredients:
-            aeon_url = f"https://shop.aeon.com/netsuper/search/?keyword={urllib.parse.quote(item)}"
-            seiyu_url = f"https://sm.rakuten.co.jp/search/?q={urllib.parse.quote(item)}"
-            amazon_url = f"https://www.amazon.co.jp/s?k={urllib.parse.quote(item)}&i=grocery"
-            st.markdown(
-                f"- {item} [イオンで探す]({aeon_url}) / [西友で探す]({seiyu_url}) / [Amazonで探す]({amazon_url})"
-            )
+    if shop_links.ingredients:
+        st.markdown(shop_links.grocery_markdown)
     else:
         st.write("メニューが決まると、材料のネットスーパー検索リンクが表示されます。")
 
-# --- カロリー計算ボタン ---
-if st.button("🔥 カロリーを計算"):
-    st.subheader("📊 カロリー詳細")
+# --- カロリー計算 ---
+calorie_panel(answer, num_people)
 
-    ingredients = []
-    if answer:
-        patterns = [
-            r"材料.*?\n((?:- .+\n)+)",  # - リスト形式
-            r"材料.*?\n((?:\d+\. .+\n)+)",  # 1. 番号付きリスト
-            r"材料.*?\n((?:・.+\n)+)",  # ・ リスト形式
-            r"材料.*?[:：]\s*(.*?)(?:\n\n|\n作り方|\n手順|$)"  # : 以降の材料
-        ]
-        for pattern in patterns:
-            match = re.search(pattern, answer, re.DOTALL | re.MULTILINE)
-            if match:
-                raw_ingredients = match.group(1).strip()
-                for line in raw_ingredients.split('\n'):
-                    line = line.strip()
-                    if line and not line.startswith(('作り方', '手順', '調理法')):
-                        clean_line = re.sub(r'^[-・\d+\.\)]\s*', '', line)
-                        if clean_line:
-                            ingredients.append(clean_line)
-                break
-        if not ingredients:
-            food_keywords = [
-                '肉', '野菜', '魚', '米', '麺', '卵', '豆腐', '油', '醤油', '味噌', '塩', '砂糖',
-                '玉ねぎ', 'にんじん', 'じゃがいも', 'キャベツ', 'トマト', 'ピーマン'
-            ]
-            for line in answer.split('\n'):
-                line = line.strip()
-                if any(keyword in line for keyword in food_keywords):
-                    if not any(exclude in line for exclude in ['炒める', '煮る', '焼く', '切る', '作り方', '手順']):
-                        clean_line = re.sub(r'^[-・\d+\.\)]\s*', '', line)
-                        if clean_line and len(clean_line) < 50:
-                            ingredients.append(clean_line)
-
-    # 材料の概算カロリー辞書（100g/大さじ1あたりのカロリー）
-    calorie_dict = {
-        # ...existing code...
-    }
-
-    # 材料ごとの量入力欄を表示
-    st.write("**材料ごとの量を入力してください（gまたは大さじ数）**")
-    ingredient_amounts = {}
-    for i, item in enumerate(ingredients):
-        # デフォルトは100gまたは大さじ1
-        default_amount = 100
-        for key in calorie_dict.keys():
-            if key in item or item in key:
-                if key in ["醤油", "味噌", "酢", "みりん", "料理酒", "ケチャップ", "マヨネーズ", "ソース", "ごま油", "サラダ油", "オリーブオイル"]:
-                    default_amount = 1
-                break
-        ingredient_amounts[item] = st.number_input(
-            f"{item} の量 (gまたは大さじ)",
-            min_value=0.0,
-            value=float(default_amount),
-            step=1.0,
-            format="%f",
-            key=f"amount_{item}_{i}"
-        )
+METRICS.observe("rerun_total", time.perf_counter() - rerun_started_at)
 
-    total_calories = 0
-    table_data = []
-    for item in ingredients:
-        estimated_calories = 50
-        matched_key = "その他"
-        serving_note = "100g"
-        for key, calories in calorie_dict.items():
-            if key in item or item in key:
-                estimated_calories = calories
-                matched_key = key
-                if key in ["醤油", "味噌", "酢", "みりん", "料理酒", "ケチャップ", "マヨネーズ", "ソース", "ごま油", "サラダ油", "オリーブオイル"]:
-                    serving_note = "大さじ1"
-                else:
-                    serving_note = "100g"
-                break
-        amount = ingredient_amounts.get(item, 0)
-        # カロリー計算（調味料は大さじ1あたり、それ以外は100gあたり）
-        if serving_note == "100g":
-            cal = estimated_calories * (amount / 100)
-        else:
-            cal = estimated_calories * amount  # 大さじ数
-        total_calories += cal
-        table_data.append({
-            "材料名": item,
-            "量": f"{amount}{'g' if serving_note=='100g' else '大さじ'}",
-            "カロリー": f"{cal:.1f}kcal",
-            "基準量": serving_note,
-            "マッチング": matched_key
-        })
-
-    import pandas as pd
-    df = pd.DataFrame(table_data)
-    st.dataframe(df, use_container_width=True)
-
-    st.markdown(
-        f"""
-        <div style="
-            background-color: #fff3e0;
-            border: 2px solid #ff9800;
-            border-radius: 10px;
-            padding: 20px;
-            text-align: center;
-            margin: 20px 0;
-        ">
-            <h3 style="color: #ff9800; margin: 0;">
-                🔥 合計概算カロリー: {total_calories:.1f}kcal
-            </h3>
-            <p style="margin: 10px 0; color: #666;">
-                ({num_people}人分)
-            </p>
-        </div>
-        """,
-        unsafe_allow_html=True
-    )
-    per_person_cal = total_calories / num_people if num_people > 0 else total_calories
-    st.info(f"一人当たりのカロリー: 約{per_person_cal:.1f}kcal")
-    st.warning("※ カロリーは概算です。実際の量や調理法で変動します。")
-    if not ingredients:
-        st.error("材料リストが見つかりませんでした。AIの回答に材料が含まれていない可能性があります。")
-        
-        # DataFrameで表示
-        df = pd.DataFrame(table_data)
-        st.dataframe(df, use_container_width=True)
-        
-        # 合計カロリーをハイライト表示
-        st.markdown(
-            f"""
-            <div style="
-                background-color: #fff3e0;
-                border: 2px solid #ff9800;
-                border-radius: 10px;
-                padding: 20px;
-                text-align: center;
-                margin: 20px 0;
-            ">
-                <h3 style="color: #ff9800; margin: 0;">
-                    🔥 合計概算カロリー: {total_calories:,}kcal
-                </h3>
-                <p style="margin: 10px 0; color: #666;">
-                    ({num_people}人分)
-                </p>
-            </div>
-            """,
-            unsafe_allow_html=True
-        )
-        
-        # 一人当たりのカロリー
-        per_person_calories = total_calories // num_people if num_people > 0 else total_calories
-        st.info(f"一人当たりのカロリー: 約{per_person_calories}kcal")
-        
-        # カロリー評価
-        if per_person_calories < 300:
-            st.success("🌱 低カロリーな料理ですね！")
-        elif per_person_calories < 600:
-            st.info("⚖️ 適度なカロリーの料理です")
-        else:
-            st.warning("🔥 高カロリーな料理です。食べ過ぎに注意！")
-        
-        st.warning("※ カロリーは概算です。調理方法や分量により実際のカロリーは変動します。")
-        
-    else:
-        st.error("材料リストが見つかりませんでした。AIの回答に材料が含まれていない可能性があります。")
-
-st.markdown(
-    """
-    <style>
-    /* 横幅を広げつつ、左右に適度な余白を作る */
-    .block-container {
-        max-width: 90vw !important;
-        width: 90vw !important;
-        padding-left: 5vw !important;
-        padding-right: 5vw !important;
-    }
-    .stApp {
-        padding: 0 !important;
-        margin: 0 !important;
-    }
-    </style>
-    """,
-    unsafe_allow_html=True
-)
+# 初回表示のあと、重いモジュールの読み込みとリソースの準備をバックグラウンドで済ませておく（プロセスで1回だけ）
+start_warm_up([
+    ("client", lambda: get_client(endpoint, deployment_name, api_key)),
+    ("price_catalog", lambda: get_price_catalog(PRICES_PATH, os.path.getmtime(PRICES_PATH))),
+    ("nutrition_table", lambda: get_nutrition_table(NUTRITION_PATH, os.path.getmtime(NUTRITION_PATH))),
+    ("semantic_cache", semantic_cache.load),
+])
@@ -0,0 +1,69 @@
+import base64
+import io
+import os
+import shutil
+
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+
+_MIME_TYPES = {
+    "WEBP": "image/webp",
+    "JPEG": "image/jpeg",
+    "PNG": "image/png",
+}
+
+
+# 背景画像を縮小・再エンコードしたバイト列を作る（Pillowが無い場合は元画像のまま）
+def encode_background(src_path, image_format="WEBP", quality=80, max_width=1920):
+    image_format = (image_format or "PNG").upper()
+    try:
+        from PIL import Image
+    except ImportError:
+        with open(src_path, "rb") as f:
+            return f.read(), "PNG"
+
+    with Image.open(src_path) as img:
+        if max_width and img.width > max_width:
+            height = round(img.height * max_width / img.width)
+            img = img.resize((max_width, height), Image.LANCZOS)
+        if image_format == "JPEG" and img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+        buf = io.BytesIO()
+        if image_format == "PNG":
+            img.save(buf, format="PNG", optimize=True)
+        else:
+            img.save(buf, format=image_format, quality=quality)
+    return buf.getvalue(), image_format
+
+
+# 背景画像を static/ に書き出し、ブラウザから参照するURLを返す
+# static_serving が無効な場合は（縮小済みの）data URIを返す
+def _static_name(src_path, image_format):
+    ext = "jpg" if image_format == "JPEG" else image_format.lower()
+    # 元画像の更新時刻をファイル名に含めてブラウザのキャッシュを切り替える
+    mtime = int(os.path.getmtime(src_path))
+    return f"{os.path.splitext(os.path.basename(src_path))[0]}-{mtime}.{ext}"
+
+
+def build_background_url(src_path, image_format="WEBP", quality=80, max_width=1920, static_serving=True):
+    if static_serving:
+        # 起動前の準備（startup.py）などで書き出し済みなら変換しない
+        name = _static_name(src_path, (image_format or "PNG").upper())
+        if os.path.exists(os.path.join(STATIC_DIR, name)):
+            return f"app/static/{name}"
+
+    data, image_format = encode_background(src_path, image_format, quality, max_width)
+
+    if not static_serving:
+        b64 = base64.b64encode(data).decode()
+        return f"data:{_MIME_TYPES[image_format]};base64,{b64}"
+
+    os.makedirs(STATIC_DIR, exist_ok=True)
+    name = _static_name(src_path, image_format)
+    dest = os.path.join(STATIC_DIR, name)
+    if not os.path.exists(dest):
+        tmp = dest + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        shutil.move(tmp, dest)
+    return f"app/static/{name}"
@@ -0,0 +1,263 @@
+"""アプリ全体のベンチマーク
+
+モックの OpenAI 互換サーバ（mock_openai.py）を別プロセスで起動し、app.py を
+streamlit.testing.v1.AppTest でブラウザなしに操作して、再実行1回ごとの
+所要時間・CPU時間・メモリ・送信バイト数を測る。結果はJSONで出力する。
+
+    python bench/bench_app.py [--repeat 5] [--latency 0.3] [--output result.json]
+
+シナリオ:
+    cold_start     最初のセッションの初回表示（リソースの作成を含む）
+    submit         新しい質問を送信（AIを呼ぶ）
+    submit_cached  送信済みの質問を別のセッションで送信（キャッシュから表示）
+    slider         回答の表示後に評価のスライダーを動かす
+    cost           材料費を算出ボタンを押す
+    calorie        カロリーを計算ボタンを押す
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import urllib.request
+
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+APP_PATH = os.path.join(ROOT_DIR, "app.py")
+
+# 毎回AIを呼ぶように、質問は料理ごとに変える（回数がこれを超えると同じ質問を繰り返す）
+DISHES = [
+    "親子丼", "肉じゃが", "カレーライス", "麻婆豆腐", "豚の生姜焼き", "鮭のムニエル",
+    "ハンバーグ", "筑前煮", "餃子", "オムライス", "チャーハン", "ぶり大根",
+]
+SCENARIOS = ["cold_start", "submit", "submit_cached", "slider", "cost", "calorie"]
+
+
+def start_mock(port, latency, chunk_delay):
+    process = subprocess.Popen(
+        [
+            sys.executable, os.path.join(BENCH_DIR, "mock_openai.py"),
+            "--port", str(port), "--latency", str(latency), "--chunk-delay", str(chunk_delay),
+        ],
+        stdout=subprocess.DEVNULL,
+    )
+    # 起動を待つ
+    for _ in range(100):
+        try:
+            mock_stats(port)
+            return process
+        except OSError:
+            time.sleep(0.05)
+    process.kill()
+    raise RuntimeError("モックサーバが起動しませんでした")
+
+
+def mock_stats(port):
+    with urllib.request.urlopen(f"http://127.0.0.1:{port}/stats", timeout=2) as response:
+        return json.loads(response.read())
+
+
+# 画面に表示した要素をシリアライズしたときのバイト数（ブラウザに送る量の目安）
+def tree_bytes(node):
+    total = 0
+    proto = getattr(node, "proto", None)
+    if proto is not None and hasattr(proto, "ByteSize"):
+        total += proto.ByteSize()
+    for child in getattr(node, "children", {}).values():
+        total += tree_bytes(child)
+    return total
+
+
+def max_rss_mb():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux は KB、macOS はバイト単位
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+class Bench:
+    def __init__(self, port, timeout, trace_memory):
+        from streamlit.testing.v1 import AppTest
+        self._app_test = AppTest
+        self.port = port
+        self.timeout = timeout
+        self.trace_memory = trace_memory
+
+    def new_session(self):
+        at = self._app_test.from_file(APP_PATH, default_timeout=self.timeout)
+        at.secrets["AZURE_OPENAI_API_KEY"] = "bench"
+        at.secrets["AZURE_OPENAI_ENDPOINT"] = f"http://127.0.0.1:{self.port}"
+        at.secrets["AZURE_OPENAI_DEPLOYMENT"] = "bench"
+        return at
+
+    # action() を1回実行し、その再実行の計測値を返す
+    def measure(self, action):
+        before = mock_stats(self.port)
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+        cpu_started = time.process_time()
+        started = time.perf_counter()
+        at = action()
+        wall = time.perf_counter() - started
+        cpu = time.process_time() - cpu_started
+        after = mock_stats(self.port)
+        sample = {
+            "wall_ms": wall * 1000,
+            "cpu_ms": cpu * 1000,
+            "max_rss_mb": max_rss_mb(),
+            "browser_bytes": tree_bytes(at._tree),  # AppTest に公開APIが無いので内部の要素ツリーを使う
+            "llm_requests": after["requests"] - before["requests"],
+            "llm_bytes_sent": after["bytes_received"] - before["bytes_received"],
+            "llm_bytes_received": after["bytes_sent"] - before["bytes_sent"],
+            "errors": len(at.exception) + len(at.error),
+        }
+        if self.trace_memory:
+            sample["peak_alloc_kb"] = tracemalloc.get_traced_memory()[1] / 1024
+        return sample
+
+    def submitted_session(self, question):
+        at = self.new_session()
+        at.run()
+        at.text_input(key="user_question").input(question).run()
+        return at
+
+
+def find_button(at, text):
+    for button in at.button:
+        if text in button.label:
+            return button
+    raise LookupError(f"ボタンが見つかりません: {text}")
+
+
+def run_scenario(bench, name, repeat, counter):
+    samples = []
+    if name == "cold_start":
+        # cache_resource はプロセスで共有されるので、初回だけを1回測る
+        at = bench.new_session()
+        return [bench.measure(at.run)]
+    for _ in range(repeat):
+        question = f"{DISHES[counter[0] % len(DISHES)]}の作り方"
+        counter[0] += 1
+        if name == "submit":
+            at = bench.new_session()
+            at.run()
+            samples.append(bench.measure(lambda: at.text_input(key="user_question").input(question).run()))
+        elif name == "submit_cached":
+            bench.submitted_session(question)
+            at = bench.new_session()
+            at.run()
+            samples.append(bench.measure(lambda: at.text_input(key="user_question").input(question).run()))
+        else:
+            at = bench.submitted_session(question)
+            if name == "slider":
+                slider = next(s for s in at.slider if s.label.startswith("星を付けて"))
+                samples.append(bench.measure(lambda: slider.set_value(5 if slider.value != 5 else 4).run()))
+            elif name == "cost":
+                button = find_button(at, "材料費を算出")
+                samples.append(bench.measure(lambda: button.click().run()))
+            elif name == "calorie":
+                button = find_button(at, "カロリーを計算")
+                samples.append(bench.measure(lambda: button.click().run()))
+    return samples
+
+
+def summarize(samples):
+    def dist(values):
+        ordered = sorted(values)
+        return {
+            "mean": round(statistics.fmean(ordered), 2),
+            "p50": round(ordered[len(ordered) // 2], 2),
+            "p95": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 2),
+            "max": round(ordered[-1], 2),
+        }
+
+    summary = {
+        "runs": len(samples),
+        "wall_ms": dist([s["wall_ms"] for s in samples]),
+        "cpu_ms": dist([s["cpu_ms"] for s in samples]),
+        "max_rss_mb": round(max(s["max_rss_mb"] for s in samples), 1),
+        "browser_bytes": round(statistics.fmean(s["browser_bytes"] for s in samples)),
+        "llm_requests": sum(s["llm_requests"] for s in samples),
+        "llm_bytes_sent": sum(s["llm_bytes_sent"] for s in samples),
+        "llm_bytes_received": sum(s["llm_bytes_received"] for s in samples),
+        "errors": sum(s["errors"] for s in samples),
+    }
+    if "peak_alloc_kb" in samples[0]:
+        summary["peak_alloc_kb"] = round(max(s["peak_alloc_kb"] for s in samples), 1)
+    return summary
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--scenario", action="append", choices=SCENARIOS, help="実行するシナリオ（複数指定可）")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.3, help="モックの最初のチャンクまでの待ち時間（秒）")
+    parser.add_argument("--chunk-delay", type=float, default=0.01, help="モックのチャンク間の待ち時間（秒）")
+    parser.add_argument("--timeout", type=float, default=60, help="再実行1回のタイムアウト（秒）")
+    parser.add_argument("--trace-memory", action="store_true", help="tracemalloc でメモリ確保量のピークも測る（遅くなる）")
+    parser.add_argument("--output", help="結果のJSONを書き出すファイル（省略時は標準出力）")
+    args = parser.parse_args()
+    scenarios = args.scenario or SCENARIOS
+
+    # キャッシュ・お気に入り・レシピ集・利用量は一時ディレクトリに置き、普段の保存先を汚さない
+    work_dir = tempfile.mkdtemp(prefix="cooking-bench-")
+    os.environ["CACHE_DIR"] = os.path.join(work_dir, "cache")
+    os.environ["FAVORITES_DB_PATH"] = os.path.join(work_dir, "favorites.sqlite3")
+    os.environ["RECIPE_CORPUS_PATH"] = os.path.join(work_dir, "recipes.sqlite3")
+    os.environ["USAGE_DB_PATH"] = os.path.join(work_dir, "usage.sqlite3")
+    os.chdir(ROOT_DIR)
+
+    mock = start_mock(args.port, args.latency, args.chunk_delay)
+    try:
+        if args.trace_memory:
+            tracemalloc.start()
+        bench = Bench(args.port, args.timeout, args.trace_memory)
+        counter = [0]
+        results = {}
+        for name in scenarios:
+            results[name] = summarize(run_scenario(bench, name, args.repeat, counter))
+            print(f"{name}: {results[name]['wall_ms']['mean']}ms", file=sys.stderr)
+    finally:
+        mock.terminate()
+        mock.wait()
+
+    import streamlit
+    report = {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "streamlit": streamlit.__version__,
+        "config": {
+            "repeat": args.repeat,
+            "latency": args.latency,
+            "chunk_delay": args.chunk_delay,
+            "trace_memory": args.trace_memory,
+        },
+        "scenarios": results,
+    }
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""材料抽出のベンチマーク
+
+保存済みのAI回答（answers.jsonl）を使って、材料抽出の処理時間と抽出率（recall）を測る。
+比較のため、以前 app.py に書かれていた抽出処理も同じ条件で測定する。
+
+    python bench/bench_ingredients.py [--repeat 200]
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import ingredients  # noqa: E402
+
+
+CORPUS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "answers.jsonl")
+
+
+# 以前の app.py の材料費ブロックと同じ抽出処理（比較用）
+def legacy_extract(answer):
+    result = []
+    patterns = [
+        r"材料.*?\n((?:- .*\n)+)",
+        r"材料.*?\n((?:\d+\..*\n)+)",
+        r"材料.*?\n((?:・.*\n)+)",
+        r"材料.*?[:：]\s*(.*?)(?:\n\n|\n作り方|\n手順|$)",
+    ]
+    for pattern in patterns:
+        match = re.search(pattern, answer, re.DOTALL | re.MULTILINE)
+        if match:
+            for line in match.group(1).strip().split('\n'):
+                line = line.strip()
+                if line and not line.startswith(('作り方', '手順', '調理法')):
+                    clean_line = re.sub(r'^[-・\d+\.\)]\s*', '', line)
+                    if clean_line:
+                        result.append(clean_line)
+            break
+    if not result:
+        for line in answer.split('\n'):
+            line = line.strip()
+            if any(keyword in line for keyword in ingredients.FOOD_KEYWORDS):
+                if not any(exclude in line for exclude in ['炒める', '煮る', '焼く', '切る', '作り方', '手順']):
+                    clean_line = re.sub(r'^[-・\d+\.\)]\s*', '', line)
+                    if clean_line and len(clean_line) < 50:
+                        result.append(clean_line)
+    return result
+
+
+def new_extract_cold(answer):
+    ingredients._cache.clear()
+    return [ingredient.text for ingredient in ingredients.extract_ingredients(answer)]
+
+
+def new_extract_warm(answer):
+    return [ingredient.text for ingredient in ingredients.extract_ingredients(answer)]
+
+
+# 期待する材料名のうち、抽出結果のどれかの行に含まれているものの割合
+# 余計な行（作り方の手順など）を拾った数も precision として出す
+def score(extracted, expected):
+    found = sum(1 for name in expected if any(name in line for line in extracted))
+    relevant = sum(1 for line in extracted if any(name in line for name in expected))
+    recall = found / len(expected) if expected else 1.0
+    precision = relevant / len(extracted) if extracted else 0.0
+    return recall, precision
+
+
+def run(name, func, corpus, repeat):
+    recalls = []
+    precisions = []
+    for item in corpus:
+        recall, precision = score(func(item["answer"]), item["expected"])
+        recalls.append(recall)
+        precisions.append(precision)
+
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for item in corpus:
+            func(item["answer"])
+    elapsed = time.perf_counter() - started
+    per_answer_us = elapsed / (repeat * len(corpus)) * 1e6
+
+    return {
+        "name": name,
+        "answers": len(corpus),
+        "per_answer_us": round(per_answer_us, 2),
+        "recall": round(sum(recalls) / len(recalls), 3),
+        "precision": round(sum(precisions) / len(precisions), 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--corpus", default=CORPUS_PATH)
+    args = parser.parse_args()
+
+    with open(args.corpus, encoding="utf-8") as f:
+        corpus = [json.loads(line) for line in f if line.strip()]
+
+    results = [
+        run("legacy", legacy_extract, corpus, args.repeat),
+        run("extract_ingredients (cold)", new_extract_cold, corpus, args.repeat),
+        run("extract_ingredients (memoized)", new_extract_warm, corpus, args.repeat),
+    ]
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+"""ワーカー数を変えたときのスループットのベンチマーク
+
+launch_workers.py で複数のワーカーを動かしたときと同じように、ワーカーごとに別のプロセスで
+app.py を AppTest で動かし、共有バックエンド（STATE_BACKEND）を使って質問を送信する。
+全ワーカーの準備（初回表示）が終わってから一斉に始め、1秒あたりに処理できた質問数を測る。
+
+    python bench/bench_workers.py [--workers 1 2 4] [--requests 3] [--backend sqlite|redis]
+
+回答キャッシュとレシピ集はワーカー間で共有されるので、質問は回ごと・ワーカーごとに別の料理にし、
+回ごとに新しい作業ディレクトリを使う（ワーカー数×質問数が料理の数を超えると共有キャッシュから答える）。
+
+--backend redis のときは mock_redis.py（Redis 互換のサーバ）を起動して使う。
+"""
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+from bench_app import APP_PATH, BENCH_DIR, DISHES, ROOT_DIR, git_commit, mock_stats, start_mock
+
+
+def start_mock_redis(port):
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(BENCH_DIR, "mock_redis.py"), "--port", str(port)], stdout=subprocess.DEVNULL
+    )
+    for _ in range(100):
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return process
+        except OSError:
+            time.sleep(0.05)
+    process.kill()
+    raise RuntimeError("Redis 互換サーバが起動しませんでした")
+
+
+# 前の回の回答・カウンタを消す
+def flush_redis(port):
+    with socket.create_connection(("127.0.0.1", port), timeout=5) as sock:
+        sock.sendall(b"*1\r\n$7\r\nFLUSHDB\r\n")
+        sock.recv(64)
+
+
+# ワーカー1つ分（子プロセスで実行する）: 準備ができたら ready を出し、go を受け取ったら質問を送る
+def run_worker(worker_id, requests, port, timeout):
+    from streamlit.testing.v1 import AppTest
+
+    def new_session():
+        at = AppTest.from_file(APP_PATH, default_timeout=timeout)
+        at.secrets["AZURE_OPENAI_API_KEY"] = "bench"
+        at.secrets["AZURE_OPENAI_ENDPOINT"] = f"http://127.0.0.1:{port}"
+        at.secrets["AZURE_OPENAI_DEPLOYMENT"] = "bench"
+        return at
+
+    new_session().run()
+    print("ready", flush=True)
+    sys.stdin.readline()
+
+    errors = 0
+    started = time.perf_counter()
+    for i in range(requests):
+        # ワーカーごとに違う料理にして、共有キャッシュに当たらないようにする
+        question = f"{DISHES[(worker_id * requests + i) % len(DISHES)]}の作り方"
+        at = new_session()
+        at.run()
+        at.text_input(key="user_question").input(question).run()
+        errors += len(at.exception) + len(at.error)
+    print(json.dumps({"requests": requests, "seconds": time.perf_counter() - started, "errors": errors}), flush=True)
+
+
+def run_round(workers, requests, port, timeout, env):
+    # 前の回の回答が共有キャッシュ・レシピ集に残らないよう、回ごとに作業ディレクトリを分ける
+    work_dir = tempfile.mkdtemp(prefix="cooking-bench-workers-")
+    env = dict(env)
+    env.update({
+        "CACHE_DIR": os.path.join(work_dir, "cache"),
+        "FAVORITES_DB_PATH": os.path.join(work_dir, "favorites.sqlite3"),
+        "RECIPE_CORPUS_PATH": os.path.join(work_dir, "recipes.sqlite3"),
+        "USAGE_DB_PATH": os.path.join(work_dir, "usage.sqlite3"),
+    })
+    if not env.get("STATE_BACKEND"):
+        env["STATE_BACKEND"] = "sqlite:///" + os.path.join(work_dir, "state.sqlite3").lstrip("/")
+    processes = [
+        subprocess.Popen(
+            [
+                sys.executable, os.path.abspath(__file__), "--worker-id", str(i),
+                "--requests", str(requests), "--port", str(port), "--timeout", str(timeout),
+            ],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True, env=env, cwd=ROOT_DIR,
+        )
+        for i in range(workers)
+    ]
+    try:
+        for process in processes:
+            if process.stdout.readline().strip() != "ready":
+                raise RuntimeError("ワーカーの準備に失敗しました")
+        before = mock_stats(port)
+        started = time.perf_counter()
+        for process in processes:
+            process.stdin.write("go\n")
+            process.stdin.flush()
+        reports = [json.loads(process.stdout.readline()) for process in processes]
+        wall = time.perf_counter() - started
+        after = mock_stats(port)
+    finally:
+        for process in processes:
+            process.stdin.close()
+            process.wait()
+    total = sum(report["requests"] for report in reports)
+    return {
+        "workers": workers,
+        "requests": total,
+        "wall_seconds": round(wall, 3),
+        "throughput_rps": round(total / wall, 3),
+        "llm_requests": after["requests"] - before["requests"],
+        "errors": sum(report["errors"] for report in reports),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--requests", type=int, default=3, help="ワーカー1つあたりの質問数")
+    parser.add_argument("--backend", choices=["sqlite", "redis"], default="sqlite")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--redis-port", type=int, default=6390)
+    parser.add_argument("--latency", type=float, default=0.3, help="モックの最初のチャンクまでの待ち時間（秒）")
+    parser.add_argument("--chunk-delay", type=float, default=0.01, help="モックのチャンク間の待ち時間（秒）")
+    parser.add_argument("--timeout", type=float, default=60, help="再実行1回のタイムアウト（秒）")
+    parser.add_argument("--output", help="結果のJSONを書き出すファイル（省略時は標準出力）")
+    parser.add_argument("--worker-id", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker_id is not None:
+        run_worker(args.worker_id, args.requests, args.port, args.timeout)
+        return
+
+    env = dict(os.environ)
+    env.pop("STATE_BACKEND", None)
+    # ベンチマークではレート制限で待たないようにする（上限の共有そのものは有効）
+    env["LLM_REQUESTS_PER_MINUTE"] = "100000"
+    env["LLM_TOKENS_PER_MINUTE"] = "100000000"
+    servers = [start_mock(args.port, args.latency, args.chunk_delay)]
+    try:
+        if args.backend == "redis":
+            servers.append(start_mock_redis(args.redis_port))
+            env["STATE_BACKEND"] = f"redis://127.0.0.1:{args.redis_port}/0"
+        rounds = []
+        for workers in args.workers:
+            if args.backend == "redis":
+                flush_redis(args.redis_port)
+            rounds.append(run_round(workers, args.requests, args.port, args.timeout, env))
+            print(f"workers={workers}: {rounds[-1]['throughput_rps']} req/s", file=sys.stderr)
+    finally:
+        for server in servers:
+            server.terminate()
+            server.wait()
+
+    base = rounds[0]["throughput_rps"] / rounds[0]["workers"]
+    for result in rounds:
+        # ワーカー1つあたりのスループットが最初の回と比べてどれだけ保たれているか（1.0 なら線形）
+        result["scaling_efficiency"] = round(result["throughput_rps"] / (base * result["workers"]), 3)
+    report = {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "config": {
+            "requests_per_worker": args.requests,
+            "backend": args.backend,
+            "latency": args.latency,
+            "chunk_delay": args.chunk_delay,
+            "cpu_count": os.cpu_count(),
+        },
+        "rounds": rounds,
+    }
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
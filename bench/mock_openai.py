@@ -0,0 +1,178 @@
+"""ベンチマーク用の OpenAI 互換モックサーバ
+
+Azure OpenAI の代わりに、保存済みの回答（answers.jsonl）を順番に返す。
+ストリーミング・json_schema・usage・max_tokens（文字数で打ち切り）に対応し、応答までの待ち時間を設定できる。
+
+    python bench/mock_openai.py [--port 8765] [--latency 0.3] [--chunk-delay 0.01]
+
+GET /stats で受け取ったリクエスト数とバイト数を返す。
+"""
+import argparse
+import itertools
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+CORPUS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "answers.jsonl")
+
+# 構造化出力（json_schema）で返すレシピ
+STRUCTURED_RECIPE = {
+    "dish_name": "親子丼",
+    "ingredients": [
+        {"name": "鶏もも肉", "quantity": 200, "unit": "g"},
+        {"name": "玉ねぎ", "quantity": 0.5, "unit": "個"},
+        {"name": "卵", "quantity": 3, "unit": "個"},
+        {"name": "醤油", "quantity": 2, "unit": "大さじ"},
+    ],
+    "steps": ["玉ねぎを薄切りにする", "鶏肉と玉ねぎを煮る", "溶き卵を回し入れる"],
+    "dessert_suggestions": ["抹茶プリン"],
+    "drink_suggestions": ["ほうじ茶"],
+    "estimated_kcal": 650,
+}
+
+
+def load_answers(path=CORPUS_PATH):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line)["answer"] for line in f if line.strip()]
+
+
+# 回答の文字数からおおよそのトークン数を作る（usage 用）
+def _usage(prompt_chars, completion_chars):
+    return {
+        "prompt_tokens": prompt_chars,
+        "completion_tokens": completion_chars,
+        "total_tokens": prompt_chars + completion_chars,
+    }
+
+
+def make_handler(answers, latency, chunk_delay, chunk_size):
+    answer_cycle = itertools.cycle(answers)
+    lock = threading.Lock()
+    stats = {"requests": 0, "bytes_received": 0, "bytes_sent": 0}
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def _send(self, data, content_type, count=True):
+            self.send_response(200)
+            self.send_header("content-type", content_type)
+            self.send_header("content-length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+            if count:
+                with lock:
+                    stats["bytes_sent"] += len(data)
+
+        def do_GET(self):
+            if self.path.rstrip("/") == "/stats":
+                with lock:
+                    data = json.dumps(stats).encode("utf-8")
+                self._send(data, "application/json", count=False)  # 計測用の通信は数えない
+            else:
+                self.send_error(404)
+
+        def do_POST(self):
+            raw = self.rfile.read(int(self.headers.get("content-length", 0)))
+            body = json.loads(raw or b"{}")
+            with lock:
+                stats["requests"] += 1
+                stats["bytes_received"] += len(raw)
+                content = next(answer_cycle)
+            response_format = body.get("response_format") or {}
+            finish_reason = "stop"
+            if response_format.get("type") == "json_schema":
+                content = json.dumps(STRUCTURED_RECIPE, ensure_ascii=False)
+            elif body.get("max_tokens") and len(content) > body["max_tokens"]:
+                # usage と同じく1文字1トークンとして、上限で打ち切る
+                content = content[:body["max_tokens"]]
+                finish_reason = "length"
+            prompt_chars = sum(len(message.get("content") or "") for message in body.get("messages", []))
+            usage = _usage(prompt_chars, len(content))
+
+            time.sleep(latency)
+            if body.get("stream"):
+                self._stream(content, usage, finish_reason)
+                return
+            data = json.dumps({
+                "id": "mock", "object": "chat.completion", "created": int(time.time()), "model": body.get("model", "mock"),
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": finish_reason}],
+                "usage": usage,
+            }, ensure_ascii=False).encode("utf-8")
+            self._send(data, "application/json")
+
+        def _stream(self, content, usage, finish_reason="stop"):
+            self.send_response(200)
+            self.send_header("content-type", "text/event-stream")
+            self.send_header("transfer-encoding", "chunked")
+            self.end_headers()
+
+            def write_event(payload):
+                data = ("data: " + payload + "\n\n").encode("utf-8")
+                self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+                self.wfile.flush()
+                with lock:
+                    stats["bytes_sent"] += len(data)
+
+            for start in range(0, len(content), chunk_size):
+                write_event(json.dumps({
+                    "id": "mock", "object": "chat.completion.chunk", "created": 0, "model": "mock",
+                    "choices": [{"index": 0, "delta": {"content": content[start:start + chunk_size]}, "finish_reason": None}],
+                }, ensure_ascii=False))
+                time.sleep(chunk_delay)
+            write_event(json.dumps({
+                "id": "mock", "object": "chat.completion.chunk", "created": 0, "model": "mock",
+                "choices": [{"index": 0, "delta": {}, "finish_reason": finish_reason}],
+            }))
+            # usage は最後のチャンクで返す
+            write_event(json.dumps({
+                "id": "mock", "object": "chat.completion.chunk", "created": 0, "model": "mock",
+                "choices": [], "usage": usage,
+            }))
+            write_event("[DONE]")
+            self.wfile.write(b"0\r\n\r\n")
+            self.wfile.flush()
+
+    return Handler
+
+
+class MockServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    # クライアントが接続を閉じただけのときはトレースバックを出さない
+    def handle_error(self, request, client_address):
+        if isinstance(sys.exc_info()[1], (ConnectionResetError, BrokenPipeError)):
+            return
+        super().handle_error(request, client_address)
+
+
+def create_server(port=8765, latency=0.3, chunk_delay=0.01, chunk_size=8, answers=None):
+    handler = make_handler(answers or load_answers(), latency, chunk_delay, chunk_size)
+    return MockServer(("127.0.0.1", port), handler)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.3, help="最初のチャンクまでの待ち時間（秒）")
+    parser.add_argument("--chunk-delay", type=float, default=0.01, help="チャンク間の待ち時間（秒）")
+    parser.add_argument("--chunk-size", type=int, default=8, help="1チャンクの文字数")
+    parser.add_argument("--corpus", default=CORPUS_PATH)
+    args = parser.parse_args()
+
+    server = create_server(args.port, args.latency, args.chunk_delay, args.chunk_size, load_answers(args.corpus))
+    print(f"mock OpenAI server: http://127.0.0.1:{args.port}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
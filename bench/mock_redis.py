@@ -0,0 +1,162 @@
+"""ベンチマーク・動作確認用の Redis 互換サーバ（RESP2）
+
+state_backend.RedisBackend が使うコマンド（PING / AUTH / SELECT / GET / SET [EX|PX] / DEL /
+INCRBY / PEXPIRE / MGET / FLUSHDB / WATCH / UNWATCH / MULTI / EXEC）だけに対応する。データはメモリ上にだけ持つ。
+
+    python bench/mock_redis.py [--port 6390]
+"""
+import argparse
+import socket
+import socketserver
+import threading
+import time
+
+
+class Store:
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.data = {}  # key -> (value, expires_at)
+        self.versions = {}  # key -> 書き込まれた回数（WATCH の確認用）
+
+    def touch(self, *keys):
+        for key in keys:
+            self.versions[key] = self.versions.get(key, 0) + 1
+
+    def live(self, key):
+        entry = self.data.get(key)
+        if entry is not None and entry[1] is not None and entry[1] <= time.time():
+            del self.data[key]
+            return None
+        return entry
+
+
+def _bulk(value):
+    if value is None:
+        return b"$-1\r\n"
+    return b"$%d\r\n%s\r\n" % (len(value), value)
+
+
+def _error(message):
+    return b"-ERR " + message.encode("utf-8") + b"\r\n"
+
+
+def execute(store, args):
+    command = args[0].upper().decode("ascii", "replace")
+    with store.lock:
+        if command in ("PING", "AUTH", "SELECT"):
+            return b"+PONG\r\n" if command == "PING" else b"+OK\r\n"
+        if command == "GET":
+            entry = store.live(args[1])
+            return _bulk(entry[0] if entry else None)
+        if command == "SET":
+            expires_at = None
+            if len(args) >= 5:
+                unit = args[3].upper()
+                expires_at = time.time() + int(args[4]) / (1000 if unit == b"PX" else 1)
+            store.data[args[1]] = (args[2], expires_at)
+            store.touch(args[1])
+            return b"+OK\r\n"
+        if command == "DEL":
+            removed = sum(1 for key in args[1:] if store.data.pop(key, None) is not None)
+            store.touch(*args[1:])
+            return b":%d\r\n" % removed
+        if command == "INCRBY":
+            entry = store.live(args[1])
+            try:
+                value = (int(entry[0]) if entry else 0) + int(args[2])
+            except ValueError:
+                return _error("value is not an integer or out of range")
+            store.data[args[1]] = (str(value).encode("ascii"), entry[1] if entry else None)
+            store.touch(args[1])
+            return b":%d\r\n" % value
+        if command == "PEXPIRE":
+            entry = store.live(args[1])
+            if entry is None:
+                return b":0\r\n"
+            store.data[args[1]] = (entry[0], time.time() + int(args[2]) / 1000)
+            store.touch(args[1])
+            return b":1\r\n"
+        if command == "MGET":
+            values = [store.live(key) for key in args[1:]]
+            return b"*%d\r\n" % len(values) + b"".join(_bulk(entry[0] if entry else None) for entry in values)
+        if command == "FLUSHDB":
+            store.touch(*store.data)
+            store.data.clear()
+            return b"+OK\r\n"
+    return _error(f"unknown command '{command}'")
+
+
+def make_handler(store):
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            # パイプラインの応答を小分けに書くので、Nagle で待たされないようにする
+            self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            watched = {}  # WATCH したキー -> そのときの書き込み回数
+            queued = None  # MULTI のあとに積んだコマンド
+            while True:
+                line = self.rfile.readline()
+                if not line:
+                    return
+                if not line.startswith(b"*"):
+                    self.wfile.write(_error("inline commands are not supported"))
+                    continue
+                args = []
+                for _ in range(int(line[1:])):
+                    length = int(self.rfile.readline()[1:])
+                    args.append(self.rfile.read(length + 2)[:-2])
+                command = args[0].upper()
+                if command == b"WATCH":
+                    with store.lock:
+                        watched.update((key, store.versions.get(key, 0)) for key in args[1:])
+                    self.wfile.write(b"+OK\r\n")
+                elif command == b"UNWATCH":
+                    watched.clear()
+                    self.wfile.write(b"+OK\r\n")
+                elif command == b"MULTI":
+                    queued = []
+                    self.wfile.write(b"+OK\r\n")
+                elif command == b"EXEC":
+                    if queued is None:
+                        self.wfile.write(_error("EXEC without MULTI"))
+                        continue
+                    with store.lock:
+                        # WATCH したキーが書き換えられていたら何も実行しない
+                        if any(store.versions.get(key, 0) != version for key, version in watched.items()):
+                            reply = b"*-1\r\n"
+                        else:
+                            reply = b"*%d\r\n" % len(queued) + b"".join(execute(store, queued_args) for queued_args in queued)
+                    watched.clear()
+                    queued = None
+                    self.wfile.write(reply)
+                elif queued is not None:
+                    queued.append(args)
+                    self.wfile.write(b"+QUEUED\r\n")
+                else:
+                    self.wfile.write(execute(store, args))
+
+    return Handler
+
+
+class MockRedisServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def create_server(port=6390):
+    return MockRedisServer(("127.0.0.1", port), make_handler(Store()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=6390)
+    args = parser.parse_args()
+    server = create_server(args.port)
+    print(f"mock Redis server: redis://127.0.0.1:{args.port}/0", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+# 会話の続き（追加の要望）をAIに送るときのメッセージ組み立て
+
+from prompt_builder import FOLLOWUP_INSTRUCTION, SYSTEM_PROMPT
+
+SUMMARY_HEADER = "これまでのやり取りの要約（省略した部分）:"
+
+
+# トークン数の目安（英数字は4文字で1トークン、日本語は1文字1トークンとして数える）
+def estimate_tokens(text):
+    ascii_chars = sum(1 for ch in text if ord(ch) < 128)
+    return (ascii_chars + 3) // 4 + (len(text) - ascii_chars) + 4  # 4: メッセージごとのオーバーヘッド
+
+
+# 省略するやり取りを1行ずつの要約にする（AIは呼ばず、各回答の先頭行と要望だけを残す）
+def summarize_turns(turns):
+    lines = []
+    for turn in turns:
+        first_line = next((line.strip() for line in turn["content"].splitlines() if line.strip()), "")
+        label = "要望" if turn["role"] == "user" else "回答"
+        lines.append(f"- {label}: {first_line[:60]}")
+    return "\n".join(lines)
+
+
+# 送信するメッセージを作る
+# 最初のやり取り（元のレシピ）は固定で残し、その後の古いやり取りから省略して budget に収める
+# 戻り値: (messages, {"tokens": 推定トークン数, "dropped": 省略したやり取りの数})
+def build_messages(base_turns, history, followup, budget=3000):
+    head = [{"role": "system", "content": SYSTEM_PROMPT}] + list(base_turns)
+    # システムプロンプトは最初の質問と同じものを使い、修正の指示は要望の前に付ける
+    # （システムプロンプト・最初の質問が最初の回答のときと同じ並びになり、プロンプトキャッシュが効く）
+    tail = [{"role": "user", "content": FOLLOWUP_INSTRUCTION + followup}]
+    fixed_tokens = sum(estimate_tokens(m["content"]) for m in head + tail)
+
+    # 新しいやり取りから順に、予算に収まる分だけ残す（ユーザーの要望と回答の組で扱う）
+    pairs = [history[i:i + 2] for i in range(0, len(history), 2)]
+    kept = []
+    used = fixed_tokens
+    dropped = []
+    for index in range(len(pairs) - 1, -1, -1):
+        pair_tokens = sum(estimate_tokens(m["content"]) for m in pairs[index])
+        if used + pair_tokens <= budget:
+            kept.insert(0, pairs[index])
+            used += pair_tokens
+        else:
+            dropped = [turn for pair in pairs[:index + 1] for turn in pair]
+            break
+
+    summary = []
+    if dropped:
+        summary_text = f"{SUMMARY_HEADER}\n{summarize_turns(dropped)}"
+        summary = [{"role": "system", "content": summary_text}]
+        used += estimate_tokens(summary_text)
+
+    # 履歴に付けた表示用の項目（途中までかどうかなど）は送らない
+    turns = [{"role": turn["role"], "content": turn["content"]} for pair in kept for turn in pair]
+    messages = head + summary + turns + tail
+    return messages, {"tokens": used, "dropped": len(dropped) // 2}
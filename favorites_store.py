@@ -0,0 +1,316 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import namedtuple
+
+from ingredients import Ingredient
+from state_backend import SharedLog
+
+
+# 保存したレシピ1件分（ingredients は Ingredient のリスト）
+Favorite = namedtuple(
+    "Favorite", ["id", "title", "question", "answer", "ingredients", "rating", "created_at", "updated_at"]
+)
+
+_COLUMNS = "id, title, question, answer, ingredients, rating, created_at, updated_at"
+
+
+# 回答の内容からキーを作る（先頭が同じ別の回答とは区別される）
+def recipe_id(answer):
+    text = unicodedata.normalize("NFKC", answer or "").strip()
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+# 一覧に表示するタイトル（回答の最初の行から見出し記号を除いたもの）
+def recipe_title(answer):
+    for line in (answer or "").splitlines():
+        title = line.strip().strip("#*【】[] ").replace("メニュー", "").strip(":： ")
+        if title:
+            return title[:60]
+    return "（無題）"
+
+
+def _row_to_favorite(row):
+    ingredients = [Ingredient(*item) for item in json.loads(row[4])]
+    return Favorite(row[0], row[1], row[2], row[3], ingredients, row[5], row[6], row[7])
+
+
+# お気に入りと評価の保存先（SQLite。全セッション・全ワーカーで共有する）
+class FavoritesStore:
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, timeout=10)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS favorites ("
+            " id TEXT NOT NULL UNIQUE,"
+            " title TEXT NOT NULL,"
+            " question TEXT NOT NULL,"
+            " answer TEXT NOT NULL,"
+            " ingredients TEXT NOT NULL,"
+            " rating INTEGER NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " updated_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_favorites_created ON favorites(created_at)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_favorites_rating ON favorites(rating, created_at)")
+        # 全文検索（日本語は単語に区切れないので trigram を使う。FTS5 が無い環境では LIKE で検索する）
+        try:
+            self._conn.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS favorites_fts USING fts5("
+                " title, answer, ingredient_names, tokenize='trigram')"
+            )
+            self.full_text_search = True
+        except sqlite3.OperationalError:
+            self.full_text_search = False
+        self._conn.commit()
+
+    def _index(self, rowid, title, answer, ingredients):
+        if not self.full_text_search:
+            return
+        self._conn.execute("DELETE FROM favorites_fts WHERE rowid = ?", (rowid,))
+        self._conn.execute(
+            "INSERT INTO favorites_fts (rowid, title, answer, ingredient_names) VALUES (?, ?, ?, ?)",
+            (rowid, title, answer, " ".join(ingredient.name for ingredient in ingredients)),
+        )
+
+    def get(self, favorite_id):
+        if not favorite_id:
+            return None
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT {_COLUMNS} FROM favorites WHERE id = ?", (favorite_id,)
+            ).fetchone()
+        return _row_to_favorite(row) if row else None
+
+    def is_favorite(self, favorite_id):
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM favorites WHERE id = ?", (favorite_id,)).fetchone() is not None
+
+    # 1件分の書き込み（_save_row / _set_rating_row / _remove_row）。self._lock を持って呼び、commit は呼び出し側で行う
+    def _save_row(self, question, answer, ingredients, rating, now):
+        favorite_id = recipe_id(answer)
+        title = recipe_title(answer)
+        self._conn.execute(
+            "INSERT INTO favorites (id, title, question, answer, ingredients, rating, created_at, updated_at)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+            " ON CONFLICT(id) DO UPDATE SET rating = excluded.rating, updated_at = excluded.updated_at",
+            (
+                favorite_id, title, question, answer,
+                json.dumps([list(ingredient) for ingredient in ingredients], ensure_ascii=False),
+                int(rating), now, now,
+            ),
+        )
+        rowid = self._conn.execute("SELECT rowid FROM favorites WHERE id = ?", (favorite_id,)).fetchone()[0]
+        self._index(rowid, title, answer, ingredients)
+        return favorite_id
+
+    def _set_rating_row(self, favorite_id, rating, now):
+        self._conn.execute(
+            "UPDATE favorites SET rating = ?, updated_at = ? WHERE id = ? AND rating != ?",
+            (int(rating), now, favorite_id, int(rating)),
+        )
+
+    def _remove_row(self, favorite_id):
+        row = self._conn.execute("SELECT rowid FROM favorites WHERE id = ?", (favorite_id,)).fetchone()
+        if row is None:
+            return
+        if self.full_text_search:
+            self._conn.execute("DELETE FROM favorites_fts WHERE rowid = ?", (row[0],))
+        self._conn.execute("DELETE FROM favorites WHERE rowid = ?", (row[0],))
+
+    # 回答全文・材料・評価を保存する（同じ回答なら上書き）。戻り値はキー
+    def save(self, question, answer, ingredients, rating, now=None):
+        with self._lock:
+            favorite_id = self._save_row(question, answer, ingredients, rating, time.time() if now is None else now)
+            self._conn.commit()
+        return favorite_id
+
+    def set_rating(self, favorite_id, rating, now=None):
+        with self._lock:
+            self._set_rating_row(favorite_id, rating, time.time() if now is None else now)
+            self._conn.commit()
+
+    def remove(self, favorite_id):
+        with self._lock:
+            self._remove_row(favorite_id)
+            self._conn.commit()
+
+    # 検索条件（WHERE句とパラメータ）。trigram は3文字以上の語しか引けないので、短い語は LIKE で探す
+    def _where(self, query):
+        terms = (query or "").split()
+        if not terms:
+            return "", []
+        clauses, params = [], []
+        fts_terms = [term for term in terms if self.full_text_search and len(term) >= 3]
+        if fts_terms:
+            clauses.append("rowid IN (SELECT rowid FROM favorites_fts WHERE favorites_fts MATCH ?)")
+            params.append(" AND ".join('"' + term.replace('"', '""') + '"' for term in fts_terms))
+        for term in terms:
+            if term in fts_terms:
+                continue
+            pattern = "%" + term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+            clauses.append("(title LIKE ? ESCAPE '\\' OR answer LIKE ? ESCAPE '\\')")
+            params += [pattern, pattern]
+        return " WHERE " + " AND ".join(clauses), params
+
+    def count(self, query=None):
+        where, params = self._where(query)
+        with self._lock:
+            return self._conn.execute(f"SELECT COUNT(*) FROM favorites{where}", params).fetchone()[0]
+
+    # 新しい順に1ページ分を返す（page は0始まり）
+    def page(self, page=0, page_size=5, query=None):
+        where, params = self._where(query)
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT {_COLUMNS} FROM favorites{where} ORDER BY created_at DESC LIMIT ? OFFSET ?",
+                params + [page_size, page * page_size],
+            ).fetchall()
+        return [_row_to_favorite(row) for row in rows]
+
+
+# お気に入りを state_backend で全サーバと共有する（STATE_BACKEND に Redis を指定したとき）
+# 登録・評価・解除はバックエンドのログ（SharedLog）に追記し、各ワーカーはそれを手元の SQLite に反映して
+# 検索・ページ送りはこれまでどおり SQLite で行う（手元の SQLite は共有ログの複製）
+# - どこまで反映したかは SQLite の中に記録する。同じサーバのワーカーが同じファイルを使っても、変更は1回だけ反映される
+# - ログは max_log_entries 件だけ残す。snapshot_every 件ごとに全件をスナップショットとしてバックエンドに置き、
+#   消えたログより前から読むことになったワーカー（新しく足したサーバなど）はスナップショットから始める
+class SharedFavoritesStore(FavoritesStore):
+    def __init__(self, db_path, backend, sync_interval=1.0, max_log_entries=1000, snapshot_every=500):
+        super().__init__(db_path)
+        self.backend = backend
+        self._log = SharedLog(backend, "favorites", max_entries=max_log_entries)
+        self.snapshot_every = snapshot_every
+        # 読むたびにバックエンドを確認しないよう、この秒数の間は手元の複製をそのまま使う
+        self.sync_interval = sync_interval
+        self._synced_at = None
+        self._missing = {}  # 番号 -> 最初に見つからなかった時刻
+        with self._lock:
+            self._conn.execute("CREATE TABLE IF NOT EXISTS favorites_sync (position INTEGER NOT NULL)")
+            if self._conn.execute("SELECT COUNT(*) FROM favorites_sync").fetchone()[0] == 0:
+                self._conn.execute("INSERT INTO favorites_sync (position) VALUES (0)")
+            self._conn.commit()
+
+    def _apply(self, event):
+        if event["op"] == "save":
+            ingredients = [Ingredient(*item) for item in event["ingredients"]]
+            self._save_row(event["question"], event["answer"], ingredients, event["rating"], event["at"])
+        elif event["op"] == "rating":
+            self._set_rating_row(event["id"], event["rating"], event["at"])
+        elif event["op"] == "remove":
+            self._remove_row(event["id"])
+
+    # スナップショットの内容で手元の SQLite を置き換えて、その番号を返す（無い・古いときは position のまま）
+    def _load_snapshot(self, position):
+        value = self.backend.get("favorites:snapshot")
+        if value is None:
+            return position
+        snapshot = json.loads(value)
+        if snapshot["position"] <= position:
+            return position
+        self._conn.execute("DELETE FROM favorites")
+        if self.full_text_search:
+            self._conn.execute("DELETE FROM favorites_fts")
+        for row in snapshot["favorites"]:
+            self._conn.execute(f"INSERT INTO favorites ({_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?)", row)
+            favorite = _row_to_favorite(row)
+            rowid = self._conn.execute("SELECT rowid FROM favorites WHERE id = ?", (favorite.id,)).fetchone()[0]
+            self._index(rowid, favorite.title, favorite.answer, favorite.ingredients)
+        return snapshot["position"]
+
+    # 他のワーカーの変更を手元の SQLite に反映する
+    def sync(self, force=False):
+        now = time.monotonic()
+        if not force and self._synced_at is not None and now - self._synced_at < self.sync_interval:
+            return
+        self._synced_at = now
+        with self._lock:
+            if self._conn.execute("SELECT position FROM favorites_sync").fetchone()[0] == self._log.latest():
+                return
+            # 同じファイルを使う他のワーカーと同時に反映しないよう、書き込みロックを取ってから位置を読む
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                position = self._conn.execute("SELECT position FROM favorites_sync").fetchone()[0]
+                latest = self._log.latest()
+                if latest < position:
+                    # バックエンドが空になった（作り直された）ので最初から読む
+                    position = 0
+                oldest = latest - self._log.max_entries
+                if position < oldest:
+                    # 読みたいログがもう消えているので、スナップショットから始める
+                    position = max(self._load_snapshot(position), oldest)
+                for seq, value in self._log.read_range(position + 1, latest):
+                    if value is None:
+                        # 番号を取ってから書き込むまでの間なら、次の同期で読み直す
+                        # 書き込む前に止まったワーカーの番号は missing_grace 秒で諦める
+                        if now - self._missing.setdefault(seq, now) <= self._log.missing_grace:
+                            break
+                    else:
+                        self._apply(json.loads(value))
+                    self._missing.pop(seq, None)
+                    position = seq
+                self._conn.execute("UPDATE favorites_sync SET position = ?", (position,))
+                self._conn.commit()
+            except BaseException:
+                self._conn.rollback()
+                raise
+
+    # 手元の SQLite の全件をスナップショットとしてバックエンドに置く（他のワーカーが置いたものより新しいときだけ）
+    def _save_snapshot(self):
+        with self._lock:
+            position = self._conn.execute("SELECT position FROM favorites_sync").fetchone()[0]
+            rows = self._conn.execute(f"SELECT {_COLUMNS} FROM favorites").fetchall()
+
+        def replace(value):
+            if value is not None and json.loads(value)["position"] >= position:
+                return value, False
+            return json.dumps({"position": position, "favorites": rows}, ensure_ascii=False).encode("utf-8"), True
+
+        self.backend.update("favorites:snapshot", replace)
+
+    def _publish(self, event):
+        seq = self._log.append(json.dumps(event, ensure_ascii=False).encode("utf-8"))
+        self.sync(force=True)
+        if seq % self.snapshot_every == 0:
+            self._save_snapshot()
+
+    def get(self, favorite_id):
+        self.sync()
+        return super().get(favorite_id)
+
+    def is_favorite(self, favorite_id):
+        self.sync()
+        return super().is_favorite(favorite_id)
+
+    def save(self, question, answer, ingredients, rating, now=None):
+        self._publish({
+            "op": "save", "question": question, "answer": answer,
+            "ingredients": [list(ingredient) for ingredient in ingredients],
+            "rating": int(rating), "at": time.time() if now is None else now,
+        })
+        return recipe_id(answer)
+
+    def set_rating(self, favorite_id, rating, now=None):
+        # 評価の欄は表示のたびに呼ばれるので、変わったときだけ書く
+        current = self.get(favorite_id)
+        if current is None or current.rating == int(rating):
+            return
+        self._publish({"op": "rating", "id": favorite_id, "rating": int(rating), "at": time.time() if now is None else now})
+
+    def remove(self, favorite_id):
+        self._publish({"op": "remove", "id": favorite_id})
+
+    def count(self, query=None):
+        self.sync()
+        return super().count(query)
+
+    def page(self, page=0, page_size=5, query=None):
+        self.sync()
+        return super().page(page, page_size, query)
@@ -0,0 +1,154 @@
+import hashlib
+import re
+import threading
+import unicodedata
+from collections import OrderedDict, namedtuple
+
+
+# 抽出した材料1行分（text: 表示用の行, name: 材料名, quantity/unit: 分量）
+Ingredient = namedtuple("Ingredient", ["text", "name", "quantity", "unit"])
+
+# 「材料」見出しの行
+_SECTION_START_RE = re.compile(r"^[\s#*【\[]*材料[^\n]*$", re.MULTILINE)
+# 材料セクションの終わり（作り方などの見出し）
+_SECTION_END_RE = re.compile(
+    r"^[\s#*【\[]*(?:作り方|手順|調理法|調理手順|デザート|飲み物|おすすめ|お勧め|ポイント)", re.MULTILINE
+)
+# 箇条書きの行（- リスト / 1. 番号付きリスト / ・ リスト）
+_BULLET_RES = [
+    re.compile(r"^[ \t]*(?:[-•]|\*(?=[ \t]))[ \t]*(\S.*)$"),
+    re.compile(r"^[ \t]*\d+[.．)）][ \t]*(\S.*)$"),
+    re.compile(r"^[ \t]*・[ \t]*(\S.*)$"),
+]
+# 「材料: 豚肉、玉ねぎ、…」のように1行で書かれている場合
+_INLINE_RE = re.compile(r"材料[^\n:：]*[:：][ \t]*([^\n]+)")
+_INLINE_SPLIT_RE = re.compile(r"[、,，]")
+# 先頭の記号や番号を除去
+_CLEAN_RE = re.compile(r"^(?:[-・*•]|\d+[.．)）])\s*")
+_MARKDOWN_RE = re.compile(r"\*\*|__|`")
+_NOTE_RE = re.compile(r"[（(][^）)]*[）)]")
+
+# 分量の書き方（「300g」「大さじ2」「1/2個」「少々」など）
+_UNITS = "kg|g|mg|ml|mL|cc|L|カップ|個|本|枚|片|かけ|株|束|袋|パック|缶|切れ|尾|合|杯|丁|玉|玉分|房|cm"
+_NUMBER = r"\d+(?:\.\d+)?(?:/\d+)?"
+_QUANTITY_RE = re.compile(
+    r"^(?P<name>.+?)[\s:：…‥\.]*"
+    r"(?:"
+    r"(?P<pre_unit>大さじ|小さじ|カップ)\s*(?P<pre_num>" + _NUMBER + r")"
+    r"|(?P<num>" + _NUMBER + r")\s*(?P<unit>" + _UNITS + r")?"
+    r"|(?P<vague>少々|少量|適量|適宜|お好みで|ひとつまみ|ひとかけ)"
+    r")\s*$"
+)
+
+# 材料セクションが見つからない場合に使う食材キーワード
+FOOD_KEYWORDS = [
+    '肉', '野菜', '魚', '米', '麺', '卵', '豆腐', '油', '醤油', '味噌', '塩', '砂糖',
+    '玉ねぎ', 'にんじん', 'じゃがいも', 'キャベツ', 'トマト', 'ピーマン'
+]
+_EXCLUDE_WORDS = ['炒める', '煮る', '焼く', '切る', '作り方', '手順']
+_STEP_PREFIXES = ('作り方', '手順', '調理法')
+
+_CACHE_SIZE = 512
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def _to_number(text):
+    if "/" in text:
+        num, den = text.split("/", 1)
+        return float(num) / float(den) if float(den) else None
+    return float(text)
+
+
+# 1行の材料から名前と分量を取り出す
+def parse_ingredient_line(line):
+    text = _CLEAN_RE.sub("", _MARKDOWN_RE.sub("", line).strip()).strip()
+    normalized = unicodedata.normalize("NFKC", text)
+    without_note = _NOTE_RE.sub("", normalized).strip()
+    match = _QUANTITY_RE.match(without_note)
+    if not match:
+        return Ingredient(text, without_note or text, None, None)
+
+    name = match.group("name").strip(" :：…‥・")
+    if match.group("pre_unit"):
+        return Ingredient(text, name, _to_number(match.group("pre_num")), match.group("pre_unit"))
+    if match.group("num"):
+        return Ingredient(text, name, _to_number(match.group("num")), match.group("unit") or "")
+    return Ingredient(text, name, None, match.group("vague"))
+
+
+def _section_lines(answer):
+    start = _SECTION_START_RE.search(answer)
+    if not start:
+        return []
+    end = _SECTION_END_RE.search(answer, start.end())
+    section = answer[start.end():end.start() if end else len(answer)]
+    for bullet_re in _BULLET_RES:
+        lines = []
+        for line in section.split("\n"):
+            match = bullet_re.match(line)
+            if match and not match.group(1).startswith(_STEP_PREFIXES):
+                lines.append(match.group(1))
+        if lines:
+            return lines
+    return []
+
+
+def _extract(answer):
+    lines = _section_lines(answer)
+
+    if not lines:
+        inline = _INLINE_RE.search(answer)
+        if inline:
+            lines = [part for part in _INLINE_SPLIT_RE.split(inline.group(1)) if part.strip()]
+
+    # パターンが見つからない場合、全体から食材らしきものを抽出
+    if not lines:
+        for line in answer.split("\n"):
+            line = line.strip()
+            if any(keyword in line for keyword in FOOD_KEYWORDS):
+                # 調理法や説明文を除外
+                if not any(exclude in line for exclude in _EXCLUDE_WORDS):
+                    clean_line = _CLEAN_RE.sub("", line)
+                    if clean_line and len(clean_line) < 50:  # 長すぎる行は除外
+                        lines.append(clean_line)
+
+    ingredients = []
+    for line in lines:
+        ingredient = parse_ingredient_line(line)
+        if ingredient.text:
+            ingredients.append(ingredient)
+    return tuple(ingredients)
+
+
+def _answer_key(answer):
+    return hashlib.sha1(answer.encode("utf-8")).hexdigest()
+
+
+def _store(key, result):
+    with _cache_lock:
+        _cache[key] = result
+        _cache.move_to_end(key)
+        while len(_cache) > _CACHE_SIZE:
+            _cache.popitem(last=False)
+
+
+# AI回答から材料リストを抽出する（同じ回答は一度だけ解析する）
+def extract_ingredients(answer):
+    if not answer:
+        return ()
+    key = _answer_key(answer)
+    with _cache_lock:
+        cached = _cache.get(key)
+        if cached is not None:
+            _cache.move_to_end(key)
+            return cached
+    result = _extract(answer)
+    _store(key, result)
+    return result
+
+
+# 構造化出力などで材料が分かっている回答は、解析せずにその結果を登録しておく
+def remember_ingredients(answer, ingredients):
+    if answer:
+        _store(_answer_key(answer), tuple(ingredients))
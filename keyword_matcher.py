@@ -0,0 +1,95 @@
+from collections import deque
+
+
+# 辞書のキー（材料名）を一度に探すためのAho–Corasickオートマトン
+# 材料名に含まれるキーのうち一番長いものを採用する（「豚ひき肉」は「豚肉」より優先など）
+# 含まれるキーが無いときは、逆に材料名を含むキーを探す（「ねぎ」→「万能ねぎ」など。一番短いキーを採用する）
+class KeywordMatcher:
+    def __init__(self, values, default_value=None, default_key="その他"):
+        self.values = dict(values)
+        self.default_value = default_value
+        self.default_key = default_key
+        self._goto = [{}]
+        self._fail = [0]
+        self._outputs = [[]]  # ノードで終わるキー（失敗リンク先の分も含む）
+        for key in self.values:
+            self._add(key)
+        self._build()
+
+    def _add(self, key):
+        node = 0
+        for ch in key:
+            nxt = self._goto[node].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[node][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._outputs.append([])
+            node = nxt
+        self._outputs[node].append(key)
+
+    def _build(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, nxt in self._goto[node].items():
+                queue.append(nxt)
+                fail = self._fail[node]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[nxt] = self._goto[fail].get(ch, 0)
+                self._outputs[nxt] = self._outputs[nxt] + self._outputs[self._fail[nxt]]
+
+    # 文字列中に現れるキーを (終了位置, キー) で列挙する
+    def _scan(self, text):
+        node = 0
+        for pos, ch in enumerate(text):
+            while node and ch not in self._goto[node]:
+                node = self._fail[node]
+            node = self._goto[node].get(ch, 0)
+            for key in self._outputs[node]:
+                yield pos, key
+
+    # 1つの材料名に対して (キー, 値) を返す。見つからなければ (default_key, default_value)
+    def match(self, item):
+        return self.match_all([item])[0]
+
+    # レシピの材料をまとめて1回の走査で判定する
+    def match_all(self, items):
+        items = list(items)
+        best = [None] * len(items)
+        # 改行で区切って連結し、どの材料の範囲で見つかったかを位置から求める
+        text = "\n".join(item.replace("\n", " ") for item in items)
+        line = 0
+        line_start = 0
+        for pos, key in self._scan(text):
+            while line < len(items) - 1 and pos >= line_start + len(items[line]) + 1:
+                line_start += len(items[line]) + 1
+                line += 1
+            start = pos - len(key) + 1
+            current = best[line]
+            # 長いキーを優先し、同じ長さなら先に出てきたものを採用する
+            if current is None or len(key) > len(current[1]) or (len(key) == len(current[1]) and start < current[0]):
+                best[line] = (start, key)
+
+        results = []
+        for item, found in zip(items, best):
+            key = found[1] if found is not None else self._containing_key(item)
+            if key is None:
+                results.append((self.default_key, self.default_value))
+            else:
+                results.append((key, self.values[key]))
+        return results
+
+    # 材料名（「ねぎ 1本」なら分量の前の「ねぎ」）を含むキーのうち一番短いもの。無ければ None
+    # 前から一致しなかった材料だけで使うので、キーを順に調べる
+    def _containing_key(self, item):
+        name = item.split()[0] if item.split() else ""
+        if not name:
+            return None
+        found = None
+        for key in self.values:
+            if name in key and (found is None or len(key) < len(found)):
+                found = key
+        return found
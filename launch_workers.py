@@ -0,0 +1,130 @@
+"""複数のワーカー（streamlit のプロセス）を起動する
+
+1つのプロセスでは同時に処理できるセッションに限りがあるので、ポートを変えて
+ワーカーを複数起動し、前段のロードバランサ（nginx など）で振り分ける。
+
+    python launch_workers.py --workers 4 --base-port 8501
+    python launch_workers.py --workers 4 --nginx > cooking-app.conf   # nginx の設定例を出力
+
+共有する状態:
+    回答キャッシュ・似た質問の索引・お気に入り・レート制限・AIの利用量の集計は STATE_BACKEND で
+    指定した場所に置き、全ワーカーで共有する。
+    未指定のときは CACHE_DIR/state.sqlite3（同じサーバ上のワーカーだけで共有）を使う。
+    複数のサーバで動かすときは Redis を指定する（例: STATE_BACKEND=redis://cache-host:6379/0）。
+    似た質問の索引は、各ワーカーが手元に複製（メモリ）を持ち、バックエンドに追記された変更を読んで反映する。
+    お気に入り（FAVORITES_DB_PATH）は、SQLite のときは同じファイルを全ワーカーで共有し、Redis のときは
+    サーバごとのファイルを複製として、バックエンドに追記された変更を読んで反映する。
+    レシピ集（RECIPE_CORPUS_PATH）は SQLite の WAL モードで同じサーバのワーカー間で共有される。
+
+スティッキーセッション:
+    Streamlit は画面の状態（st.session_state・入力中の値・会話履歴）を WebSocket を張った
+    ワーカーのメモリに持つ。再接続のたびに別のワーカーへ振り分けられると状態が消えるので、
+    ロードバランサでは同じ利用者を同じワーカーに送る設定（nginx の ip_hash / hash $cookie、
+    クラウドのロードバランサの「セッションアフィニティ」）を必ず有効にし、
+    WebSocket（/_stcore/stream）の Upgrade を通すこと。
+"""
+import argparse
+import os
+import signal
+import subprocess
+import sys
+import time
+
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+NGINX_TEMPLATE = """\
+# 料理チャットアプリ: {workers}ワーカー（同じ利用者は同じワーカーへ）
+upstream cooking_app {{
+    ip_hash;
+{servers}
+}}
+
+server {{
+    listen 80;
+
+    location / {{
+        proxy_pass http://cooking_app;
+        proxy_http_version 1.1;
+        # Streamlit の WebSocket（/_stcore/stream）
+        proxy_set_header Upgrade $http_upgrade;
+        proxy_set_header Connection "upgrade";
+        proxy_set_header Host $host;
+        proxy_read_timeout 86400;
+    }}
+}}
+"""
+
+
+def nginx_config(workers, base_port, host="127.0.0.1"):
+    servers = "\n".join(f"    server {host}:{base_port + i};" for i in range(workers))
+    return NGINX_TEMPLATE.format(workers=workers, servers=servers)
+
+
+def worker_env():
+    env = dict(os.environ)
+    if not env.get("STATE_BACKEND"):
+        cache_dir = env.get("CACHE_DIR", os.path.join(BASE_DIR, ".cache"))
+        env["STATE_BACKEND"] = "sqlite:///" + os.path.abspath(os.path.join(cache_dir, "state.sqlite3")).lstrip("/")
+    return env
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 2)
+    parser.add_argument("--base-port", type=int, default=8501)
+    parser.add_argument("--address", default="127.0.0.1", help="ワーカーが待ち受けるアドレス（前段にロードバランサを置く）")
+    parser.add_argument("--nginx", action="store_true", help="nginx の設定例を出力して終了する")
+    parser.add_argument("--skip-prepare", action="store_true", help="startup.py の事前準備を省く")
+    args = parser.parse_args()
+
+    if args.nginx:
+        print(nginx_config(args.workers, args.base_port, args.address), end="")
+        return
+
+    env = worker_env()
+    # 背景画像の変換などは起動前に1回だけ済ませる（ワーカーごとにやらない）
+    if not args.skip_prepare:
+        subprocess.run([sys.executable, os.path.join(BASE_DIR, "startup.py")], cwd=BASE_DIR, env=env, check=True)
+
+    processes = []
+    for i in range(args.workers):
+        port = args.base_port + i
+        processes.append(subprocess.Popen(
+            [
+                sys.executable, "-m", "streamlit", "run", os.path.join(BASE_DIR, "app.py"),
+                "--server.port", str(port), "--server.address", args.address, "--server.headless", "true",
+            ],
+            cwd=BASE_DIR,
+            env=env,
+        ))
+        print(f"worker {i}: http://{args.address}:{port}", flush=True)
+    print(f"STATE_BACKEND={env['STATE_BACKEND']}", flush=True)
+
+    stopping = []
+
+    def stop(*_):
+        stopping.append(True)
+        for process in processes:
+            if process.poll() is None:
+                process.terminate()
+
+    signal.signal(signal.SIGTERM, stop)
+    crashed = False
+    try:
+        # どれかのワーカーが落ちたら全体を止める（再起動は systemd などに任せる）
+        while all(process.poll() is None for process in processes):
+            time.sleep(1)
+        crashed = not stopping
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop()
+        for process in processes:
+            process.wait()
+    if crashed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
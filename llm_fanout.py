@@ -0,0 +1,76 @@
+import asyncio
+import time
+
+
+# 1件分のストリーミング生成
+# 同時実行数の枠・リトライ・サーキットブレーカーは gateway（llm_gateway.LLMGateway）のものを使う
+async def _generate(client, gateway, index, request, estimated_tokens, on_chunk):
+    started_at = time.perf_counter()
+    ttft = None
+    usage = None
+    finish_reason = None
+    parts = []
+    try:
+        async with gateway.slot_async():
+            started_at = time.perf_counter()  # 枠が空くまでの待ち時間は含めない
+            stream = await gateway.call_async(lambda: client.chat.completions.create(stream=True, **request))
+            try:
+                async for chunk in stream:
+                    # usage を返すサービスでは最後のチャンクに含まれる
+                    if getattr(chunk, "usage", None):
+                        usage = chunk.usage
+                    if not chunk.choices:
+                        continue
+                    if chunk.choices[0].finish_reason:
+                        finish_reason = chunk.choices[0].finish_reason
+                    delta = chunk.choices[0].delta.content
+                    if delta:
+                        if ttft is None:
+                            ttft = time.perf_counter() - started_at
+                        parts.append(delta)
+                        if on_chunk is not None:
+                            on_chunk(index, "".join(parts))
+            except Exception as e:
+                # 途中で切れた場合はリトライしない（表示済みの文字と重複するため）
+                gateway.record_stream_failure(e)
+                raise
+        # 同期の呼び出しと同じく、利用量の集計とトークン数の制限の戻しをする
+        gateway.record_usage(usage, estimated_tokens)
+        error = None
+    except Exception as e:  # 1件の失敗で他の案を止めない
+        error = e
+    info = {
+        "error": error, "ttft": ttft, "total": time.perf_counter() - started_at,
+        "usage": usage, "finish_reason": finish_reason,
+    }
+    return index, None if error is not None else "".join(parts), info
+
+
+async def _fan_out(make_client, requests, gateway, estimated_tokens, on_chunk, on_done):
+    results = [None] * len(requests)
+    async with make_client() as client:
+        tasks = [
+            asyncio.create_task(_generate(client, gateway, index, request, estimated, on_chunk))
+            for index, (request, estimated) in enumerate(zip(requests, estimated_tokens))
+        ]
+        # 終わったものから順に後処理する
+        for finished in asyncio.as_completed(tasks):
+            index, text, info = await finished
+            results[index] = text
+            if on_done is not None:
+                on_done(index, text, info)
+    return results
+
+
+# 複数のリクエストを非同期クライアントで同時に投げる
+# make_client: async with で使える AsyncOpenAI を返す関数
+# gateway: 同時実行数の枠（同期の呼び出しと共有）・リトライ・サーキットブレーカーに使う LLMGateway
+# requests: chat.completions.create に渡す引数（stream 以外）のリスト
+# estimated_tokens: requests ごとのトークン数の見積もり（gateway.admit で確保した分。実際の使用量との差を戻す）
+# on_chunk(index, text_so_far) / on_done(index, text, info) は呼び出し元のスレッドで呼ばれる
+# info: {"error", "ttft", "total", "usage", "finish_reason"}（usage は返らなかったとき None。
+#       finish_reason が "length" なら max_tokens で途中までになっている）
+def fan_out(make_client, requests, gateway, estimated_tokens, on_chunk=None, on_done=None):
+    if not requests:
+        return []
+    return asyncio.run(_fan_out(make_client, requests, gateway, estimated_tokens, on_chunk, on_done))
@@ -0,0 +1,337 @@
+import asyncio
+import contextlib
+import random
+import threading
+import time
+from collections import namedtuple
+from email.utils import parsedate_to_datetime
+
+from rate_limit import TokenBucket
+
+
+# 混雑・障害で一時的に失敗した（リトライしても回答が得られない）ときの例外
+class UpstreamUnavailable(Exception):
+    pass
+
+
+# create / stream_text の結果（同じキーで待っていた呼び出しにも同じ形で渡す）
+# text: 回答全文 / finish_reason: "stop"・"length" など / usage: response.usage（返らなければ None）
+# shared: 他の呼び出しの結果を待って受け取った（自分ではAIを呼んでいない）
+Completion = namedtuple("Completion", ["text", "finish_reason", "usage", "shared"])
+
+
+# サーキットブレーカー（連続して失敗したら一定時間は呼ばずにすぐ失敗させる）
+class CircuitBreaker:
+    def __init__(self, failure_threshold=5, reset_seconds=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = "closed"
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    # 開いていて、まだ試す時間になっていないか（半開の試行枠は使わない）
+    def is_open(self):
+        with self._lock:
+            return self.state == "open" and time.monotonic() - self._opened_at < self.reset_seconds
+
+    def allow(self):
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() - self._opened_at >= self.reset_seconds:
+                self.state = "half_open"
+            # 半開状態では1件だけ試す
+            if self.state == "half_open" and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self._failures = 0
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._probing = False
+            if self.state == "half_open" or self._failures >= self.failure_threshold:
+                self.state = "open"
+                self._opened_at = time.monotonic()
+
+
+# 同じキーの処理が実行中なら、終わるのを待って同じ結果を受け取る
+class SingleFlight:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}
+
+    # 戻り値: (flight, 自分が実行するか)
+    def begin(self, key):
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                return flight, False
+            flight = self._flights[key] = {"done": threading.Event(), "result": None, "error": None}
+            return flight, True
+
+    def finish(self, key, flight, result=None, error=None):
+        flight["result"] = result
+        flight["error"] = error
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+        flight["done"].set()
+
+    def wait(self, flight, timeout):
+        if not flight["done"].wait(timeout):
+            raise UpstreamUnavailable("同じ質問の回答待ちがタイムアウトしました")
+        if flight["error"] is not None:
+            raise flight["error"]
+        return flight["result"]
+
+
+# 429 / 503 の Retry-After（秒）を読む。無ければ None
+def retry_after_seconds(error):
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    headers = response.headers
+    value = headers.get("retry-after-ms")
+    if value:
+        try:
+            return float(value) / 1000
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+
+# AIへのリクエストの入口（全セッションで1つだけ作って共有する）
+# - 同じキーの実行中リクエストはまとめる（single-flight）
+# - 1分あたりのリクエスト数・トークン数をトークンバケットで制限する
+# - 一時的なエラーは Retry-After を優先した指数バックオフ（ジッター付き）でリトライする
+# - 失敗が続いたらサーキットブレーカーで呼び出しを止め、UpstreamUnavailable を送出する
+# on_usage(usage) / on_event(name) は計測用のコールバック
+# requests_bucket / tokens_bucket を渡すと、プロセス内のトークンバケットの代わりに使う（複数ワーカーで上限を共有するとき）
+# create と stream_text は同じキーどうしでまとめるので、まとめた結果は Completion に揃えて受け渡す
+class LLMGateway:
+    def __init__(
+        self, client, requests_per_minute=60, tokens_per_minute=60000, max_concurrency=8,
+        max_retries=3, base_delay=0.5, max_delay=8.0, max_retry_after=30.0, queue_timeout=20.0,
+        flight_timeout=90.0, failure_threshold=5, reset_seconds=30.0, on_usage=None, on_event=None,
+        requests_bucket=None, tokens_bucket=None,
+    ):
+        # openai は読み込みに時間がかかるので、ゲートウェイを作るときに読み込む
+        import openai
+        # 一時的なエラー（待てば成功する可能性があるもの）
+        self._retryable_errors = (openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError)
+        self._status_error = openai.APIStatusError
+        self.client = client
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_retry_after = max_retry_after
+        self.queue_timeout = queue_timeout
+        self.flight_timeout = flight_timeout
+        self.requests = requests_bucket or TokenBucket(requests_per_minute)
+        self.tokens = tokens_bucket or TokenBucket(tokens_per_minute)
+        self.breaker = CircuitBreaker(failure_threshold, reset_seconds)
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._flights = SingleFlight()
+        self._on_usage = on_usage
+        self._on_event = on_event
+
+    def _event(self, name):
+        if self._on_event is not None:
+            self._on_event(name)
+
+    # 実際の使用量を on_usage に渡し、見積もりとの差をトークン数の制限に戻す
+    # （create / stream_text のほか、llm_fanout の非同期の呼び出しからも呼ぶ）
+    def record_usage(self, usage, estimated_tokens):
+        if usage is None:
+            return
+        if self._on_usage is not None:
+            self._on_usage(usage)
+        total = getattr(usage, "total_tokens", None)
+        if total:
+            self.tokens.adjust(estimated_tokens - total)
+
+    # ブレーカーとレート制限を確認し、必要なら順番を待つ
+    def admit(self, estimated_tokens, requests=1):
+        if self.breaker.is_open():
+            self._event("circuit_open")
+            raise UpstreamUnavailable("AIサービスが不安定なため、一時的に呼び出しを止めています")
+        wait = max(self.requests.reserve(requests), self.tokens.reserve(estimated_tokens))
+        if wait > self.queue_timeout:
+            self.requests.adjust(requests)
+            self.tokens.adjust(estimated_tokens)
+            self._event("rate_limited")
+            raise UpstreamUnavailable("リクエストが集中しているため、しばらく待ってから再度お試しください")
+        if wait > 0:
+            self._event("throttled")
+            time.sleep(wait)
+
+    def _allow(self):
+        if not self.breaker.allow():
+            self._event("circuit_open")
+            raise UpstreamUnavailable("AIサービスが不安定なため、一時的に呼び出しを止めています")
+
+    # 一時的なエラーのあと、次に試すまでの秒数（もう試さないときは UpstreamUnavailable を送出する）
+    # ブレーカーにはリトライ1回ごとではなく、リトライを使い切ったときにリクエスト1件の失敗として数える
+    def _retry_delay(self, attempt, error):
+        retry_after = retry_after_seconds(error)
+        if attempt == self.max_retries or (retry_after or 0) > self.max_retry_after:
+            self.breaker.record_failure()
+            raise UpstreamUnavailable(f"AIサービスに接続できませんでした（{type(error).__name__}）") from error
+        self._event("retries")
+        if retry_after is not None:
+            return retry_after + random.uniform(0, self.base_delay)
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def _call(self, func):
+        for attempt in range(self.max_retries + 1):
+            # ブレーカーの確認は最初の1回だけ（リトライは同じリクエストの続きなので、半開の試行枠もそのまま使う）
+            if attempt == 0:
+                self._allow()
+            try:
+                result = func()
+            except self._retryable_errors as e:
+                time.sleep(self._retry_delay(attempt, e))
+            except self._status_error:
+                # 400 などは相手に届いているので障害としては数えない
+                self.breaker.record_success()
+                raise
+            except Exception:
+                self.breaker.record_failure()
+                raise
+            else:
+                self.breaker.record_success()
+                return result
+
+    # 非同期クライアント（llm_fanout）用の _call。func はコルーチンを返す関数
+    async def call_async(self, func):
+        for attempt in range(self.max_retries + 1):
+            if attempt == 0:
+                self._allow()
+            try:
+                result = await func()
+            except self._retryable_errors as e:
+                await asyncio.sleep(self._retry_delay(attempt, e))
+            except self._status_error:
+                self.breaker.record_success()
+                raise
+            except Exception:
+                self.breaker.record_failure()
+                raise
+            else:
+                self.breaker.record_success()
+                return result
+
+    # 非同期の呼び出しで同時実行数の枠を取る（同期の create / stream_text と同じ枠を使う）
+    # スレッドを止めないよう、空くまで少しずつ待って取り直す。queue_timeout 秒で諦める
+    @contextlib.asynccontextmanager
+    async def slot_async(self, poll_interval=0.02):
+        deadline = time.monotonic() + self.queue_timeout
+        while not self._slots.acquire(blocking=False):
+            if time.monotonic() >= deadline:
+                self._event("slot_timeout")
+                raise UpstreamUnavailable("リクエストが集中しているため、しばらく待ってから再度お試しください")
+            await asyncio.sleep(poll_interval)
+        try:
+            yield
+        finally:
+            self._slots.release()
+
+    # 非同期のストリーミングが途中で切れたときに呼ぶ（リトライはしないが障害として数える）
+    def record_stream_failure(self, error):
+        if isinstance(error, self._retryable_errors):
+            self.breaker.record_failure()
+
+    # chat.completions.create（ストリーミングなし）。回答を Completion で返す
+    # key が同じ実行中の呼び出し（stream_text も含む）とは結果を共有する
+    def create(self, key, estimated_tokens, **request):
+        if key is not None:
+            flight, leader = self._flights.begin(key)
+            if not leader:
+                self._event("coalesced")
+                return self._flights.wait(flight, self.flight_timeout)._replace(shared=True)
+        try:
+            self.admit(estimated_tokens)
+            with self._slots:
+                response = self._call(lambda: self.client.chat.completions.create(**request))
+            self.record_usage(response.usage, estimated_tokens)
+            choice = response.choices[0]
+            completion = Completion(choice.message.content or "", choice.finish_reason, response.usage, False)
+        except Exception as e:
+            if key is not None:
+                self._flights.finish(key, flight, error=e)
+            raise
+        if key is not None:
+            self._flights.finish(key, flight, result=completion)
+        return completion
+
+    # ストリーミングで回答の文字列を少しずつ返すジェネレータ
+    # 同じキーの呼び出しが実行中なら、それが終わったあとで回答全体を1回で返す
+    # 最後まで受け取ったら on_complete(Completion) を1回呼ぶ（打ち切り・usage の確認用）
+    def stream_text(self, key, estimated_tokens, on_complete=None, **request):
+        if key is not None:
+            flight, leader = self._flights.begin(key)
+            if not leader:
+                self._event("coalesced")
+                completion = self._flights.wait(flight, self.flight_timeout)._replace(shared=True)
+                yield completion.text
+                if on_complete is not None:
+                    on_complete(completion)
+                return
+        parts = []
+        usage = None
+        finish_reason = None
+        completion = None
+        error = None
+        try:
+            self.admit(estimated_tokens)
+            with self._slots:
+                stream = self._call(lambda: self.client.chat.completions.create(stream=True, **request))
+                try:
+                    for chunk in stream:
+                        # usage を返すサービスでは最後のチャンクに含まれる
+                        if getattr(chunk, "usage", None):
+                            usage = chunk.usage
+                        if not chunk.choices:
+                            continue
+                        if chunk.choices[0].finish_reason:
+                            finish_reason = chunk.choices[0].finish_reason
+                        delta = chunk.choices[0].delta.content
+                        if delta:
+                            parts.append(delta)
+                            yield delta
+                except self._retryable_errors as e:
+                    # 途中で切れた場合はリトライしない（表示済みの文字と重複するため）
+                    self.breaker.record_failure()
+                    raise UpstreamUnavailable(f"回答の受信中に接続が切れました（{type(e).__name__}）") from e
+            self.record_usage(usage, estimated_tokens)
+            completion = Completion("".join(parts), finish_reason, usage, False)
+        except Exception as e:
+            error = e
+            raise
+        except BaseException:
+            # 表示側が途中でやめた（GeneratorExit など）ときは、待っている側には失敗として伝える
+            error = UpstreamUnavailable("回答の生成が中断されました")
+            raise
+        finally:
+            if key is not None:
+                self._flights.finish(key, flight, result=completion, error=error)
+        if on_complete is not None:
+            on_complete(completion)
@@ -0,0 +1,95 @@
+import unicodedata
+from collections import namedtuple
+
+import numpy as np
+
+from nutrition import default_grams
+
+
+WEEKDAYS = ("月", "火", "水", "木", "金", "土", "日")
+
+# 日ごとに主菜の材料を変えて、同じような料理が続かないようにする
+DAY_THEMES = ("鶏肉", "豚肉", "魚", "卵・豆腐", "ひき肉", "牛肉", "野菜たっぷり")
+
+# 1週間分の買い物リスト（names から下は材料ごとの配列。費用の高い順に並べる）
+# names: 材料名 / grams: 1週間で使う量(g) / packs: 買うパック数 / pack_prices: 1パックの価格
+# costs: packs × pack_prices / days: 使う日数 / matched: 価格表で一致したキー
+# total_cost: まとめ買いの合計 / separate_cost: 日ごとに買った場合の合計 / used_cost: 使う分だけの按分額
+ShoppingList = namedtuple(
+    "ShoppingList",
+    ["names", "grams", "packs", "pack_prices", "costs", "days", "matched", "total_cost", "separate_cost", "used_cost"],
+)
+
+
+# 曜日ごとのプロンプトを作る（同時に生成するので、材料の使い回しはプロンプトで指示する）
+def build_day_prompts(num_people, difficulty, target_calorie, days=7):
+    prompts = []
+    for day in range(days):
+        weekday = WEEKDAYS[day % len(WEEKDAYS)]
+        theme = DAY_THEMES[day % len(DAY_THEMES)]
+        prompts.append(
+            f"1週間の献立の{weekday}曜日の夕食として、{theme}を使った料理を1品教えて"
+            f"（{num_people}人分、{difficulty}、{target_calorie}kcal前後）。"
+            "1週間で材料を使い回すので、玉ねぎ・にんじん・キャベツ・卵など定番の材料を優先し、"
+            "使い切りにくい珍しい材料は避けてください。"
+        )
+    return prompts
+
+
+def _group_name(ingredient):
+    return unicodedata.normalize("NFKC", ingredient.name).strip()
+
+
+# 全レシピの材料をまとめて、1週間分の買い物リストと費用を計算する
+# day_ingredients: 日ごとの材料（Ingredient）のリスト。生成に失敗した日は空にする
+# 材料は価格表で一致したキーごと（見つからない材料は材料名ごと）にまとめ、量をgに換算して合計する
+def aggregate_shopping_list(day_ingredients, price_catalog, nutrition_table, num_people, region=None):
+    items = [ingredient for ingredients in day_ingredients for ingredient in ingredients]
+    if not items:
+        empty = np.zeros(0)
+        return ShoppingList([], empty, empty, empty, empty, np.zeros(0, dtype=np.intp), [], 0, 0, 0)
+    day_ids = np.repeat(np.arange(len(day_ingredients)), [len(ingredients) for ingredients in day_ingredients])
+
+    matched_keys, price_indices = price_catalog.lookup([ingredient.text for ingredient in items])
+    _, nutrition_indices = nutrition_table.lookup(items)
+    grams = nutrition_table.to_grams(items, nutrition_indices, default_grams=default_grams(num_people))
+
+    # 同じ材料を同じグループにする（「豚こま肉」「豚ロース」が同じキーに一致すれば1つにまとめる）
+    labels = np.array([
+        key if index != price_catalog.default_index else _group_name(ingredient)
+        for key, index, ingredient in zip(matched_keys, price_indices, items)
+    ], dtype=object)
+    names, first, groups = np.unique(labels, return_index=True, return_inverse=True)
+    group_count = len(names)
+    group_prices = price_indices[first]
+    pack_g = price_catalog.pack_g[group_prices].astype(np.float64)
+    pack_prices = price_catalog.pack_prices(group_prices, region)
+
+    # まとめ買い: 1週間分の量を合計してから必要なパック数を出す
+    total_grams = np.bincount(groups, weights=grams, minlength=group_count)
+    packs = np.ceil(total_grams / pack_g)
+    costs = packs * pack_prices
+
+    # 日ごとに買った場合: (材料, 日) ごとに合計してパック数を出す
+    day_count = len(day_ingredients)
+    pairs, pair_ids = np.unique(groups * day_count + day_ids, return_inverse=True)
+    pair_grams = np.bincount(pair_ids, weights=grams, minlength=len(pairs))
+    pair_groups = pairs // day_count
+    separate_cost = float((np.ceil(pair_grams / pack_g[pair_groups]) * pack_prices[pair_groups]).sum())
+    days = np.bincount(pair_groups, minlength=group_count)
+
+    used_cost = float(price_catalog.estimate(price_indices, grams, region).sum())
+
+    order = np.argsort(-costs, kind="stable")
+    return ShoppingList(
+        [str(names[i]) for i in order],
+        total_grams[order],
+        packs[order],
+        pack_prices[order],
+        costs[order],
+        days[order],
+        [matched_keys[first[i]] for i in order],
+        int(round(costs.sum())),
+        int(round(separate_cost)),
+        int(round(used_cost)),
+    )
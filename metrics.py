@@ -0,0 +1,104 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+
+# 処理時間のヒストグラムのバケット（秒）
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # 最後は +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+# プロセス全体で共有する計測値（処理ごとのヒストグラムとカウンタ）
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._counters = {}
+
+    def observe(self, phase, seconds):
+        with self._lock:
+            histogram = self._histograms.get(phase)
+            if histogram is None:
+                histogram = self._histograms[phase] = Histogram()
+            histogram.observe(seconds)
+
+    def increment(self, name, value=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    # with metrics.timer("llm_call"): ... の形で処理時間を計測する
+    @contextmanager
+    def timer(self, phase):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(phase, time.perf_counter() - started)
+
+    # 関数全体の処理時間を計測するデコレータ
+    def timed(self, phase):
+        def decorator(func):
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.timer(phase):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    # response.usage のトークン数を加算する
+    def record_usage(self, usage):
+        if usage is None:
+            return
+        self.increment("llm_requests_with_usage_total")
+        for field in ("prompt_tokens", "completion_tokens", "total_tokens"):
+            value = getattr(usage, field, None)
+            if value:
+                self.increment(f"llm_{field}_total", value)
+
+    def snapshot(self):
+        with self._lock:
+            histograms = {
+                phase: (h.buckets, list(h.counts), h.sum, h.count) for phase, h in self._histograms.items()
+            }
+            return histograms, dict(self._counters)
+
+    # Prometheusのテキスト形式で出力する
+    def render_prometheus(self, prefix="cooking_app"):
+        histograms, counters = self.snapshot()
+        lines = []
+        if histograms:
+            name = f"{prefix}_phase_seconds"
+            lines.append(f"# HELP {name} 処理ごとの所要時間")
+            lines.append(f"# TYPE {name} histogram")
+            for phase in sorted(histograms):
+                buckets, counts, total, count = histograms[phase]
+                cumulative = 0
+                for bound, bucket_count in zip(buckets, counts):
+                    cumulative += bucket_count
+                    lines.append(f'{name}_bucket{{phase="{phase}",le="{bound}"}} {cumulative}')
+                lines.append(f'{name}_bucket{{phase="{phase}",le="+Inf"}} {count}')
+                lines.append(f'{name}_sum{{phase="{phase}"}} {total:.6f}')
+                lines.append(f'{name}_count{{phase="{phase}"}} {count}')
+        for counter in sorted(counters):
+            name = f"{prefix}_{counter}"
+            lines.append(f"# TYPE {name} counter")
+            lines.append(f"{name} {counters[counter]}")
+        return "\n".join(lines) + "\n"
+
+
+# モジュール読み込み時に1つだけ作成し、全セッションで共有する
+METRICS = Metrics()
@@ -0,0 +1,130 @@
+import csv
+
+import numpy as np
+
+from keyword_matcher import KeywordMatcher
+
+
+NUTRIENTS = ("kcal", "protein", "fat", "carbs")
+
+# 栄養表に無い材料は100gあたり50kcalとして扱う（以前のデフォルトと同じ）
+DEFAULT_NUTRIENTS = (50.0, 0.0, 0.0, 0.0)
+DEFAULT_TBSP_G = 15.0
+DEFAULT_TSP_G = 5.0
+DEFAULT_PIECE_G = 100.0
+DEFAULT_AMOUNT_G = 100.0  # 分量が読み取れない材料の初期値
+
+# 重さに直接換算できる単位（1単位あたりのg）
+FIXED_UNIT_GRAMS = {
+    "g": 1.0, "kg": 1000.0, "mg": 0.001,
+    "ml": 1.0, "mL": 1.0, "cc": 1.0, "L": 1000.0,
+    "カップ": 200.0, "合": 150.0, "cm": 3.0,
+    "少々": 1.0, "ひとつまみ": 1.0, "少量": 2.0, "適量": 5.0, "適宜": 5.0, "お好みで": 5.0, "ひとかけ": 10.0,
+}
+# 材料ごとの1個あたりの重さ（piece_g）で換算する単位
+PIECE_UNITS = {
+    "個", "本", "枚", "片", "かけ", "株", "束", "袋", "パック", "缶", "切れ",
+    "尾", "杯", "丁", "玉", "玉分", "房", "",
+}
+
+_KIND_DEFAULT, _KIND_FIXED, _KIND_TBSP, _KIND_TSP, _KIND_PIECE = range(5)
+
+
+# 分量が書かれていない材料の量（一人 DEFAULT_AMOUNT_G として人数分）
+# 費用・カロリー・献立の買い物リストで同じ量になるよう、to_grams の default_grams にはこれを渡す
+def default_grams(num_people):
+    return DEFAULT_AMOUNT_G * num_people
+
+
+def _float_or(value, default):
+    value = (value or "").strip()
+    return float(value) if value else default
+
+
+# 100gあたりの栄養価と単位換算の表（読み込み後は変更しない）
+class NutritionTable:
+    def __init__(self, names, values, tbsp_g, tsp_g, piece_g):
+        self.names = tuple(names)
+        # 最後の行に「その他」を置き、見つからない材料もインデックスで計算できるようにする
+        self.values = np.vstack([np.asarray(values, dtype=np.float64).reshape(-1, len(NUTRIENTS)), DEFAULT_NUTRIENTS])
+        self.tbsp_g = np.append(np.asarray(tbsp_g, dtype=np.float64), DEFAULT_TBSP_G)
+        self.tsp_g = np.append(np.asarray(tsp_g, dtype=np.float64), DEFAULT_TSP_G)
+        self.piece_g = np.append(np.asarray(piece_g, dtype=np.float64), DEFAULT_PIECE_G)
+        self.default_index = len(self.names)
+        self._matcher = KeywordMatcher(
+            {name: i for i, name in enumerate(self.names)}, default_value=self.default_index
+        )
+        for array in (self.values, self.tbsp_g, self.tsp_g, self.piece_g):
+            array.setflags(write=False)
+
+    # 材料ごとに栄養表の行を探す（戻り値: 一致したキーのリスト, 行インデックスの配列）
+    def lookup(self, ingredients):
+        matches = self._matcher.match_all([ingredient.text for ingredient in ingredients])
+        keys = [key for key, _ in matches]
+        indices = np.fromiter((index for _, index in matches), dtype=np.intp, count=len(matches))
+        return keys, indices
+
+    # 解析した分量（「300g」「大さじ2」「1個」など）をまとめてgに換算する
+    # 分量が書かれていない材料は default_grams とする
+    def to_grams(self, ingredients, indices, default_grams=DEFAULT_AMOUNT_G):
+        count = len(ingredients)
+        quantity = np.ones(count)
+        kind = np.full(count, _KIND_DEFAULT, dtype=np.int8)
+        fixed = np.zeros(count)
+        for i, ingredient in enumerate(ingredients):
+            unit = ingredient.unit
+            if unit is None:
+                continue
+            if ingredient.quantity is not None:
+                quantity[i] = ingredient.quantity
+            if unit in FIXED_UNIT_GRAMS:
+                kind[i] = _KIND_FIXED
+                fixed[i] = FIXED_UNIT_GRAMS[unit]
+            elif unit == "大さじ":
+                kind[i] = _KIND_TBSP
+            elif unit == "小さじ":
+                kind[i] = _KIND_TSP
+            elif unit in PIECE_UNITS:
+                kind[i] = _KIND_PIECE
+
+        indices = np.asarray(indices, dtype=np.intp)
+        per_unit = np.select(
+            [kind == _KIND_FIXED, kind == _KIND_TBSP, kind == _KIND_TSP, kind == _KIND_PIECE],
+            [
+                fixed,
+                np.nan_to_num(self.tbsp_g[indices], nan=DEFAULT_TBSP_G),
+                np.nan_to_num(self.tsp_g[indices], nan=DEFAULT_TSP_G),
+                np.nan_to_num(self.piece_g[indices], nan=DEFAULT_PIECE_G),
+            ],
+            default=DEFAULT_AMOUNT_G,
+        )
+        return np.where(kind == _KIND_DEFAULT, default_grams, quantity * per_unit)
+
+    # 材料ごとの栄養価（行: 材料, 列: NUTRIENTS）を一括で計算する
+    # recipe_ids を渡すと、レシピごとの合計（行: レシピ）を返す
+    def compute(self, indices, grams, recipe_ids=None):
+        indices = np.asarray(indices, dtype=np.intp)
+        grams = np.asarray(grams, dtype=np.float64)
+        per_item = self.values[indices] * (grams / 100.0)[:, None]
+        if recipe_ids is None:
+            return per_item
+        recipe_ids = np.asarray(recipe_ids, dtype=np.intp)
+        totals = np.zeros((recipe_ids.max() + 1 if len(recipe_ids) else 0, len(NUTRIENTS)))
+        np.add.at(totals, recipe_ids, per_item)
+        return totals
+
+
+# CSV（name,kcal,protein,fat,carbs,tbsp_g,tsp_g,piece_g）から栄養表を読み込む
+def load_nutrition_table(path):
+    names, values, tbsp_g, tsp_g, piece_g = [], [], [], [], []
+    with open(path, encoding="utf-8", newline="") as f:
+        for row in csv.DictReader(f):
+            name = (row.get("name") or "").strip()
+            if not name:
+                continue
+            names.append(name)
+            values.append([_float_or(row.get(column), 0.0) for column in NUTRIENTS])
+            tbsp_g.append(_float_or(row.get("tbsp_g"), np.nan))
+            tsp_g.append(_float_or(row.get("tsp_g"), np.nan))
+            piece_g.append(_float_or(row.get("piece_g"), np.nan))
+    return NutritionTable(names, values, tbsp_g, tsp_g, piece_g)
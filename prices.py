@@ -0,0 +1,103 @@
+import csv
+import hashlib
+import os
+import time
+
+import numpy as np
+
+from keyword_matcher import KeywordMatcher
+
+
+DEFAULT_PRICE = 150  # どのキーにも当てはまらない材料の価格（1パックあたり）
+DEFAULT_PACK_G = 300.0  # どのキーにも当てはまらない材料の1パックの量
+STANDARD_COLUMN = "price"
+
+# 価格列の表示名（price_xxx 列を追加すると xxx の名前で選べる）
+REGION_LABELS = {
+    "price": "標準",
+    "price_tokyo": "東京",
+    "price_osaka": "大阪",
+}
+
+
+def _region_label(column):
+    return REGION_LABELS.get(column, column[len("price_"):] if column.startswith("price_") else column)
+
+
+# 材料の価格表（読み込み後は変更しない。全セッションで共有する）
+# prices[i, r] は i番目の材料の地域・店舗 r での1パックの価格、pack_g[i] はその量(g)
+class PriceCatalog:
+    def __init__(self, names, pack_g, prices, columns, version=""):
+        self.names = tuple(names)
+        self.columns = tuple(columns)
+        self.regions = tuple(_region_label(column) for column in self.columns)
+        self.version = version
+
+        prices = np.asarray(prices, dtype=np.float64).reshape(len(self.names), len(self.columns))
+        # 地域・店舗の価格が空欄の場合は標準価格を使う
+        standard = prices[:, self.columns.index(STANDARD_COLUMN)]
+        prices = np.where(np.isnan(prices), standard[:, None], prices)
+        # 最後の行に「その他」を置き、見つからない材料もインデックスで計算できるようにする
+        self.prices = np.vstack([prices, np.full(len(self.columns), float(DEFAULT_PRICE))]).astype(np.float32)
+        self.pack_g = np.append(np.asarray(pack_g, dtype=np.float64), DEFAULT_PACK_G).astype(np.float32)
+        self.default_index = len(self.names)
+        self._matcher = KeywordMatcher(
+            {name: i for i, name in enumerate(self.names)}, default_value=self.default_index
+        )
+        self.prices.setflags(write=False)
+        self.pack_g.setflags(write=False)
+
+    def region_index(self, region):
+        if region in self.regions:
+            return self.regions.index(region)
+        return self.columns.index(STANDARD_COLUMN)
+
+    # 材料ごとに価格表の行を探す（戻り値: 一致したキーのリスト, 行インデックスの配列）
+    def lookup(self, texts):
+        matches = self._matcher.match_all(texts)
+        keys = [key for key, _ in matches]
+        indices = np.fromiter((index for _, index in matches), dtype=np.intp, count=len(matches))
+        return keys, indices
+
+    # 1パックあたりの価格
+    def pack_prices(self, indices, region=None):
+        return self.prices[np.asarray(indices, dtype=np.intp), self.region_index(region)].astype(np.float64)
+
+    # 使う量(g)に応じた価格をまとめて計算する
+    def estimate(self, indices, grams, region=None):
+        indices = np.asarray(indices, dtype=np.intp)
+        grams = np.asarray(grams, dtype=np.float64)
+        return self.pack_prices(indices, region) * grams / self.pack_g[indices]
+
+
+# CSV（name,category,pack_g,price,price_xxx...）から価格表を読み込む
+def load_price_catalog(path):
+    with open(path, "rb") as f:
+        raw = f.read()
+    reader = csv.DictReader(raw.decode("utf-8-sig").splitlines())
+    columns = [column for column in reader.fieldnames or [] if column == STANDARD_COLUMN or column.startswith("price_")]
+    if STANDARD_COLUMN not in columns:
+        raise ValueError(f"{path} に {STANDARD_COLUMN} 列がありません")
+
+    names, pack_g, prices = [], [], []
+    seen = {}
+    for row in reader:
+        name = (row.get("name") or "").strip()
+        if not name:
+            continue
+        values = [float(row[column]) if (row.get(column) or "").strip() else np.nan for column in columns]
+        pack = float(row["pack_g"]) if (row.get("pack_g") or "").strip() else DEFAULT_PACK_G
+        # 同じ材料が複数行ある場合は後の行で上書きする
+        if name in seen:
+            pack_g[seen[name]] = pack
+            prices[seen[name]] = values
+            continue
+        seen[name] = len(names)
+        names.append(name)
+        pack_g.append(pack)
+        prices.append(values)
+
+    # 更新日時と内容のハッシュを版として表示する
+    updated = time.strftime("%Y-%m-%d %H:%M", time.localtime(os.path.getmtime(path)))
+    version = f"{updated} ({hashlib.sha1(raw).hexdigest()[:8]})"
+    return PriceCatalog(names, pack_g, prices, columns, version)
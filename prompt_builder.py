@@ -0,0 +1,51 @@
+# AIに送るプロンプトの組み立て（システムプロンプト・回答の長さの上限・追加で頼む項目）
+
+# どの質問でも同じ内容にして、プロバイダ側のプロンプトキャッシュが効くようにする（可変の値は入れない）
+SYSTEM_PROMPT = (
+    "あなたは家庭料理のアドバイザーです。"
+    "料理名、材料（分量つきの箇条書き）、作り方（番号付き）を簡潔に答えてください。"
+    "前置きやまとめの文は不要です。"
+)
+
+# 会話の続き（追加の要望）で、要望の前に付ける指示
+FOLLOWUP_INSTRUCTION = "次の要望に合わせて直前のレシピを修正し、変更点が分かるように答えてください。\n要望: "
+
+# モードごとの回答の長さの上限（max_tokens）。生成にかかる時間は回答のトークン数にほぼ比例する
+# 日本語はおおよそ1文字1トークン。構造化出力はJSONの記号の分だけ多めにする（足りないとJSONが途中で切れる）
+DEFAULT_OUTPUT_BUDGETS = {
+    "answer": 800,  # 通常の回答
+    "structured": 1000,  # 構造化レシピ（JSON）
+    "compare": 600,  # メニュー比較の各案
+    "meal_plan": 800,  # 1週間の献立の各日（JSON）
+    "followup": 800,  # 会話の続き（追加の要望）
+}
+
+# 利用者が選んだときだけ頼む項目
+OPTIONAL_SECTIONS = {
+    "dessert": "デザート",
+    "drink": "飲み物",
+}
+
+
+# 追加で頼む項目の指示（sections: OPTIONAL_SECTIONS のキー）
+# 構造化出力ではスキーマの項目は省けないので、頼まない項目は空にしてもらう
+def section_instruction(sections, structured=False):
+    wanted = [label for name, label in OPTIONAL_SECTIONS.items() if name in sections]
+    skipped = [label for name, label in OPTIONAL_SECTIONS.items() if name not in sections]
+    instruction = f"料理に合う{'と'.join(wanted)}も1つずつ提案してください。" if wanted else ""
+    if structured and skipped:
+        instruction += f"{'・'.join(skipped)}の提案は空の配列にしてください。"
+    return instruction
+
+
+# 質問と条件から利用者のメッセージを作る
+def build_user_prompt(question, num_people, difficulty, target_calorie, sections=(), structured=False):
+    prompt = f"{question}（{num_people}人分・{difficulty}・{target_calorie}kcal前後）"
+    return prompt + section_instruction(sections, structured)
+
+
+def request_messages(prompt):
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": prompt},
+    ]
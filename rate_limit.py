@@ -0,0 +1,70 @@
+"""1分あたりの上限で呼び出しを制限するバケット
+
+TokenBucket はプロセス内、SharedTokenBucket は state_backend のバックエンドで複数ワーカーと残量を共有する。
+llm_gateway（AIへのリクエスト）と state_backend の両方から使う。
+"""
+import threading
+import time
+
+
+# トークンバケット（1分あたりの上限を秒単位で補充する）
+# 先に予約して残量をマイナスにし、戻り値の秒数だけ待ってから使う
+class TokenBucket:
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self._tokens = self.capacity
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    def reserve(self, amount):
+        amount = min(float(amount), self.capacity)
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens -= amount
+            return max(0.0, -self._tokens / self.rate)
+
+    # 予約した分を戻す（待ちきれずに諦めたとき・実際の使用量が見積もりより少なかったとき）
+    # マイナスを渡すと追加で消費する
+    def adjust(self, amount):
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens = min(self.capacity, self._tokens + amount)
+
+
+# 共有バックエンドに残量を置くトークンバケット（全ワーカーの合計で1分あたりの上限を守る）
+# 残量と最後に補充した時刻をひとつの値にして、backend.update で読み書きする
+# 時刻は各ワーカーの time.time() を使う（複数サーバのときは時計を合わせておく）
+class SharedTokenBucket:
+    def __init__(self, backend, name, per_minute):
+        self.backend = backend
+        self.key = f"ratelimit:{name}"
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+
+    # 補充してから amount を取り出し、取り出したあとの残量を返す（amount がマイナスなら戻す）
+    def _take(self, amount):
+        def take(value):
+            now = time.time()
+            if value is None:
+                tokens, updated_at = self.capacity, now
+            else:
+                tokens, updated_at = map(float, value.split())
+            tokens = min(self.capacity, tokens + max(0.0, now - updated_at) * self.rate - amount)
+            return f"{tokens!r} {now!r}".encode("ascii"), tokens
+
+        # 使われなくなったバケットは満タンに戻っているはずなので、1時間で消す
+        return self.backend.update(self.key, take, ttl=3600)
+
+    def reserve(self, amount):
+        tokens = self._take(min(float(amount), self.capacity))
+        return max(0.0, -tokens / self.rate)
+
+    # 予約した分を戻す（マイナスを渡すと追加で消費する）
+    def adjust(self, amount):
+        if amount:
+            self._take(-float(amount))
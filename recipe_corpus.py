@@ -0,0 +1,358 @@
+"""ローカルのレシピ集（AIを呼ばずに答えるための検索インデックス）
+
+AIの回答・お気に入り・取り込んだデータセットのレシピを SQLite に保存し、
+料理名の索引と、材料名の文字2-gram（bigram）による FTS5 の転置インデックスを作る。
+「親子丼の作り方」のような定番の質問や「豚肉とキャベツで作れる料理」のような材料検索は
+このインデックスから返し、見つからないときだけAIに問い合わせる。
+
+    python recipe_corpus.py import recipes.jsonl
+        # {"answer": ..., "question"/"dish_name"/"num_people"/"difficulty"/"target_calorie"/"sections" は任意}
+    python recipe_corpus.py favorites              # お気に入りを取り込む
+"""
+import argparse
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import namedtuple
+
+from favorites_store import recipe_id, recipe_title
+from ingredients import Ingredient, extract_ingredients
+from semantic_cache import calorie_bucket, sections_key, semantic_text
+
+
+# レシピ1件分（ingredients は Ingredient のリスト）
+CorpusRecipe = namedtuple(
+    "CorpusRecipe", ["id", "dish_name", "question", "answer", "ingredients", "num_people", "source", "created_at"]
+)
+
+_COLUMNS = "id, dish_name, question, answer, ingredients, num_people, source, created_at"
+
+# 「豚肉とキャベツで作れる料理」「卵を使ったレシピ」のような材料からの質問
+_INGREDIENT_QUERY_RE = re.compile(
+    r"^(.+?)(?:だけ)?(?:で|を使って|を使った|を使う|があるので|が余って(?:いる|る)?(?:ので)?)"
+    r"(?:作れる|できる|何|なに|料理|レシピ|おかず|メニュー)"
+)
+_INGREDIENT_SPLIT_RE = re.compile(r"[と、,，・&＆\s]+")
+_PEOPLE_RE = re.compile(r"(\d+)\s*人分")
+# 回答の1行目から料理名を取り出すときに取り除く部分（「(2人分)」「はいかがでしょう。」など）
+_TITLE_NOTE_RE = re.compile(r"[（(][^）)]*[）)]")
+_TITLE_TAIL_RE = re.compile(r"(?:はいかが|の作り方|のポイント|がおすすめ|です|。).*$")
+
+
+def _compact(text):
+    return "".join(unicodedata.normalize("NFKC", text or "").split())
+
+
+# 文字2-gramに分けて空白区切りにする（FTS5 の unicode61 で1トークンずつになる。1文字の語はそのまま）
+def bigrams(text):
+    tokens = []
+    for part in unicodedata.normalize("NFKC", text or "").lower().split():
+        if len(part) < 2:
+            tokens.append(part)
+        else:
+            tokens += [part[i:i + 2] for i in range(len(part) - 1)]
+    return " ".join(tokens)
+
+
+# FTS5 の検索式（語ごとに bigram の並びをフレーズで探す）
+def _match_phrase(term):
+    return '"' + bigrams(term).replace('"', '""') + '"'
+
+
+# 材料から探す質問なら材料名のリストを返す（それ以外は空のリスト）
+def ingredient_query(question):
+    match = _INGREDIENT_QUERY_RE.match(unicodedata.normalize("NFKC", question or "").strip())
+    if not match:
+        return []
+    terms = [term.strip("のをがはもに") for term in _INGREDIENT_SPLIT_RE.split(match.group(1))]
+    return list(dict.fromkeys(term for term in terms if term))
+
+
+# 回答に書かれた人数（「材料（2人分）」など）。無ければ None
+def answer_num_people(answer):
+    match = _PEOPLE_RE.search(unicodedata.normalize("NFKC", answer or ""))
+    return int(match.group(1)) if match else None
+
+
+# 回答の1行目から料理名を作る（質問が無いデータセットの取り込み用）
+def dish_from_answer(answer):
+    title = _TITLE_TAIL_RE.sub("", _TITLE_NOTE_RE.sub("", recipe_title(answer)))
+    return semantic_text(title)
+
+
+def _row_to_recipe(row):
+    ingredients = [Ingredient(*item) for item in json.loads(row[4])]
+    return CorpusRecipe(row[0], row[1], row[2], row[3], ingredients, row[5], row[6], row[7])
+
+
+# レシピ集（SQLite。全セッション・全ワーカーで共有する）
+# max_entries 件を超えたら、AIの回答から、最後に使われた（なければ登録した）のが古い順に消す
+# 取り込んだレシピ・お気に入りは、AIの回答が残っていないときだけ消す
+class RecipeCorpus:
+    def __init__(self, db_path, max_entries=20000):
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "lookups": 0, "lookup_seconds": 0.0}
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, timeout=10)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS recipes ("
+            " id TEXT NOT NULL UNIQUE,"
+            " dish_name TEXT NOT NULL,"
+            " question TEXT NOT NULL,"
+            " answer TEXT NOT NULL,"
+            " ingredients TEXT NOT NULL,"
+            " num_people INTEGER,"
+            " source TEXT NOT NULL,"
+            " created_at REAL NOT NULL)"
+        )
+        # 回答を作ったときの条件（難易度・カロリー帯・追加で頼んだ項目）。取り込んだレシピなど条件が分からないときは NULL
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(recipes)")}
+        # used_at: 最後に質問の答えとして返した時刻（件数の上限で消す順番に使う）
+        for column, column_type in (
+            ("difficulty", "TEXT"), ("calorie_bucket", "INTEGER"), ("sections", "TEXT"), ("used_at", "REAL"),
+        ):
+            if column not in columns:
+                self._conn.execute(f"ALTER TABLE recipes ADD COLUMN {column} {column_type}")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_recipes_dish ON recipes(dish_name, num_people)")
+        # 材料名の bigram の転置インデックス（FTS5 が無い環境では LIKE で検索する）
+        try:
+            self._conn.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS recipes_fts USING fts5("
+                " ingredient_names, tokenize='unicode61 remove_diacritics 0')"
+            )
+            self.full_text_search = True
+        except sqlite3.OperationalError:
+            self.full_text_search = False
+        self._conn.commit()
+
+    def count(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM recipes").fetchone()[0]
+
+    # レシピを保存する（同じ回答なら何もしない）。戻り値はキー
+    # dish_name を省略すると質問（無ければ回答の1行目）から料理名を作る
+    # difficulty / target_calorie / sections は回答を作ったときの条件（分からなければ None）
+    def add(
+        self, answer, ingredients=None, question="", num_people=None, source="answer", dish_name=None,
+        difficulty=None, target_calorie=None, sections=None,
+    ):
+        if ingredients is None:
+            ingredients = extract_ingredients(answer)
+        if not ingredients:
+            return None  # 材料の無い回答（雑談など）は入れない
+        dish_name = _compact(dish_name or semantic_text(question) or dish_from_answer(answer))
+        if num_people is None:
+            num_people = answer_num_people(answer)
+        key = recipe_id(answer)
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT OR IGNORE INTO recipes"
+                " (id, dish_name, question, answer, ingredients, num_people, source, created_at,"
+                " difficulty, calorie_bucket, sections)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    key, dish_name, question or "", answer,
+                    json.dumps([list(ingredient) for ingredient in ingredients], ensure_ascii=False),
+                    num_people, source, time.time(), difficulty,
+                    calorie_bucket(target_calorie) if target_calorie is not None else None,
+                    sections_key(sections) if sections is not None else None,
+                ),
+            )
+            if cursor.rowcount and self.full_text_search:
+                self._conn.execute(
+                    "INSERT INTO recipes_fts (rowid, ingredient_names) VALUES (?, ?)",
+                    (
+                        cursor.lastrowid,
+                        " ".join(bigrams(ingredient.name) for ingredient in ingredients),
+                    ),
+                )
+            if cursor.rowcount:
+                self._evict()
+            self._conn.commit()
+        return key
+
+    # 上限を超えた分を消す（self._lock を持って呼ぶ。転置インデックスの行も一緒に消す）
+    def _evict(self):
+        excess = self._conn.execute("SELECT COUNT(*) FROM recipes").fetchone()[0] - self.max_entries
+        if excess <= 0:
+            return
+        rowids = [row[0] for row in self._conn.execute(
+            "SELECT rowid FROM recipes ORDER BY source = 'answer', COALESCE(used_at, created_at) DESC"
+            " LIMIT -1 OFFSET ?",
+            (self.max_entries,),
+        )]
+        for start in range(0, len(rowids), 500):
+            chunk = rowids[start:start + 500]
+            placeholders = ",".join("?" * len(chunk))
+            if self.full_text_search:
+                self._conn.execute(f"DELETE FROM recipes_fts WHERE rowid IN ({placeholders})", chunk)
+            self._conn.execute(f"DELETE FROM recipes WHERE rowid IN ({placeholders})", chunk)
+
+    # 質問の答えとして返したレシピの使われた時刻を更新する
+    def _touch(self, recipe_ids):
+        if not recipe_ids:
+            return
+        with self._lock:
+            self._conn.execute(
+                f"UPDATE recipes SET used_at = ? WHERE id IN ({','.join('?' * len(recipe_ids))})",
+                [time.time()] + list(recipe_ids),
+            )
+            self._conn.commit()
+
+    def _record(self, started, hit):
+        with self._lock:
+            self.stats["lookups"] += 1
+            self.stats["lookup_seconds"] += time.perf_counter() - started
+            self.stats["hits" if hit else "misses"] += 1
+
+    # 条件で絞り込む WHERE 句（semantic_cache.make_bucket と同じ条件。None の条件では絞り込まない）
+    # 人数・難易度・カロリー帯が分からないレシピはどの条件でも使う
+    # 追加で頼んだ項目が分からないレシピは、何も頼んでいないときだけ使う
+    def _conditions_clause(self, num_people=None, difficulty=None, target_calorie=None, sections=None):
+        sql, params = "", []
+        for column, value in (
+            ("num_people", num_people),
+            ("difficulty", difficulty),
+            ("calorie_bucket", calorie_bucket(target_calorie) if target_calorie is not None else None),
+        ):
+            if value is not None:
+                sql += f" AND ({column} = ? OR {column} IS NULL)"
+                params.append(value)
+        if sections is not None:
+            key = sections_key(sections)
+            sql += " AND sections = ?" if key != "-" else " AND (sections = ? OR sections IS NULL)"
+            params.append(key)
+        return sql, params
+
+    # 料理名の質問（「親子丼の作り方」など）に合うレシピを返す。無ければ None
+    # 言い回しを取り除いた質問が料理名と完全に一致したときだけ使う（「親子丼 辛口」は「親子丼」とは別の料理として扱う）
+    def find_dish(self, question, num_people=None, difficulty=None, target_calorie=None, sections=None):
+        started = time.perf_counter()
+        core = _compact(semantic_text(question))
+        result = None
+        if core:
+            conditions_sql, conditions_params = self._conditions_clause(num_people, difficulty, target_calorie, sections)
+            with self._lock:
+                row = self._conn.execute(
+                    f"SELECT {_COLUMNS} FROM recipes WHERE dish_name = ?{conditions_sql}"
+                    " ORDER BY num_people IS NULL, difficulty IS NULL, calorie_bucket IS NULL, created_at DESC LIMIT 1",
+                    [core] + conditions_params,
+                ).fetchone()
+            result = _row_to_recipe(row) if row else None
+        self._record(started, result is not None)
+        if result is not None:
+            self._touch([result.id])
+        return result
+
+    # 材料名を使うレシピを、一致した材料が多い順に返す（戻り値: (レシピ, 一致した材料の数) のリスト）
+    def search_ingredients(
+        self, names, num_people=None, difficulty=None, target_calorie=None, sections=None, limit=5
+    ):
+        started = time.perf_counter()
+        names = list(dict.fromkeys(_compact(name) for name in names if _compact(name)))
+        results = []
+        if names:
+            # 材料ごとに一致したレシピを並べ、レシピごとの件数を一致した材料の数にする
+            matches, params = [], []
+            for name in names:
+                if self.full_text_search and len(name) >= 2:
+                    matches.append("SELECT rowid FROM recipes_fts WHERE recipes_fts MATCH ?")
+                    params.append(_match_phrase(name))
+                else:
+                    # 1文字の材料名（「卵」など）は bigram にならないので LIKE で探す
+                    matches.append("SELECT rowid FROM recipes WHERE ingredients LIKE ? ESCAPE '\\'")
+                    params.append("%" + name.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%")
+            conditions_sql, conditions_params = self._conditions_clause(num_people, difficulty, target_calorie, sections)
+            with self._lock:
+                rows = self._conn.execute(
+                    f"SELECT {_COLUMNS}, COUNT(*) AS matched FROM recipes"
+                    f" JOIN ({' UNION ALL '.join(matches)}) AS m ON m.rowid = recipes.rowid"
+                    f" WHERE 1{conditions_sql} GROUP BY recipes.rowid ORDER BY matched DESC, recipes.rowid DESC LIMIT ?",
+                    params + conditions_params + [limit],
+                ).fetchall()
+            results = [(_row_to_recipe(row[:-1]), row[-1]) for row in rows]
+        self._record(started, bool(results))
+        self._touch([recipe.id for recipe, _ in results])
+        return results
+
+    def hit_rate(self):
+        return self.stats["hits"] / self.stats["lookups"] if self.stats["lookups"] else 0.0
+
+    def mean_lookup_ms(self):
+        return self.stats["lookup_seconds"] / self.stats["lookups"] * 1000 if self.stats["lookups"] else 0.0
+
+
+# JSON Lines のレシピを取り込む。戻り値は追加した件数
+def import_jsonl(corpus, path, source="import"):
+    before = corpus.count()
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            corpus.add(
+                item["answer"],
+                question=item.get("question", ""),
+                num_people=item.get("num_people"),
+                source=source,
+                dish_name=item.get("dish_name"),
+                difficulty=item.get("difficulty"),
+                target_calorie=item.get("target_calorie"),
+                sections=item.get("sections"),
+            )
+    return corpus.count() - before
+
+
+# お気に入りに保存したレシピを取り込む
+def import_favorites(corpus, favorites_store, page_size=100):
+    before = corpus.count()
+    page = 0
+    while True:
+        favorites = favorites_store.page(page, page_size)
+        for favorite in favorites:
+            corpus.add(favorite.answer, favorite.ingredients, favorite.question, source="favorite")
+        if len(favorites) < page_size:
+            break
+        page += 1
+    return corpus.count() - before
+
+
+def main():
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("command", choices=["import", "favorites", "count"])
+    parser.add_argument("path", nargs="?")
+    parser.add_argument(
+        "--db", default=os.environ.get("RECIPE_CORPUS_PATH", os.path.join(base_dir, ".data", "recipes.sqlite3"))
+    )
+    parser.add_argument(
+        "--max-entries", type=int, default=int(os.environ.get("RECIPE_CORPUS_MAX_ENTRIES", "20000")),
+        help="レシピ集の件数の上限（超えたらAIの回答の使われていないものから消す）",
+    )
+    parser.add_argument(
+        "--favorites-db",
+        default=os.environ.get("FAVORITES_DB_PATH", os.path.join(base_dir, ".data", "favorites.sqlite3")),
+    )
+    args = parser.parse_args()
+
+    corpus = RecipeCorpus(args.db, max_entries=args.max_entries)
+    if args.command == "import":
+        if not args.path:
+            parser.error("取り込むファイルを指定してください")
+        print(f"{import_jsonl(corpus, args.path)}件を追加しました（合計 {corpus.count()}件）")
+    elif args.command == "favorites":
+        from favorites_store import FavoritesStore
+        print(f"{import_favorites(corpus, FavoritesStore(args.favorites_db))}件を追加しました（合計 {corpus.count()}件）")
+    else:
+        print(corpus.count())
+
+
+if __name__ == "__main__":
+    main()
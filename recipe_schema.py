@@ -0,0 +1,133 @@
+import json
+
+from ingredients import Ingredient
+
+
+# AIに返してもらうレシピのJSONスキーマ（structured outputs 用）
+RECIPE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "dish_name": {"type": "string"},
+        "ingredients": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "name": {"type": "string"},
+                    "quantity": {"type": ["number", "null"]},
+                    "unit": {"type": "string"},
+                },
+                "required": ["name", "quantity", "unit"],
+                "additionalProperties": False,
+            },
+        },
+        "steps": {"type": "array", "items": {"type": "string"}},
+        "dessert_suggestions": {"type": "array", "items": {"type": "string"}},
+        "drink_suggestions": {"type": "array", "items": {"type": "string"}},
+        "estimated_kcal": {"type": ["number", "null"]},
+    },
+    "required": [
+        "dish_name",
+        "ingredients",
+        "steps",
+        "dessert_suggestions",
+        "drink_suggestions",
+        "estimated_kcal",
+    ],
+    "additionalProperties": False,
+}
+
+RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {"name": "recipe", "schema": RECIPE_SCHEMA, "strict": True},
+}
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+# AIの回答（JSON文字列）を検証してdictにする。形式がおかしい場合は ValueError
+def parse_recipe(text):
+    try:
+        data = json.loads(text)
+    except (TypeError, json.JSONDecodeError) as e:
+        raise ValueError(f"JSONとして読み込めません: {e}") from e
+    if not isinstance(data, dict):
+        raise ValueError("レシピがオブジェクトではありません")
+
+    dish_name = data.get("dish_name")
+    if not isinstance(dish_name, str) or not dish_name.strip():
+        raise ValueError("dish_name がありません")
+
+    items = data.get("ingredients")
+    if not isinstance(items, list) or not items:
+        raise ValueError("ingredients がありません")
+    ingredients = []
+    for item in items:
+        if not isinstance(item, dict) or not isinstance(item.get("name"), str) or not item["name"].strip():
+            raise ValueError(f"材料の形式が不正です: {item!r}")
+        quantity = item.get("quantity")
+        if quantity is not None and not _is_number(quantity):
+            raise ValueError(f"分量が数値ではありません: {item!r}")
+        unit = item.get("unit") or ""
+        if not isinstance(unit, str):
+            raise ValueError(f"単位が文字列ではありません: {item!r}")
+        ingredients.append({"name": item["name"].strip(), "quantity": quantity, "unit": unit.strip()})
+
+    lists = {}
+    for field in ("steps", "dessert_suggestions", "drink_suggestions"):
+        value = data.get(field) or []
+        if not isinstance(value, list) or not all(isinstance(v, str) for v in value):
+            raise ValueError(f"{field} の形式が不正です")
+        lists[field] = [v.strip() for v in value if v.strip()]
+
+    kcal = data.get("estimated_kcal")
+    if kcal is not None and not _is_number(kcal):
+        raise ValueError("estimated_kcal が数値ではありません")
+
+    return {
+        "dish_name": dish_name.strip(),
+        "ingredients": ingredients,
+        "steps": lists["steps"],
+        "dessert_suggestions": lists["dessert_suggestions"],
+        "drink_suggestions": lists["drink_suggestions"],
+        "estimated_kcal": kcal,
+    }
+
+
+def _format_quantity(item):
+    quantity = item["quantity"]
+    if quantity is None:
+        return item["unit"]
+    number = f"{quantity:g}"
+    # 大さじ・小さじは「大さじ2」の順で書く
+    if item["unit"] in ("大さじ", "小さじ", "カップ"):
+        return f"{item['unit']}{number}"
+    return f"{number}{item['unit']}"
+
+
+# レシピから材料リストを作る（材料費・カロリー・ネットスーパーで使う形）
+def recipe_ingredients(recipe):
+    result = []
+    for item in recipe["ingredients"]:
+        quantity_text = _format_quantity(item)
+        text = f"{item['name']} {quantity_text}".strip()
+        unit = item["unit"] or ("" if item["quantity"] is not None else None)
+        result.append(Ingredient(text, item["name"], item["quantity"], unit))
+    return tuple(result)
+
+
+# レシピを従来のテキスト回答と同じ形式に整形する（Gmail・お店検索などはこのテキストを使う）
+def recipe_to_text(recipe, num_people):
+    lines = [f"【{recipe['dish_name']}】", f"材料（{num_people}人分）"]
+    lines += [f"- {ingredient.text}" for ingredient in recipe_ingredients(recipe)]
+    lines += ["", "作り方"]
+    lines += [f"{i}. {step}" for i, step in enumerate(recipe["steps"], 1)]
+    if recipe["estimated_kcal"] is not None:
+        lines += ["", f"推定カロリー: 約{recipe['estimated_kcal']:g}kcal"]
+    if recipe["dessert_suggestions"]:
+        lines += ["", "おすすめのデザート: " + "、".join(recipe["dessert_suggestions"])]
+    if recipe["drink_suggestions"]:
+        lines += ["", "おすすめの飲み物: " + "、".join(recipe["drink_suggestions"])]
+    return "\n".join(lines)
@@ -0,0 +1,135 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+
+# 質問文の表記ゆれ（全角/半角・余分な空白）を吸収する
+def normalize_question(text):
+    text = unicodedata.normalize("NFKC", text or "")
+    return " ".join(text.split())
+
+
+# プロンプトの構成要素からキャッシュキーを作る
+def make_cache_key(question, num_people, difficulty, target_calorie, deployment, api_version, **extra):
+    payload = {
+        "question": normalize_question(question),
+        "num_people": num_people,
+        "difficulty": difficulty,
+        "target_calorie": target_calorie,
+        "deployment": deployment,
+        "api_version": api_version,
+    }
+    payload.update(extra)
+    raw = json.dumps(payload, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+# AI回答のキャッシュ（プロセス内のLRU + SQLiteのディスク層）
+# backend（state_backend）を渡すと、ディスク層の代わりにそこへ保存して他のワーカー・サーバと共有する
+class ResponseCache:
+    def __init__(self, db_path, max_memory_entries=256, max_disk_entries=5000, ttl_seconds=7 * 24 * 3600, backend=None):
+        self.db_path = db_path
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_entries = max_disk_entries
+        self.ttl_seconds = ttl_seconds
+        self.backend = backend
+        self._memory = OrderedDict()  # key -> (answer, created_at)
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "memory_hits": 0, "disk_hits": 0, "misses": 0}
+        if backend is not None:
+            return
+
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        # 複数セッション・複数ワーカーから共有するのでWALモードで開く
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, timeout=10)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY,"
+            " answer TEXT NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " accessed_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_accessed ON responses(accessed_at)")
+        self._conn.commit()
+
+    def _expired(self, created_at, now):
+        return self.ttl_seconds is not None and now - created_at > self.ttl_seconds
+
+    def _remember(self, key, answer, created_at):
+        self._memory[key] = (answer, created_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            # まずはプロセス内キャッシュを確認
+            entry = self._memory.get(key)
+            if entry is not None:
+                answer, created_at = entry
+                if not self._expired(created_at, now):
+                    self._memory.move_to_end(key)
+                    self.stats["hits"] += 1
+                    self.stats["memory_hits"] += 1
+                    return answer
+                del self._memory[key]
+
+            # 次にディスク（他のワーカーが保存した回答も含む）
+            if self.backend is not None:
+                # 期限切れはバックエンド側で消える
+                value = self.backend.get("response:" + key)
+                if value is not None:
+                    answer = value.decode("utf-8")
+                    self._remember(key, answer, now)
+                    self.stats["hits"] += 1
+                    self.stats["disk_hits"] += 1
+                    return answer
+                self.stats["misses"] += 1
+                return None
+            row = self._conn.execute(
+                "SELECT answer, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None:
+                answer, created_at = row
+                if not self._expired(created_at, now):
+                    self._conn.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+                    self._conn.commit()
+                    self._remember(key, answer, created_at)
+                    self.stats["hits"] += 1
+                    self.stats["disk_hits"] += 1
+                    return answer
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._conn.commit()
+
+            self.stats["misses"] += 1
+            return None
+
+    def set(self, key, answer):
+        now = time.time()
+        with self._lock:
+            self._remember(key, answer, now)
+            if self.backend is not None:
+                self.backend.set("response:" + key, answer.encode("utf-8"), self.ttl_seconds)
+                return
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, answer, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, answer, now, now),
+            )
+            # 古いものから削除してディスク上の件数を抑える
+            self._conn.execute(
+                "DELETE FROM responses WHERE key IN ("
+                " SELECT key FROM responses ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_disk_entries,),
+            )
+            self._conn.commit()
+
+    def hit_rate(self):
+        total = self.stats["hits"] + self.stats["misses"]
+        return self.stats["hits"] / total if total else 0.0
@@ -0,0 +1,270 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import Counter
+
+import numpy as np
+
+from response_cache import normalize_question
+from state_backend import SharedLog
+
+
+# ベクトル化の前に取り除く言い回し（料理名や食材の違いだけで比べられるようにする）
+_FILLER_RE = re.compile(
+    r"の作り方|作り方|作りたい|作って|作る|教えてください|教えて|レシピ|を知りたい|知りたい|"
+    r"簡単に|簡単な|簡単|かんたん|手軽に|手軽な|お願いします|ください|について|"
+    r"[\s、。,.!?！？「」『』()（）]"
+)
+_PARTICLE_RE = re.compile(r"^[のをにでがはとも]+|[のをにでがはとも]+$")
+
+
+# 質問文から比較に使う部分だけを残す
+def semantic_text(question):
+    text = _FILLER_RE.sub(" ", normalize_question(question))
+    parts = [_PARTICLE_RE.sub("", part) for part in text.split()]
+    return " ".join(part for part in parts if part)
+
+
+# 文字n-gram（2文字・3文字）をハッシュで固定次元に割り当てたベクトル（L2正規化済み）
+def embed(question, dim=2048, ngram_sizes=(2, 3)):
+    vector = np.zeros(dim, dtype=np.float32)
+    for part in semantic_text(question).split():
+        grams = [part] if len(part) < min(ngram_sizes) else []
+        for n in ngram_sizes:
+            grams += [part[i:i + n] for i in range(len(part) - n + 1)]
+        for gram in grams:
+            digest = hashlib.blake2b(gram.encode("utf-8"), digest_size=8).digest()
+            vector[int.from_bytes(digest, "little") % dim] += 1.0
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+# 希望カロリーを calorie_step kcal 単位の帯にまとめる（少し動かしただけなら同じ帯）
+def calorie_bucket(target_calorie, calorie_step=100):
+    return int(round(target_calorie / calorie_step)) * calorie_step
+
+
+# 追加で頼んだ項目（デザート・飲み物）を1つの文字列にする（無ければ "-"）
+def sections_key(sections=()):
+    return "+".join(sections) or "-"
+
+
+# 2つの質問で片方にしか無い文字の数（言い回しを取り除いたあとで比べる）
+# 「親子丼 辛口」と「親子丼」は n-gram のベクトルでは似ていても「辛口」の2文字が違う
+def extra_chars(question, other):
+    left = Counter(semantic_text(question).replace(" ", ""))
+    right = Counter(semantic_text(other).replace(" ", ""))
+    return sum((left - right).values()) + sum((right - left).values())
+
+
+# 人数・難易度・カロリー帯・追加で頼んだ項目（デザート・飲み物）が同じ質問だけを比べるためのキー
+def make_bucket(num_people, difficulty, target_calorie, sections=(), calorie_step=100):
+    return f"{num_people}|{difficulty}|{calorie_bucket(target_calorie, calorie_step)}|{sections_key(sections)}"
+
+
+# 似た質問の回答を返すキャッシュ（ベクトルはNumPy行列で保持し、ディスクに保存する）
+# 行列は先に大きめに確保しておき、足りなくなったら倍にする（追加のたびに行列を作り直さない）
+# 保存は追加のたびではなく、flush_delay 秒ごとにまとめてバックグラウンドで行う
+# backend（state_backend）を渡すと、ファイルの代わりにバックエンドのログ（SharedLog）に追記し、
+# 他のワーカーが追加した分もそこから読んで取り込む（ワーカーごとに索引を持ち、ファイルの上書きで消し合わない）
+class SemanticCache:
+    # 似ていても、違う文字がこれより多い質問は別の質問とみなす（「甘口」「和風」などの2文字の違いを区別する）
+    MAX_EXTRA_CHARS = 1
+
+    def __init__(
+        self, path, threshold=0.85, dim=2048, max_entries=20000, flush_delay=2.0, initial_capacity=256, backend=None
+    ):
+        self.path = path
+        self.threshold = threshold
+        self.dim = dim
+        self.max_entries = max_entries
+        self.flush_delay = flush_delay
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self._loaded = False
+        self._vectors = np.zeros((min(initial_capacity, max_entries), dim), dtype=np.float32)
+        self._size = 0
+        self._buckets = []
+        self._questions = []
+        self._answers = []
+        # (バケット, 質問) -> 通し番号（行の位置は 通し番号 - 先頭の行の通し番号）
+        self._positions = {}
+        self._first_serial = 0
+        self._dirty = False
+        self._flush_timer = None
+        self._log = None
+        if backend is not None:
+            self._log = SharedLog(backend, "semantic", max_entries=max_entries)
+        self.stats = {"hits": 0, "misses": 0, "lookups": 0, "lookup_seconds": 0.0}
+
+    # 起動時ではなく最初に使うときに読み込む
+    def _ensure_loaded(self):
+        if self._loaded:
+            return
+        self._loaded = True
+        if self._log is not None or not os.path.exists(self.path):
+            return
+        with np.load(self.path, allow_pickle=False) as data:
+            vectors = data["vectors"].astype(np.float32)
+            if vectors.ndim != 2 or vectors.shape[1] != self.dim:
+                return  # 次元が変わった古いインデックスは使わない
+            vectors = vectors[-self.max_entries:]
+            self._reserve(len(vectors))
+            self._vectors[:len(vectors)] = vectors
+            self._size = len(vectors)
+            self._buckets = data["buckets"].tolist()[-self.max_entries:]
+            self._questions = data["questions"].tolist()[-self.max_entries:]
+            self._answers = data["answers"].tolist()[-self.max_entries:]
+            self._positions = {key: serial for serial, key in enumerate(zip(self._buckets, self._questions))}
+
+    # 起動後の準備などで、先に読み込んでおく
+    def load(self):
+        with self._lock:
+            self._ensure_loaded()
+        self._sync()
+
+    # 他のワーカーがバックエンドに追加した分を取り込む
+    def _sync(self):
+        if self._log is None:
+            return
+        entries = self._log.read_new()
+        if not entries:
+            return
+        with self._lock:
+            for _, value in entries:
+                entry = json.loads(value)
+                vector = embed(entry["question"], self.dim)
+                if vector.any():
+                    self._append(vector, entry["bucket"], entry["question"], entry["answer"])
+
+    # 行列の行数を count 件以上にする（倍々に増やす。max_entries を超えては確保しない）
+    def _reserve(self, count):
+        capacity = len(self._vectors)
+        if count <= capacity:
+            return
+        while capacity < count:
+            capacity = min(max(capacity * 2, 1), self.max_entries)
+        vectors = np.zeros((capacity, self.dim), dtype=np.float32)
+        vectors[:self._size] = self._vectors[:self._size]
+        self._vectors = vectors
+
+    # 変更があったことを記録し、まだ予約されていなければ保存を予約する
+    def _schedule_flush(self):
+        self._dirty = True
+        if self._flush_timer is None:
+            self._flush_timer = threading.Timer(self.flush_delay, self.flush)
+            self._flush_timer.daemon = True
+            self._flush_timer.start()
+
+    # 変更があればディスクに書き出す（予約した保存・終了時・テストから呼ぶ）
+    def flush(self):
+        with self._save_lock:
+            with self._lock:
+                self._flush_timer = None
+                if not self._dirty:
+                    return
+                self._dirty = False
+                # 書き出す間も検索・追加できるよう、ロック中は複製だけ作る
+                snapshot = (
+                    self._vectors[:self._size].copy(),
+                    list(self._buckets), list(self._questions), list(self._answers),
+                )
+            try:
+                self._save(*snapshot)
+            except OSError:
+                with self._lock:
+                    self._dirty = True
+                raise
+
+    def _save(self, vectors, buckets, questions, answers):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        # 複数のワーカーが同時に保存しても一時ファイルがぶつからないよう、プロセスごとに名前を変える
+        tmp = f"{self.path}.{os.getpid()}.tmp.npz"
+        np.savez_compressed(
+            tmp,
+            vectors=vectors,
+            buckets=np.array(buckets, dtype=str),
+            questions=np.array(questions, dtype=str),
+            answers=np.array(answers, dtype=str),
+        )
+        os.replace(tmp, self.path)
+
+    # 同じバケットで一番似ている質問の (回答, 類似度, 元の質問) を返す。しきい値未満なら None
+    # threshold を渡すとそのときだけしきい値を変える（混雑時の代わりの回答など）
+    # strict=False にすると、違う文字が多い質問（「辛口」などの付いた質問）も似た質問として使う
+    def lookup(self, question, bucket, threshold=None, strict=True):
+        threshold = self.threshold if threshold is None else threshold
+        started = time.perf_counter()
+        query = embed(question, self.dim)
+        result = None
+        self._sync()
+        with self._lock:
+            self._ensure_loaded()
+            if self._size and query.any():
+                mask = np.fromiter((b == bucket for b in self._buckets), dtype=bool, count=self._size)
+                if mask.any():
+                    candidates = np.flatnonzero(mask)
+                    scores = self._vectors[candidates] @ query
+                    # しきい値を超えたものを似ている順に見て、違う文字が少ないものを使う
+                    for best in np.argsort(-scores):
+                        if scores[best] < threshold:
+                            break
+                        index = candidates[best]
+                        if not strict or extra_chars(question, self._questions[index]) <= self.MAX_EXTRA_CHARS:
+                            result = (self._answers[index], float(scores[best]), self._questions[index])
+                            break
+            self.stats["lookups"] += 1
+            self.stats["lookup_seconds"] += time.perf_counter() - started
+            self.stats["hits" if result else "misses"] += 1
+        return result
+
+    def add(self, question, bucket, answer):
+        vector = embed(question, self.dim)
+        if not vector.any():
+            return
+        normalized = normalize_question(question)
+        if self._log is not None:
+            # 自分の索引にもバックエンドから読んで入れる（他のワーカーの追加と同じ順番にそろう）
+            entry = {"bucket": bucket, "question": normalized, "answer": answer}
+            self._log.append(json.dumps(entry, ensure_ascii=False).encode("utf-8"))
+            self._sync()
+            return
+        with self._lock:
+            self._ensure_loaded()
+            self._append(vector, bucket, normalized, answer)
+            self._schedule_flush()
+
+    def _append(self, vector, bucket, normalized, answer):
+        # 同じ質問がすでにあれば回答だけ入れ替える（同時に生成した場合など）
+        serial = self._positions.get((bucket, normalized))
+        if serial is not None:
+            self._answers[serial - self._first_serial] = answer
+            return
+        # 上限に達したら古いものから1割まとめて削除する（1件ずつ詰め直さない）
+        if self._size >= self.max_entries:
+            overflow = max(1, self.max_entries // 10)
+            for key in zip(self._buckets[:overflow], self._questions[:overflow]):
+                self._positions.pop(key, None)
+            self._vectors[:self._size - overflow] = self._vectors[overflow:self._size]
+            self._size -= overflow
+            self._first_serial += overflow
+            del self._buckets[:overflow], self._questions[:overflow], self._answers[:overflow]
+        self._reserve(self._size + 1)
+        self._vectors[self._size] = vector
+        self._positions[(bucket, normalized)] = self._first_serial + self._size
+        self._size += 1
+        self._buckets.append(bucket)
+        self._questions.append(normalized)
+        self._answers.append(answer)
+
+    def __len__(self):
+        return self._size
+
+    def hit_rate(self):
+        return self.stats["hits"] / self.stats["lookups"] if self.stats["lookups"] else 0.0
+
+    def mean_lookup_ms(self):
+        return self.stats["lookup_seconds"] / self.stats["lookups"] * 1000 if self.stats["lookups"] else 0.0
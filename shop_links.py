@@ -0,0 +1,101 @@
+import hashlib
+import threading
+import urllib.parse
+from collections import OrderedDict, namedtuple
+
+
+# 検索リンクを作るお店（url_template の {query} に検索語が入る）
+Store = namedtuple("Store", ["key", "label", "kind", "prefix", "suffix", "extra_terms"])
+
+# 1回分のリンク一式（restaurants / carts: (お店の名前, URL) のリスト, ingredients: (材料の行, [(お店の名前, URL)]) のリスト）
+ShopLinks = namedtuple("ShopLinks", ["menu_name", "restaurants", "ingredients", "carts", "restaurant_markdown", "grocery_markdown"])
+
+_stores = OrderedDict()
+_lock = threading.Lock()
+_cache = OrderedDict()
+_CACHE_SIZE = 256
+
+
+# お店を登録する（同じ key なら置き換える）
+# kind: "restaurant"（料理名で探す） / "grocery"（材料名で探す）
+# extra_terms: 検索語の後ろに付け足す語（「 レストラン」など）
+def register_store(key, label, url_template, kind="grocery", extra_terms=""):
+    # 毎回テンプレートを解析しないよう、検索語の前後に分けておく
+    prefix, found, suffix = url_template.partition("{query}")
+    if not found:
+        raise ValueError(f"url_template に {{query}} がありません: {url_template}")
+    with _lock:
+        _stores[key] = Store(key, label, kind, prefix, suffix, extra_terms)
+        _cache.clear()
+
+
+def stores(kind=None, keys=None):
+    with _lock:
+        return [
+            store for store in _stores.values()
+            if (kind is None or store.kind == kind) and (keys is None or store.key in keys)
+        ]
+
+
+def search_url(store, query):
+    return store.prefix + urllib.parse.quote(query + store.extra_terms) + store.suffix
+
+
+register_store("google", "Google", "https://www.google.com/search?q={query}", "restaurant", " レストラン")
+register_store("tabelog", "食べログ", "https://tabelog.com/rstLst/?vs=1&sa={query}", "restaurant")
+register_store("aeon", "イオン", "https://shop.aeon.com/netsuper/search/?keyword={query}")
+register_store("seiyu", "西友", "https://sm.rakuten.co.jp/search/?q={query}")
+register_store("amazon", "Amazon", "https://www.amazon.co.jp/s?k={query}&i=grocery")
+
+
+# 回答の1行目から料理名を取り出す
+def menu_name(answer):
+    first_line = (answer or "").split("\n")[0]
+    return first_line.replace("【", "").replace("】", "").replace("メニュー", "").strip()
+
+
+def _build(answer, ingredients, store_keys):
+    name = menu_name(answer)
+    restaurant_stores = stores("restaurant", store_keys)
+    grocery_stores = stores("grocery", store_keys)
+
+    restaurants = [(store.label, search_url(store, name)) for store in restaurant_stores] if name else []
+    # 検索には分量を除いた材料名を使う
+    ingredient_links = [
+        (ingredient.text, [(store.label, search_url(store, ingredient.name)) for store in grocery_stores])
+        for ingredient in ingredients
+    ]
+    # 全部の材料をまとめて1回で検索するリンク
+    all_names = " ".join(dict.fromkeys(ingredient.name for ingredient in ingredients))
+    carts = [(store.label, search_url(store, all_names)) for store in grocery_stores] if ingredients else []
+
+    restaurant_markdown = "\n".join(
+        f"- [{label}で「{name}」のお店を探す]({url})" for label, url in restaurants
+    )
+    grocery_lines = [
+        "- " + text + " " + " / ".join(f"[{label}で探す]({url})" for label, url in links)
+        for text, links in ingredient_links
+    ]
+    if carts:
+        grocery_lines.append(
+            "\n**まとめて探す:** " + " / ".join(f"[{label}で全部の材料を探す]({url})" for label, url in carts)
+        )
+    return ShopLinks(name, restaurants, ingredient_links, carts, restaurant_markdown, "\n".join(grocery_lines))
+
+
+# 回答1件分のリンクをまとめて作る（回答と使うお店の組み合わせごとに結果を使い回す）
+# store_keys を省略すると登録されているお店をすべて使う
+def build_links(answer, ingredients, store_keys=None):
+    store_keys = tuple(store_keys) if store_keys is not None else None
+    key = (hashlib.sha1((answer or "").encode("utf-8")).hexdigest(), store_keys)
+    with _lock:
+        links = _cache.get(key)
+        if links is not None:
+            _cache.move_to_end(key)
+            return links
+    links = _build(answer, ingredients, store_keys)
+    with _lock:
+        _cache[key] = links
+        while len(_cache) > _CACHE_SIZE:
+            _cache.popitem(last=False)
+    return links
@@ -1,4 +1,6 @@
 @echo off
 cd /d %~dp0
+rem 背景画像の変換などを先に済ませておく
+python startup.py
 streamlit run app.py
 pause
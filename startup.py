@@ -0,0 +1,107 @@
+"""起動を速くするための処理
+
+- 重いモジュールは使うときに timed_import で読み込み、読み込み時間を記録する
+- 初回表示のあと start_warm_up で、重いモジュールの読み込みとリソースの準備をバックグラウンドで済ませる
+- サーバ起動前に `python startup.py` を実行すると、背景画像の変換などを済ませておける
+
+    python startup.py && streamlit run app.py
+"""
+import importlib
+import json
+import os
+import sys
+import threading
+import time
+
+from metrics import METRICS
+
+
+# 初回表示には不要で、読み込みに時間がかかるモジュール
+HEAVY_MODULES = ("openai",)
+
+# モジュール名 -> 最初の読み込みにかかった秒数
+IMPORT_TIMES = {}
+
+_lock = threading.Lock()
+_warm_up_started = False
+
+
+# モジュールを読み込む（初回だけ時間を計測して記録する）
+# （sys.modules だけを見ると、別スレッドで読み込み途中のモジュールを返してしまうので import_module を通す）
+def timed_import(name):
+    if name in IMPORT_TIMES:
+        return sys.modules[name]
+    started = time.perf_counter()
+    module = importlib.import_module(name)
+    elapsed = time.perf_counter() - started
+    with _lock:
+        first = name not in IMPORT_TIMES
+        if first:
+            IMPORT_TIMES[name] = elapsed
+    if first:
+        METRICS.observe(f"import_{name}", elapsed)
+    return module
+
+
+# 重いモジュールの読み込みと tasks（(名前, 関数) のリスト）をバックグラウンドで実行する
+# プロセスで最初の1回だけ動く。戻り値は今回開始したかどうか
+def start_warm_up(tasks=(), modules=HEAVY_MODULES):
+    global _warm_up_started
+    with _lock:
+        if _warm_up_started:
+            return False
+        _warm_up_started = True
+
+    def run():
+        with METRICS.timer("warm_up_total"):
+            for name in modules:
+                try:
+                    timed_import(name)
+                except ImportError:
+                    METRICS.increment("warm_up_errors_total")
+            for name, task in tasks:
+                try:
+                    with METRICS.timer(f"warm_up_{name}"):
+                        task()
+                except Exception:  # 準備に失敗しても、使うときに改めて作られる
+                    METRICS.increment("warm_up_errors_total")
+
+    threading.Thread(target=run, name="warm-up", daemon=True).start()
+    return True
+
+
+# サーバ起動前の準備（背景画像の変換、データファイルの確認、モジュールの読み込み時間の計測）
+def main():
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    sys.path.insert(0, base_dir)
+    from background_asset import build_background_url
+    from nutrition import load_nutrition_table
+    from prices import load_price_catalog
+
+    report = {}
+    started = time.perf_counter()
+    # app.py と同じ設定で static/ に書き出しておき、最初のリクエストでは変換しないようにする
+    build_background_url(
+        os.path.join(base_dir, "background.png"),
+        os.environ.get("BG_IMAGE_FORMAT", "WEBP"),
+        int(os.environ.get("BG_IMAGE_QUALITY", "80")),
+        int(os.environ.get("BG_IMAGE_MAX_WIDTH", "1920")),
+    )
+    report["background_seconds"] = round(time.perf_counter() - started, 3)
+
+    started = time.perf_counter()
+    load_price_catalog(os.path.join(base_dir, "data", "prices.csv"))
+    load_nutrition_table(os.path.join(base_dir, "data", "nutrition.csv"))
+    report["data_files_seconds"] = round(time.perf_counter() - started, 3)
+
+    for name in HEAVY_MODULES:
+        try:
+            timed_import(name)
+        except ImportError:
+            pass
+    report["import_seconds"] = {name: round(seconds, 3) for name, seconds in IMPORT_TIMES.items()}
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
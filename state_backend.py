@@ -0,0 +1,450 @@
+import abc
+import os
+import socket
+import sqlite3
+import threading
+import time
+import urllib.parse
+
+from rate_limit import SharedTokenBucket, TokenBucket
+
+
+# バックエンドとの通信・応答のエラー
+class BackendError(Exception):
+    pass
+
+
+# 複数のワーカー（プロセス・サーバ）で共有する状態の置き場所
+# 値は bytes、カウンタは整数。ttl は秒（None なら期限なし）
+class StateBackend(abc.ABC):
+    @abc.abstractmethod
+    def get(self, key):
+        pass
+
+    @abc.abstractmethod
+    def set(self, key, value, ttl=None):
+        pass
+
+    @abc.abstractmethod
+    def delete(self, key):
+        pass
+
+    # 値をまとめて読む（無いものは None）
+    def get_many(self, keys):
+        return [self.get(key) for key in keys]
+
+    # カウンタを増やして増やしたあとの値を返す（キーが無ければ0から。ttl はカウンタの有効期限）
+    @abc.abstractmethod
+    def incr(self, key, amount=1, ttl=None):
+        pass
+
+    # カウンタをまとめて読む（無いものは0）
+    @abc.abstractmethod
+    def counters(self, keys):
+        pass
+
+    # 値を読んで書き換えるまでを、他のワーカーに割り込まれずに行う
+    # func は今の値（無ければ None）を受け取って (新しい値, 戻り値) を返す。他のワーカーと競合したら呼び直すことがある
+    @abc.abstractmethod
+    def update(self, key, func, ttl=None):
+        pass
+
+    # 1分あたりの上限で制限するバケット（reserve / adjust は rate_limit.TokenBucket と同じ使い方）
+    def rate_limiter(self, name, per_minute):
+        return SharedTokenBucket(self, name, per_minute)
+
+    def close(self):
+        pass
+
+
+# プロセス内だけで持つバックエンド（ワーカー1つで動かすとき・開発用）
+class MemoryBackend(StateBackend):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._data = {}  # key -> (value, expires_at)
+
+    def _live(self, key, now):
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        if entry[1] is not None and entry[1] <= now:
+            del self._data[key]
+            return None
+        return entry
+
+    def get(self, key):
+        with self._lock:
+            entry = self._live(key, time.time())
+        return entry[0] if entry else None
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._data[key] = (value, time.time() + ttl if ttl else None)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def incr(self, key, amount=1, ttl=None):
+        now = time.time()
+        with self._lock:
+            entry = self._live(key, now)
+            if entry is None:
+                entry = (0, now + ttl if ttl else None)
+            value = int(entry[0]) + amount
+            self._data[key] = (value, entry[1])
+        return value
+
+    def counters(self, keys):
+        now = time.time()
+        with self._lock:
+            return [int(entry[0]) if entry else 0 for entry in (self._live(key, now) for key in keys)]
+
+    def update(self, key, func, ttl=None):
+        now = time.time()
+        with self._lock:
+            entry = self._live(key, now)
+            value, result = func(entry[0] if entry else None)
+            self._data[key] = (value, now + ttl if ttl else None)
+        return result
+
+    # 共有しないので、もともとのトークンバケットをそのまま使う
+    def rate_limiter(self, name, per_minute):
+        return TokenBucket(per_minute)
+
+
+# SQLiteのファイルで共有するバックエンド（同じサーバ上の複数ワーカー用）
+class SQLiteBackend(StateBackend):
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, timeout=10, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS state ("
+            " key TEXT PRIMARY KEY,"
+            " value BLOB NOT NULL,"
+            " expires_at REAL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_state_expires ON state(expires_at)")
+        self._last_purge = 0.0
+
+    # 期限切れの行はときどきまとめて消す
+    def _purge(self, now):
+        if now - self._last_purge < 60:
+            return
+        self._last_purge = now
+        self._conn.execute("DELETE FROM state WHERE expires_at IS NOT NULL AND expires_at <= ?", (now,))
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM state WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)", (key, time.time())
+            ).fetchone()
+        return row[0] if row else None
+
+    def get_many(self, keys):
+        keys = list(keys)
+        rows = {}
+        with self._lock:
+            # SQLite の変数の数の上限を超えないよう、500件ずつ読む
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                rows.update(self._conn.execute(
+                    f"SELECT key, value FROM state WHERE key IN ({','.join('?' * len(chunk))})"
+                    " AND (expires_at IS NULL OR expires_at > ?)",
+                    chunk + [time.time()],
+                ).fetchall())
+        return [rows.get(key) for key in keys]
+
+    def set(self, key, value, ttl=None):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO state (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, value, now + ttl if ttl else None),
+            )
+            self._purge(now)
+
+    def delete(self, key):
+        with self._lock:
+            self._conn.execute("DELETE FROM state WHERE key = ?", (key,))
+
+    def incr(self, key, amount=1, ttl=None):
+        now = time.time()
+        with self._lock:
+            # 他のプロセスと同時に増やしても数え漏れないよう、書き込みロックを取ってから読む
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute("DELETE FROM state WHERE key = ? AND expires_at <= ?", (key, now))
+                self._conn.execute(
+                    "INSERT INTO state (key, value, expires_at) VALUES (?, ?, ?)"
+                    " ON CONFLICT(key) DO UPDATE SET value = value + excluded.value",
+                    (key, amount, now + ttl if ttl else None),
+                )
+                value = self._conn.execute("SELECT value FROM state WHERE key = ?", (key,)).fetchone()[0]
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._purge(now)
+        return int(value)
+
+    def counters(self, keys):
+        keys = list(keys)
+        with self._lock:
+            rows = dict(self._conn.execute(
+                f"SELECT key, value FROM state WHERE key IN ({','.join('?' * len(keys))})"
+                " AND (expires_at IS NULL OR expires_at > ?)",
+                keys + [time.time()],
+            ).fetchall())
+        return [int(rows.get(key, 0)) for key in keys]
+
+    def update(self, key, func, ttl=None):
+        now = time.time()
+        with self._lock:
+            # 書き込みロックを取ってから読むので、他のプロセスが間に書き込むことはない
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT value FROM state WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)", (key, now)
+                ).fetchone()
+                value, result = func(row[0] if row else None)
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO state (key, value, expires_at) VALUES (?, ?, ?)",
+                    (key, value, now + ttl if ttl else None),
+                )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return result
+
+    def close(self):
+        self._conn.close()
+
+
+# Redis（RESP2 プロトコル）のバックエンド（複数サーバで共有するとき）
+# redis-py を使わず、必要なコマンドだけを送る
+class RedisBackend(StateBackend):
+    def __init__(self, host="127.0.0.1", port=6379, db=0, password=None, prefix="cooking:", timeout=5.0):
+        self.host = host
+        self.port = port
+        self.db = db
+        self.password = password
+        self.prefix = prefix
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._sock = None
+        self._reader = None
+
+    def _connect(self):
+        self._sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._reader = self._sock.makefile("rb")
+        if self.password:
+            self._send([("AUTH", self.password)])
+        if self.db:
+            self._send([("SELECT", self.db)])
+
+    def _disconnect(self):
+        if self._sock is not None:
+            try:
+                self._reader.close()
+                self._sock.close()
+            except OSError:
+                pass
+        self._sock = self._reader = None
+
+    @staticmethod
+    def _encode(args):
+        parts = [b"*%d\r\n" % len(args)]
+        for arg in args:
+            if isinstance(arg, bytes):
+                data = arg
+            elif isinstance(arg, str):
+                data = arg.encode("utf-8")
+            else:
+                data = str(arg).encode("ascii")
+            parts.append(b"$%d\r\n%s\r\n" % (len(data), data))
+        return b"".join(parts)
+
+    def _read(self):
+        line = self._reader.readline()
+        if not line.endswith(b"\r\n"):
+            raise ConnectionError("Redis の接続が切れました")
+        kind, body = line[:1], line[1:-2]
+        if kind == b"+":
+            return body.decode("utf-8")
+        if kind == b"-":
+            return BackendError(body.decode("utf-8", "replace"))
+        if kind == b":":
+            return int(body)
+        if kind == b"$":
+            length = int(body)
+            if length < 0:
+                return None
+            data = self._reader.read(length + 2)
+            return data[:-2]
+        if kind == b"*":
+            length = int(body)
+            return None if length < 0 else [self._read() for _ in range(length)]
+        raise BackendError(f"Redis の応答を読めません: {line!r}")
+
+    # コマンドをまとめて送り、同じ数の応答を読む（パイプライン）
+    def _send(self, commands):
+        self._sock.sendall(b"".join(self._encode(command) for command in commands))
+        replies = [self._read() for _ in commands]
+        for reply in replies:
+            if isinstance(reply, BackendError):
+                raise reply
+        return replies
+
+    def _execute(self, *commands):
+        with self._lock:
+            return self._execute_locked(commands)
+
+    # 接続が切れていたら、reconnect なら1回だけつなぎ直す（self._lock を持って呼ぶ）
+    def _execute_locked(self, commands, reconnect=True):
+        for attempt in range(2 if reconnect else 1):
+            try:
+                if self._sock is None:
+                    self._connect()
+                return self._send(commands)
+            except (OSError, ConnectionError) as e:
+                self._disconnect()
+                if attempt or not reconnect:
+                    raise BackendError(f"Redis に接続できません（{self.host}:{self.port}）: {e}") from e
+
+    def get(self, key):
+        return self._execute(("GET", self.prefix + key))[0]
+
+    def get_many(self, keys):
+        keys = list(keys)
+        values = []
+        for start in range(0, len(keys), 500):
+            values += self._execute(("MGET", *(self.prefix + key for key in keys[start:start + 500])))[0]
+        return values
+
+    def set(self, key, value, ttl=None):
+        if ttl:
+            self._execute(("SET", self.prefix + key, value, "PX", int(ttl * 1000)))
+        else:
+            self._execute(("SET", self.prefix + key, value))
+
+    def delete(self, key):
+        self._execute(("DEL", self.prefix + key))
+
+    def incr(self, key, amount=1, ttl=None):
+        if not ttl:
+            return self._execute(("INCRBY", self.prefix + key, amount))[0]
+        value, _ = self._execute(("INCRBY", self.prefix + key, amount), ("PEXPIRE", self.prefix + key, int(ttl * 1000)))
+        return value
+
+    def counters(self, keys):
+        keys = list(keys)
+        if not keys:
+            return []
+        values = self._execute(("MGET", *(self.prefix + key for key in keys)))[0]
+        return [int(value) if value is not None else 0 for value in values]
+
+    # WATCH したキーを他の接続が書き換えていたら EXEC が空振りするので、読み直してやり直す
+    # （WATCH は接続ごとなので、EXEC までロックを持ったままにする。途中で切れたらつなぎ直さずにエラーにする）
+    def update(self, key, func, ttl=None):
+        key = self.prefix + key
+        with self._lock:
+            while True:
+                value = self._execute_locked([("WATCH", key), ("GET", key)])[1]
+                value, result = func(value)
+                command = ("SET", key, value, "PX", int(ttl * 1000)) if ttl else ("SET", key, value)
+                if self._execute_locked([("MULTI",), command, ("EXEC",)], reconnect=False)[-1] is not None:
+                    return result
+
+    def close(self):
+        with self._lock:
+            self._disconnect()
+
+
+# バックエンド上の追記専用のログ（キーの一覧を取れないバックエンドでも使えるよう、通し番号で管理する）
+# 各ワーカーは append で書き、read_new で前回の続きから読んで、自分の持っている複製（検索用の索引など）に反映する
+# max_entries を指定すると古いエントリから消す（後から起動したワーカーは残っている分だけ読む）
+class SharedLog:
+    def __init__(self, backend, name, max_entries=None, missing_grace=10.0):
+        self.backend = backend
+        self.name = name
+        self.max_entries = max_entries
+        # 番号を取ってから書き込むまでの間に読んだエントリは、この秒数まで読み直す
+        self.missing_grace = missing_grace
+        self._position = 0
+        self._missing = {}  # 番号 -> 最初に見つからなかった時刻
+        self._lock = threading.Lock()
+
+    def _key(self, seq):
+        return f"log:{self.name}:{seq}"
+
+    # 追記して番号を返す
+    def append(self, value):
+        seq = self.backend.incr(f"log:{self.name}:seq")
+        self.backend.set(self._key(seq), value)
+        if self.max_entries and seq > self.max_entries:
+            self.backend.delete(self._key(seq - self.max_entries))
+        return seq
+
+    # 最後に追記されたエントリの番号
+    def latest(self):
+        return self.backend.counters([f"log:{self.name}:seq"])[0]
+
+    # first から last までのエントリを番号順に返す（戻り値: (番号, 値) のリスト。書き込み前・消されたものは値が None）
+    # 読んだ位置を呼び出し側で持つとき（read_new の代わり）に使う
+    def read_range(self, first, last):
+        seqs = list(range(max(first, 1), last + 1))
+        if not seqs:
+            return []
+        return list(zip(seqs, self.backend.get_many(self._key(seq) for seq in seqs)))
+
+    # 前回読んだ後に追記されたエントリを番号順に返す（戻り値: (番号, 値) のリスト）
+    def read_new(self):
+        with self._lock:
+            latest = self.backend.counters([f"log:{self.name}:seq"])[0]
+            if latest < self._position:
+                # バックエンドが空になった（作り直された）ので最初から読む
+                self._position = 0
+                self._missing.clear()
+            start = self._position + 1
+            if self.max_entries:
+                start = max(start, latest - self.max_entries + 1)
+            seqs = sorted(self._missing) + list(range(start, latest + 1))
+            if not seqs:
+                return []
+            now = time.monotonic()
+            entries = []
+            for seq, value in zip(seqs, self.backend.get_many(self._key(seq) for seq in seqs)):
+                if value is not None:
+                    self._missing.pop(seq, None)
+                    entries.append((seq, value))
+                elif now - self._missing.setdefault(seq, now) > self.missing_grace:
+                    # 書き込む前に止まったワーカーの番号・消された古いエントリは諦める
+                    del self._missing[seq]
+            self._position = latest
+            return sorted(entries)
+
+
+# 設定の文字列からバックエンドを作る
+#   memory                       プロセス内
+#   sqlite:///path/to/state.db   SQLiteファイル（同じサーバの複数ワーカー）
+#   redis://[:password@]host:port/db   Redis または Redis 互換のサーバ
+def open_backend(url):
+    if not url or url == "memory":
+        return MemoryBackend()
+    parsed = urllib.parse.urlsplit(url)
+    if parsed.scheme == "sqlite":
+        path = parsed.netloc + parsed.path
+        # sqlite:///C:/... のような Windows のパス
+        if len(path) > 2 and path[0] == "/" and path[2] == ":":
+            path = path[1:]
+        return SQLiteBackend(path)
+    if parsed.scheme == "redis":
+        db = int(parsed.path.strip("/") or 0)
+        return RedisBackend(parsed.hostname or "127.0.0.1", parsed.port or 6379, db, parsed.password)
+    raise ValueError(f"対応していない STATE_BACKEND です: {url}")
@@ -0,0 +1,69 @@
+import html
+import importlib.util
+import io
+
+from startup import timed_import
+
+
+# 列ごとにリストで持つ小さな表
+# columns: (見出し, 書式) のリスト。書式は "{:,.0f}" のような format 文字列で、行を追加したときに1回だけ整形する
+# 元の値も残しておき、CSV/Excel の書き出しに使う
+# 見た目は theme.py のスタイルシート（.lean-table）で付ける
+class Table:
+    def __init__(self, columns):
+        self.headers = tuple(header for header, _ in columns)
+        self.formats = tuple(fmt for _, fmt in columns)
+        self.values = [[] for _ in columns]
+        self.texts = [[] for _ in columns]
+
+    def add_row(self, *row):
+        for values, texts, fmt, value in zip(self.values, self.texts, self.formats, row):
+            values.append(value)
+            texts.append("" if value is None else fmt.format(value))
+
+    def __len__(self):
+        return len(self.values[0]) if self.values else 0
+
+    # 数値の列は右寄せにする
+    def _numeric_columns(self):
+        return [
+            bool(values) and all(isinstance(value, (int, float)) and not isinstance(value, bool) for value in values)
+            for values in self.values
+        ]
+
+    def to_html(self):
+        numeric = self._numeric_columns()
+        parts = ['<table class="lean-table"><thead><tr>']
+        parts += [f"<th>{html.escape(header)}</th>" for header in self.headers]
+        parts.append("</tr></thead><tbody>")
+        for row in zip(*self.texts):
+            parts.append("<tr>")
+            parts += [
+                f'<td class="num">{html.escape(text)}</td>' if is_numeric else f"<td>{html.escape(text)}</td>"
+                for text, is_numeric in zip(row, numeric)
+            ]
+            parts.append("</tr>")
+        parts.append("</tbody></table>")
+        return "".join(parts)
+
+
+# ここから下は書き出し用（pandas はダウンロードするときだけ読み込む）
+
+def _data_frame(table, headers=None):
+    pd = timed_import("pandas")
+    return pd.DataFrame(dict(zip(headers or table.headers, table.values)))
+
+
+# Excelで文字化けしないよう BOM 付きの UTF-8 にする
+def to_csv_bytes(table, headers=None):
+    return _data_frame(table, headers).to_csv(index=False).encode("utf-8-sig")
+
+
+def excel_available():
+    return importlib.util.find_spec("openpyxl") is not None
+
+
+def to_excel_bytes(table, headers=None, sheet_name="Sheet1"):
+    buf = io.BytesIO()
+    _data_frame(table, headers).to_excel(buf, index=False, sheet_name=sheet_name)
+    return buf.getvalue()
@@ -0,0 +1,51 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from favorites_store import SharedFavoritesStore, recipe_id  # noqa: E402
+from state_backend import MemoryBackend  # noqa: E402
+
+
+def make_store(tmp_path, backend, name="favorites.sqlite3", **kwargs):
+    return SharedFavoritesStore(str(tmp_path / name), backend, sync_interval=0, **kwargs)
+
+
+def answer(number):
+    return f"メニュー: 料理{number}\n作り方{number}"
+
+
+def test_changes_reach_other_workers(tmp_path):
+    backend = MemoryBackend()
+    first = make_store(tmp_path, backend, "first.sqlite3")
+    second = make_store(tmp_path, backend, "second.sqlite3")
+    favorite_id = first.save("質問", answer(1), [], 4)
+    assert second.get(favorite_id).rating == 4
+    second.set_rating(favorite_id, 2)
+    assert first.get(favorite_id).rating == 2
+    first.remove(favorite_id)
+    assert not second.is_favorite(favorite_id)
+
+
+def test_workers_sharing_a_file_apply_each_change_once(tmp_path):
+    backend = MemoryBackend()
+    first = make_store(tmp_path, backend)
+    second = make_store(tmp_path, backend)
+    favorite_id = first.save("質問", answer(1), [], 4)
+    first.remove(favorite_id)
+    # 同じファイルを使うもう一方のワーカーが古い登録をもう一度反映して、解除を打ち消さない
+    assert not second.is_favorite(favorite_id)
+    assert second.count() == 0
+
+
+def test_log_is_trimmed_and_new_workers_start_from_snapshot(tmp_path):
+    backend = MemoryBackend()
+    first = make_store(tmp_path, backend, "first.sqlite3", max_log_entries=10, snapshot_every=5)
+    for number in range(30):
+        first.save("質問", answer(number), [], 3)
+    first.remove(recipe_id(answer(0)))
+    assert backend.get("log:favorites:1") is None
+    late = make_store(tmp_path, backend, "late.sqlite3", max_log_entries=10, snapshot_every=5)
+    assert late.count() == 29
+    assert not late.is_favorite(recipe_id(answer(0)))
+    assert late.is_favorite(recipe_id(answer(29)))
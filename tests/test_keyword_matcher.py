@@ -0,0 +1,27 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from keyword_matcher import KeywordMatcher  # noqa: E402
+
+
+def make_matcher():
+    return KeywordMatcher({"豚肉": 1, "豚ひき肉": 2, "万能ねぎ": 3, "長ねぎ": 4, "鶏もも": 5}, default_value=0)
+
+
+def test_longest_contained_key_wins():
+    matcher = make_matcher()
+    assert matcher.match_all(["豚ひき肉 200g", "鶏もも肉 300g"]) == [("豚ひき肉", 2), ("鶏もも", 5)]
+
+
+def test_short_name_matches_key_that_contains_it():
+    matcher = make_matcher()
+    # 材料名がキーより短いとき（「ねぎ」「もも」）は、それを含む一番短いキーを使う
+    assert matcher.match("ねぎ 1本") == ("長ねぎ", 4)
+    assert matcher.match("もも") == ("鶏もも", 5)
+
+
+def test_unknown_ingredient_uses_default():
+    matcher = make_matcher()
+    assert matcher.match_all(["ご飯 2杯", ""]) == [("その他", 0), ("その他", 0)]
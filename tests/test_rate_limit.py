@@ -0,0 +1,73 @@
+import os
+import sys
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from rate_limit import SharedTokenBucket, TokenBucket  # noqa: E402
+from state_backend import MemoryBackend, SQLiteBackend  # noqa: E402
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def backend(request, tmp_path):
+    if request.param == "memory":
+        backend = MemoryBackend()
+    else:
+        backend = SQLiteBackend(str(tmp_path / "state.sqlite3"))
+    yield backend
+    backend.close()
+
+
+def test_token_bucket_waits_for_one_refill():
+    bucket = TokenBucket(10)
+    waits = [bucket.reserve(1) for _ in range(11)]
+    assert waits[:10] == [0.0] * 10
+    assert waits[10] == pytest.approx(6.0, abs=0.1)
+
+
+def test_shared_bucket_refills_like_token_bucket(backend):
+    bucket = SharedTokenBucket(backend, "requests", 10)
+    waits = [bucket.reserve(1) for _ in range(11)]
+    assert waits[:10] == [0.0] * 10
+    # 1分の窓が空くのを待つのではなく、1件分の補充（6秒）だけ待つ
+    assert waits[10] == pytest.approx(6.0, abs=0.1)
+
+
+def test_shared_bucket_adjust_returns_tokens(backend):
+    bucket = SharedTokenBucket(backend, "tokens", 600)
+    assert bucket.reserve(600) == 0.0
+    bucket.adjust(300)
+    assert bucket.reserve(300) == pytest.approx(0.0, abs=0.1)
+    assert bucket.reserve(10) == pytest.approx(1.0, abs=0.1)
+
+
+def test_shared_bucket_is_shared_between_workers(backend):
+    first = SharedTokenBucket(backend, "requests", 10)
+    second = SharedTokenBucket(backend, "requests", 10)
+    for _ in range(10):
+        first.reserve(1)
+    assert second.reserve(1) == pytest.approx(6.0, abs=0.1)
+
+
+def test_update_does_not_lose_concurrent_writes(tmp_path):
+    path = str(tmp_path / "state.sqlite3")
+    backends = [SQLiteBackend(path) for _ in range(4)]
+
+    def increment(value):
+        count = int(value or 0) + 1
+        return str(count).encode("ascii"), count
+
+    def work(backend):
+        for _ in range(50):
+            backend.update("count", increment)
+
+    threads = [threading.Thread(target=work, args=(backend,)) for backend in backends]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert backends[0].get("count") == b"200"
+    for backend in backends:
+        backend.close()
@@ -0,0 +1,34 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from recipe_corpus import RecipeCorpus  # noqa: E402
+
+
+def answer(dish, grams):
+    return f"【{dish}】\n材料（2人分）\n- 鶏もも肉 {grams}g\n- 卵 2個"
+
+
+def dish_names(corpus):
+    return {row[0] for row in corpus._conn.execute("SELECT dish_name FROM recipes")}
+
+
+def test_oldest_answers_are_evicted_over_the_limit(tmp_path):
+    corpus = RecipeCorpus(str(tmp_path / "recipes.sqlite3"), max_entries=3)
+    for number in range(5):
+        corpus.add(answer(f"料理{number}", 100 + number), question=f"料理{number}")
+    assert corpus.count() == 3
+    assert dish_names(corpus) == {"料理2", "料理3", "料理4"}
+    # 転置インデックスの行も一緒に消える
+    assert corpus._conn.execute("SELECT COUNT(*) FROM recipes_fts").fetchone()[0] == 3
+
+
+def test_served_recipes_and_imports_are_kept(tmp_path):
+    corpus = RecipeCorpus(str(tmp_path / "recipes.sqlite3"), max_entries=3)
+    corpus.add(answer("取り込み", 50), question="取り込み", source="import")
+    corpus.add(answer("料理0", 100), question="料理0")
+    corpus.add(answer("料理1", 101), question="料理1")
+    assert corpus.find_dish("料理0") is not None
+    corpus.add(answer("料理2", 102), question="料理2")
+    assert dish_names(corpus) == {"取り込み", "料理0", "料理2"}
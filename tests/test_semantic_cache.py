@@ -0,0 +1,100 @@
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from semantic_cache import SemanticCache, extra_chars, make_bucket  # noqa: E402
+from state_backend import MemoryBackend  # noqa: E402
+
+BUCKET = make_bucket(2, "普通", 600)
+
+
+def make_cache(tmp_path, **kwargs):
+    return SemanticCache(str(tmp_path / "semantic_index.npz"), threshold=0.85, **kwargs)
+
+
+def test_same_dish_with_different_wording_hits(tmp_path):
+    cache = make_cache(tmp_path)
+    cache.add("親子丼の作り方", BUCKET, "親子丼の回答")
+    hit = cache.lookup("簡単な親子丼を教えて", BUCKET)
+    assert hit is not None
+    assert hit[0] == "親子丼の回答"
+
+
+def test_modifier_does_not_match_plain_dish(tmp_path):
+    cache = make_cache(tmp_path)
+    cache.add("親子丼", BUCKET, "親子丼の回答")
+    cache.add("カレー", BUCKET, "カレーの回答")
+    assert cache.lookup("親子丼 辛口", BUCKET) is None
+    assert cache.lookup("カレー 甘口", BUCKET) is None
+    assert cache.lookup("和風カレー", BUCKET) is None
+
+
+def test_plain_dish_does_not_match_modified_answer(tmp_path):
+    cache = make_cache(tmp_path)
+    cache.add("カレー 甘口", BUCKET, "甘口カレーの回答")
+    assert cache.lookup("カレー", BUCKET) is None
+    assert cache.lookup("カレー 甘口を教えて", BUCKET)[0] == "甘口カレーの回答"
+
+
+def test_modifier_prefers_matching_entry(tmp_path):
+    cache = make_cache(tmp_path)
+    cache.add("親子丼", BUCKET, "親子丼の回答")
+    cache.add("親子丼 辛口", BUCKET, "辛口の回答")
+    assert cache.lookup("親子丼 辛口の作り方", BUCKET)[0] == "辛口の回答"
+    assert cache.lookup("親子丼の作り方", BUCKET)[0] == "親子丼の回答"
+
+
+def test_fallback_lookup_allows_modifiers(tmp_path):
+    cache = make_cache(tmp_path)
+    cache.add("親子丼", BUCKET, "親子丼の回答")
+    assert cache.lookup("親子丼 辛口", BUCKET, threshold=0.6, strict=False)[0] == "親子丼の回答"
+
+
+def test_different_bucket_misses(tmp_path):
+    cache = make_cache(tmp_path)
+    cache.add("親子丼", BUCKET, "親子丼の回答")
+    assert cache.lookup("親子丼", make_bucket(2, "難しい", 600)) is None
+    assert cache.lookup("親子丼", make_bucket(2, "普通", 600, ("dessert",))) is None
+
+
+def test_extra_chars_ignores_filler():
+    assert extra_chars("親子丼の作り方", "親子丼を教えてください") == 0
+    assert extra_chars("親子丼 辛口", "親子丼") == 2
+
+
+def test_grows_and_evicts_oldest(tmp_path):
+    cache = make_cache(tmp_path, max_entries=20, initial_capacity=4)
+    for i in range(25):
+        cache.add(f"料理{i:02d}番", BUCKET, f"回答{i}")
+    assert len(cache) <= 20
+    assert cache.lookup("料理24番", BUCKET)[0] == "回答24"
+    assert cache.lookup("料理00番", BUCKET) is None
+
+
+def test_flush_persists_in_batch(tmp_path):
+    cache = make_cache(tmp_path, flush_delay=60)
+    cache.add("親子丼", BUCKET, "親子丼の回答")
+    cache.add("カレー", BUCKET, "カレーの回答")
+    # 保存は予約されるだけで、追加のたびには書き出さない
+    assert not os.path.exists(cache.path)
+    cache.flush()
+    with np.load(cache.path, allow_pickle=False) as data:
+        assert data["vectors"].shape == (2, cache.dim)
+    reloaded = make_cache(tmp_path)
+    assert reloaded.lookup("親子丼の作り方", BUCKET)[0] == "親子丼の回答"
+
+
+def test_workers_share_index_through_backend(tmp_path):
+    backend = MemoryBackend()
+    first = make_cache(tmp_path, backend=backend)
+    second = make_cache(tmp_path, backend=backend)
+    first.add("親子丼", BUCKET, "親子丼の回答")
+    second.add("カレー", BUCKET, "カレーの回答")
+    assert second.lookup("親子丼の作り方", BUCKET)[0] == "親子丼の回答"
+    assert first.lookup("カレーの作り方", BUCKET)[0] == "カレーの回答"
+    # バックエンドを使うときは索引のファイルを書かない
+    first.flush()
+    assert not os.path.exists(first.path)
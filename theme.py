@@ -0,0 +1,133 @@
+import html
+import re
+
+
+# アプリ全体の見た目（読みやすいように書いておき、送るときに縮める）
+# 背景画像のURLだけは実行時に決まるので、build_stylesheet で先頭に足す
+THEME_CSS = """
+/* 見出し・文字に白い背景を付けて背景画像の上でも読めるようにする */
+.stApp h1, .stApp h2, .stApp h3, .stApp h4, .stApp h5, .stApp h6, .stApp p, .stApp label, .stApp span {
+    color: #1a237e !important;
+    background: #fff !important;
+    border-radius: 8px;
+    padding: 0.2em 0.5em;
+    display: inline-block;
+}
+/* st.markdownで出力される材料リストなどにも背景色を適用 */
+.stApp ul, .stApp ol, .stApp li, .stApp pre, .stApp code {
+    background: #fff !important;
+    color: #1a237e !important;
+    border-radius: 8px;
+    padding: 0.2em 0.5em;
+    display: inline-block;
+}
+/* selectbox・text input・radio の親divに枠線を付ける */
+div[data-testid="stSelectbox"], div[data-testid="stTextInput"], div[data-testid="stRadio"] {
+    border: 2px solid #1976d2;
+    border-radius: 8px;
+    padding: 8px 4px;
+    background: #fff;
+    margin-bottom: 8px;
+}
+/* 横幅を広げつつ、左右に適度な余白を作る */
+.block-container {
+    max-width: 90vw !important;
+    width: 90vw !important;
+    padding-left: 5vw !important;
+    padding-right: 5vw !important;
+}
+.stApp {
+    padding: 0 !important;
+    margin: 0 !important;
+}
+/* 材料費・カロリーなどの表（table_render.Table） */
+.lean-table {
+    border-collapse: collapse;
+    width: 100%;
+    background: #fff;
+    font-size: 0.9rem;
+}
+.lean-table th, .lean-table td {
+    padding: 4px 8px;
+    border-bottom: 1px solid #e0e0e0;
+    text-align: left;
+}
+.lean-table th {
+    background: #e3f2fd;
+    color: #1a237e;
+}
+.lean-table td.num {
+    text-align: right;
+    font-variant-numeric: tabular-nums;
+}
+/* リンクのボタン（Gmailで送るなど） */
+.theme-button {
+    display: inline-block;
+    padding: 8px 16px;
+    font-size: 16px;
+    background: #1976d2;
+    color: #fff !important;
+    border: none;
+    border-radius: 6px;
+    text-decoration: none;
+    font-weight: bold;
+    margin-top: 24px;
+}
+/* 合計金額・合計カロリーのカード（色は --tone で切り替える） */
+.theme-card {
+    --tone: #1976d2;
+    --tone-bg: #f0f8ff;
+    background-color: var(--tone-bg);
+    border: 2px solid var(--tone);
+    border-radius: 10px;
+    padding: 20px;
+    text-align: center;
+    margin: 20px 0;
+}
+.theme-card-calorie {
+    --tone: #ff9800;
+    --tone-bg: #fff3e0;
+}
+.stApp .theme-card h3 {
+    color: var(--tone) !important;
+    margin: 0;
+}
+.stApp .theme-card p {
+    color: #666 !important;
+    margin: 10px 0;
+}
+"""
+
+
+# コメント・改行・余分な空白を取り除く
+def minify_css(css):
+    css = re.sub(r"/\*.*?\*/", "", css, flags=re.DOTALL)
+    css = re.sub(r"\s+", " ", css)
+    css = re.sub(r"\s*([{}:;,>])\s*", r"\1", css)
+    return css.replace(";}", "}").strip()
+
+
+# 1つの <style> にまとめたスタイルシート（プロセスごとに1回作って使い回す）
+def build_stylesheet(bg_url):
+    background = (
+        f".stApp{{background-image:url('{bg_url}');background-size:cover;"
+        "background-repeat:no-repeat;background-attachment:fixed}"
+    )
+    return f"<style>{background}{minify_css(THEME_CSS)}</style>"
+
+
+# ここから下は部品のテンプレート（見た目はスタイルシートのクラスで付ける）
+
+def link_button(url, label):
+    return (
+        f'<a class="theme-button" href="{html.escape(url)}" target="_blank" rel="noopener">'
+        f"{html.escape(label)}</a>"
+    )
+
+
+# tone: "cost"（青）または "calorie"（オレンジ）
+def summary_card(title, note, tone="cost"):
+    return (
+        f'<div class="theme-card theme-card-{tone}">'
+        f"<h3>{html.escape(title)}</h3><p>{html.escape(note)}</p></div>"
+    )
@@ -0,0 +1,61 @@
+import time
+from collections import namedtuple
+
+
+# 1回のリクエストで使ったトークン数と概算費用（estimated: usage が返らず文字数から見積もった）
+UsageRecord = namedtuple("UsageRecord", ["mode", "prompt_tokens", "completion_tokens", "cost_yen", "estimated"])
+
+# 日ごとに数える項目（費用は整数のカウンタで足せるように 1/1000000 円単位で持つ）
+USAGE_FIELDS = ("requests", "prompt_tokens", "completion_tokens", "cost_microyen")
+
+
+# AIの利用量（トークン数・概算費用）をモードごと・日ごとに集計する
+# カウンタは state_backend の incr で足すので、共有バックエンドなら全ワーカーの合計になる
+class UsageLedger:
+    def __init__(self, backend, modes, yen_per_1m_prompt, yen_per_1m_completion, retention_days=90):
+        self.backend = backend
+        self.modes = tuple(modes)
+        self.yen_per_1m_prompt = yen_per_1m_prompt
+        self.yen_per_1m_completion = yen_per_1m_completion
+        self.retention_seconds = retention_days * 86400
+
+    @staticmethod
+    def _key(day, mode, field):
+        return f"usage:{day}:{mode}:{field}"
+
+    def cost_yen(self, prompt_tokens, completion_tokens):
+        return (prompt_tokens * self.yen_per_1m_prompt + completion_tokens * self.yen_per_1m_completion) / 1e6
+
+    # response.usage（無ければ見積もりのトークン数）を記録し、その1回分を返す
+    def record(self, mode, usage=None, estimated_prompt_tokens=0, estimated_completion_tokens=0):
+        prompt_tokens = getattr(usage, "prompt_tokens", None) if usage is not None else None
+        completion_tokens = getattr(usage, "completion_tokens", None) if usage is not None else None
+        estimated = prompt_tokens is None or completion_tokens is None
+        if estimated:
+            prompt_tokens, completion_tokens = estimated_prompt_tokens, estimated_completion_tokens
+        cost = self.cost_yen(prompt_tokens, completion_tokens)
+        day = time.strftime("%Y-%m-%d")
+        for field, value in zip(USAGE_FIELDS, (1, prompt_tokens, completion_tokens, int(round(cost * 1e6)))):
+            self.backend.incr(self._key(day, mode, field), value, ttl=self.retention_seconds)
+        return UsageRecord(mode, prompt_tokens, completion_tokens, cost, estimated)
+
+    # ある日のモードごとの集計（{mode: {"requests", "prompt_tokens", "completion_tokens", "cost_yen"}}）
+    def daily(self, day=None):
+        day = day or time.strftime("%Y-%m-%d")
+        values = self.backend.counters(self._key(day, mode, field) for mode in self.modes for field in USAGE_FIELDS)
+        totals = {}
+        for i, mode in enumerate(self.modes):
+            requests, prompt_tokens, completion_tokens, cost_microyen = values[i * len(USAGE_FIELDS):(i + 1) * len(USAGE_FIELDS)]
+            totals[mode] = {
+                "requests": requests,
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "cost_yen": cost_microyen / 1e6,
+            }
+        return totals
+
+    # 直近 count 日分（新しい日から）の (日付, モードごとの集計)
+    def recent_days(self, count=7):
+        now = time.time()
+        days = [time.strftime("%Y-%m-%d", time.localtime(now - i * 86400)) for i in range(count)]
+        return [(day, self.daily(day)) for day in days]